@@ -6,31 +6,95 @@ import re
 # In the meanwhile, if the input consists of multiple sequences the program will still run if one sequence
 # raise an error.
 #
+# The parse_* functions read the output of the tools as a list of lines (e.g. the
+# standard output), the read* functions read it from a file.
+#
 
 
-def readhmmscan(file):
+def parse_hmmscan(lines):
     """parse the hmmscan output"""
 
     evalue = 1
+    for line in lines:
+        if not line.startswith("#"):
+            split = line.split()
+            evalue = float(split[6])
+
+    return evalue
+
+
+def readhmmscan(file):
+    """parse the hmmscan output file"""
 
     # Check if file exists
     if not os.path.isfile(file):
-        return evalue
-
-    else:
-        domains = 0
-        handle = open(file, "r")
-        for line in handle:
-            if not line.startswith("#"):
-                domains = domains + 1
-                split = line.split()
-                evalue = float(split[6])
-
-        handle.close()
-    return evalue
+        return 1
 
+    with open(file, "r") as handle:
+        return parse_hmmscan(handle)
 
-def read_align(file):
+
+def parse_hmmscan_models(lines, models):
+    """parse the hmmscan --domtblout output of a scan against several models
+
+    models = names of the models in the database
+    Returns a dictionary with the model name as key and the full sequence E-value as value
+    """
+
+    evalues = {model: 1 for model in models}
+    for line in lines:
+        if not line.startswith("#"):
+            split = line.split()
+            if split[0] in evalues:
+                evalues[split[0]] = float(split[6])
+
+    return evalues
+
+
+def readhmmscan_models(file, models):
+    """parse the hmmscan --domtblout output file of a scan against several models"""
+
+    # Check if file exists
+    if not os.path.isfile(file):
+        return {model: 1 for model in models}
+
+    with open(file, "r") as handle:
+        return parse_hmmscan_models(handle, models)
+
+
+def parse_hmmscan_queries(lines, models):
+    """parse the hmmscan --domtblout output of a scan of many sequences
+
+    models = names of the models in the database
+    Returns a dictionary with the query name as key and as value a dictionary with the
+    model name as key and (full sequence E-value, number of domains) as value
+    """
+
+    hits = {}
+    models = set(models)
+    for line in lines:
+        if not line.startswith("#"):
+            split = line.split()
+            if split[0] in models:
+                query_hits = hits.setdefault(split[3], {})
+                # one line per domain, the E-value is the same for all of them
+                query_hits[split[0]] = (float(split[6]), int(split[10]))
+
+    return hits
+
+
+def readhmmscan_queries(file, models):
+    """parse the hmmscan --domtblout output file of a scan of many sequences"""
+
+    # Check if file exists
+    if not os.path.isfile(file):
+        return {}
+
+    with open(file, "r") as handle:
+        return parse_hmmscan_queries(handle, models)
+
+
+def parse_align(lines):
     """parse the hmmalign output
     4fp8_J         EVQLQESGGGLVQPGESLRLSCVGSGSSFGESTlsY----YAVSWVRQAPGKGLEWLSIINA-------GGGDIDYADSVEGRFTISR...
     #=GR 4fp8_J PP 8**************************997765445....**********************.......*******************...
@@ -39,31 +103,83 @@ def read_align(file):
     """
     aligned = ""
 
+    for line in lines:
+
+        # Extract aligned sequence
+        if (
+            not line.startswith("#")
+            and not line.startswith("\n")
+            and not line.startswith("//")
+        ):
+            split = line.split()
+            aligned = aligned + split[1]
+
+        # Check if alignment failed'''
+        elif re.match("\#\=GC RF", line):
+            split = line.split()
+            if re.search(
+                "\.", split[2]
+            ):  # Correct alignments do not present any dot in the GC RF line
+                aligned = ""
+                break
+
+    return aligned
+
+
+def read_align(file):
+    """parse the hmmalign output file"""
+
     if not os.path.isfile(file):  # Check if file exists
-        return aligned
-    else:
-        handle = open(file, "r")
-
-        for line in handle:
-
-            # Extract aligned sequence
-            if (
-                not line.startswith("#")
-                and not line.startswith("\n")
-                and not line.startswith("//")
-            ):
-                split = line.split()
-                aligned = aligned + split[1]
-
-            # Check if alignment failed'''
-            elif re.match("\#\=GC RF", line):
-                split = line.split()
-                if re.search(
-                    "\.", split[2]
-                ):  # Correct alignments do not present any dot in the GC RF line
-                    aligned = ""
-                    break
-
-        handle.close()
+        return ""
+
+    with open(file, "r") as handle:
+        return parse_align(handle)
+
+
+def parse_align_multi(lines):
+    """parse the hmmalign output of many sequences
+
+    Returns a dictionary with the sequence name as key and the aligned sequence as value.
+    The aligned sequence is empty if the alignment of that sequence failed, that is
+    if it has residues in the insert columns ('.' in the #=GC RF line).
+    """
+    aligned = {}
+
+    # The alignment can be split in blocks, which are joined back
+    blocks = {}
+    reference = []
+    for line in lines:
+
+        # Extract aligned sequence
+        if not line.startswith("#") and line.strip() and not line.startswith("//"):
+            split = line.split()
+            blocks.setdefault(split[0], []).append(split[1])
+
+        elif line.startswith("#=GC RF"):
+            split = line.split()
+            reference.append(split[2])
+
+    reference = "".join(reference)
+    match_columns = [num for num, col in enumerate(reference) if col != "."]
+    insert_columns = [num for num, col in enumerate(reference) if col == "."]
+
+    for name, block in blocks.items():
+        row = "".join(block)
+
+        # Correct alignments do not present any residue in the insert columns
+        if any(row[num] != "." for num in insert_columns):
+            aligned[name] = ""
+        else:
+            aligned[name] = "".join(row[num] for num in match_columns)
 
     return aligned
+
+
+def read_align_multi(file):
+    """parse the hmmalign output file of many sequences"""
+
+    if not os.path.isfile(file):  # Check if file exists
+        return {}
+
+    with open(file, "r") as handle:
+        return parse_align_multi(handle)
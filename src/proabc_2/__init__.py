@@ -1,22 +1,42 @@
 import os
 
-HMMER_PATH = os.environ.get("HMMER_PATH")
-IGBLAST_PATH = os.environ.get("IGBLAST_PATH")
-IGDATA = os.environ.get("IGDATA")
+# Names of the library API (see api.py), imported on first use so that importing
+# the package stays fast
+API_NAMES = [
+    "predict_pairs",
+    "PredictionError",
+    "InvalidSequenceError",
+    "ChainError",
+    "AlignmentError",
+    "GermlineError",
+    "ToolError",
+]
 
 HELP_MSG = "Check the installation instructions of THIRD-PARTY dependencies at `https://github.com/haddocking/proabc-2`"
 
-if HMMER_PATH is None:
-    _msg = "Please set the HMMER_PATH environment variable" + os.linesep + HELP_MSG
-    print(_msg)
-    exit(1)
 
-if IGBLAST_PATH is None:
-    _msg = "Please set the IGBLAST_PATH environment variable" + os.linesep + HELP_MSG
-    print(_msg)
-    exit(1)
+class EnvironmentNotSetError(RuntimeError):
+    """Environment variable of a third-party dependency is not set"""
 
-if IGDATA is None:
-    _msg = "Please set the IGDATA environment variable" + os.linesep + HELP_MSG
-    print(_msg)
-    exit(1)
+
+def tool_path(variable):
+    """Value of the environment variable of a third-party dependency (HMMER_PATH,
+    IGBLAST_PATH or IGDATA).
+
+    It is only checked when an external tool is run, so importing the package
+    and the in-process backends do not need it
+    """
+    value = os.environ.get(variable)
+    if value is None:
+        raise EnvironmentNotSetError(
+            f"Please set the {variable} environment variable" + os.linesep + HELP_MSG
+        )
+    return value
+
+
+def __getattr__(name):
+    if name in API_NAMES:
+        from proabc_2 import api
+
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
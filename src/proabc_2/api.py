@@ -0,0 +1,183 @@
+"""
+Library API of proABC-2: predictions from sequence strings, in memory.
+
+    import proabc_2
+
+    heavy, light = proabc_2.predict_pairs([(heavy_seq, light_seq)])[0]
+
+The chains are classified, aligned and assigned to their germlines in-process
+by default (or with the external tools through pipes), so nothing is written
+to disk unless output_path is given. The per-residue predictions are returned
+as data-frames with the Chothia numbering, and the failure of an antibody is
+raised as a PredictionError subclass telling why it failed.
+"""
+
+import os
+
+import proabc_2.batch as ba
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2 import EnvironmentNotSetError, metrics
+from proabc_2.cache import DEFAULT_MAX_SIZE, ResultCache, StageCache, split_size
+
+# Ways of reporting the failed antibodies
+ERROR_MODES = ["raise", "return"]
+
+
+class PredictionError(Exception):
+    """Failure of the prediction of an antibody.
+
+    index = position of the antibody in the input (None if the whole call failed)
+    reason = category of the error (see jobinput.ERROR_REASONS)
+    """
+
+    def __init__(self, message, index=None, reason="other"):
+        super().__init__(message)
+        self.message = message
+        self.index = index
+        self.reason = reason
+
+
+class InvalidSequenceError(PredictionError, ValueError):
+    """Empty sequence or sequence with unknown amino acids"""
+
+
+class ChainError(PredictionError):
+    """Sequence which is not an antibody chain, or not the expected one"""
+
+
+class AlignmentError(PredictionError):
+    """Chain which could not be aligned to the profile HMM of its isotype"""
+
+
+class GermlineError(PredictionError):
+    """Chain without hits in the germline database"""
+
+
+class ToolError(PredictionError):
+    """Failure of an external tool, for all the antibodies of the call"""
+
+
+# Exception raised for every category of jobinput.ERROR_REASONS
+ERROR_TYPES = {
+    "invalid_input": InvalidSequenceError,
+    "not_antibody": ChainError,
+    "single_chain": ChainError,
+    "wrong_chain": ChainError,
+    "missing_chain": ChainError,
+    "alignment_failed": AlignmentError,
+    "no_germline": GermlineError,
+    "hmmscan_error": ToolError,
+    "hmmalign_error": ToolError,
+    "igblastp_error": ToolError,
+}
+
+
+def prediction_error(message, index=None):
+    """Exception of an error message, of the type of its category"""
+    reason = ji.error_reason(message)
+    return ERROR_TYPES.get(reason, PredictionError)(message, index, reason)
+
+
+def predict_pairs(
+    pairs,
+    engine="tf",
+    hmm_backend="native",
+    germline_backend="kmer",
+    germline_index=None,
+    num_threads=1,
+    chunk_size=256,
+    cache_dir=None,
+    cache_size=DEFAULT_MAX_SIZE,
+    output_path=None,
+    errors="raise",
+):
+    """Make the proABC 2 predictions of a list of heavy/light chain pairs.
+
+    pairs = list of (heavy sequence, light sequence), protein or DNA
+    engine, hmm_backend, germline_backend, germline_index, num_threads,
+    chunk_size = settings of the pipeline, as in batch.batch_prediction (by
+    default without external tools)
+    cache_dir = folder of the cache of the stages and of the predictions
+    (default: no cache)
+    cache_size = size limit of the cache in bytes, shared by the stages and
+    the predictions
+    output_path = folder where the job folders of the antibodies are written,
+    as in batch mode (default: nothing is written)
+    errors = "raise" to raise the PredictionError of the first failed antibody,
+    "return" to return it in place of its predictions
+
+    Returns the list of (heavy data-frame, light data-frame) of the antibodies,
+    in input order, with the columns Chothia, Sequence and OUTPUT_NAMES. A
+    ToolError is raised if an external tool fails or cannot be run
+    """
+    if errors not in ERROR_MODES:
+        raise ValueError(f"Unknown errors mode '{errors}', choose from {ERROR_MODES}")
+
+    # The antibodies are named after their position, as in the server
+    records = [
+        (f"antibody{num}", heavy_seq.strip().upper(), light_seq.strip().upper())
+        for num, (heavy_seq, light_seq) in enumerate(pairs, 1)
+    ]
+    if output_path is not None:
+        os.makedirs(output_path, exist_ok=True)
+
+    # Take the antibodies already predicted from the cache
+    results = {}
+    stage_size, result_size = split_size(cache_size)
+    if cache_dir:
+        result_cache = ResultCache(os.path.join(cache_dir, "predictions"), result_size)
+        params = f"{engine}/{hmm_backend}/{germline_backend}"
+        keys = {
+            ab_id: pr.result_key(result_cache, heavy_seq, light_seq, params)
+            for ab_id, heavy_seq, light_seq in records
+        }
+        for ab_id, _, _ in records:
+            result = result_cache.get_key(keys[ab_id])
+            if result is not None:
+                results[ab_id] = pr.unpack_result(result)
+
+    status = {}
+    todo = [record for record in records if record[0] not in results]
+    if todo:
+        try:
+            status, jobs = ba.batch_features(
+                todo,
+                output_path,
+                num_threads,
+                hmm_backend,
+                germline_backend,
+                germline_index,
+                StageCache(cache_dir, stage_size) if cache_dir else None,
+            )
+        except ji.JobError as err:
+            raise prediction_error(err.message) from None
+        except (EnvironmentNotSetError, OSError) as err:
+            # The tool is not installed or its environment variable is not set
+            raise ToolError(str(err), reason="tool_error") from err
+
+        for (ab_id, _, features), y in ba.predict_jobs(jobs, engine, chunk_size):
+            results[ab_id] = (y,) + tuple(features[1:])
+            if cache_dir:
+                result_cache.put_key(keys[ab_id], pr.pack_result(y, features))
+
+    for ab_id, _, _ in records:
+        metrics.record_status("OK" if ab_id in results else status[ab_id])
+
+    outputs = []
+    for index, (ab_id, heavy_seq, light_seq) in enumerate(records):
+        if ab_id not in results:
+            error = prediction_error(status[ab_id], index)
+            if errors == "raise":
+                raise error
+            outputs.append(error)
+            continue
+
+        heavy_out, light_out = pr.format_output(*results[ab_id])
+        if output_path is not None:
+            jobid = ba.prepare_job(output_path, ab_id, heavy_seq, light_seq)
+            heavy_out.to_csv(path_or_buf=os.path.join(jobid, "heavy-pred.csv"))
+            light_out.to_csv(path_or_buf=os.path.join(jobid, "light-pred.csv"))
+        outputs.append((heavy_out, light_out))
+
+    return outputs
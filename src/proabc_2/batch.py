@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+
+"""
+Batch mode of proABC-2.
+
+The heavy/light pairs are read from a paired multi-record FASTA file
+(heavy chain record followed by its light chain record) or from a CSV/TSV
+manifest with the columns: id, heavy, light.
+
+The external tools are run once for the whole batch: one hmmscan to
+identify the isotypes, one hmmalign per isotype and one igblastp per
+germline database. Then the encoded inputs are stacked and the network is
+loaded once and called once per chunk of antibodies.
+
+With several workers, the batch is split into chunks whose features are
+calculated in a pool of processes, each chunk in its own batch_N/ folder,
+while the main process runs the network on the chunks as they are done.
+The progress of the batch (antibodies done, rate and estimated time left)
+can be printed after every chunk and the metrics of the run (see
+metrics.py) written to a file.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import proabc_2.cnn as cn
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2 import metrics, trace
+from proabc_2.cache import (
+    DEFAULT_MAX_SIZE,
+    ResultCache,
+    StageCache,
+    run_stage,
+    split_size,
+)
+
+MANIFEST_COLUMNS = ["id", "heavy", "light"]
+
+# Implementations of the profile HMM stages: HMMER programs or profile_hmm
+HMM_BACKENDS = ["hmmer", "native"]
+
+# Implementations of the germline assignment: igblastp or germline_kmer
+GERMLINE_BACKENDS = ["igblastp", "kmer"]
+
+# Germline database of every isotype
+IG_DATABASES = {"H": pr.IG_DATABASE_H, "K": pr.IG_DATABASE_K, "L": pr.IG_DATABASE_L}
+
+# Error raised when a chain is found in place of the other one
+WRONG_CHAIN_ERRORS = {
+    ("H", "K"): "Kappa chain found when heavy expected.",
+    ("H", "L"): "Lambda chain found when heavy expected.",
+    ("L", "H"): "Heavy chain found when light expected",
+}
+
+
+def read_paired_fasta(filename):
+    """Read a multi-record FASTA file where every heavy chain record is
+    followed by the light chain record of the same antibody.
+
+    Returns a list of (id, heavy sequence, light sequence)
+    """
+    records = []
+    with open(filename) as fhIn:
+        for line in fhIn:
+            line = line.rstrip()
+            if line.startswith(">"):
+                # the first word of the header is the identifier
+                header = line[1:].split()
+                records.append([header[0] if header else "", ""])
+            elif line:
+                if not records:
+                    raise ValueError(f"Missing header at the beginning of {filename}")
+                records[-1][1] = records[-1][1] + line.upper()
+
+    if len(records) % 2:
+        raise ValueError(
+            f"Odd number of records in {filename}. Every heavy chain must be followed by its light chain"
+        )
+
+    pairs = []
+    for (head_h, seq_h), (_head_l, seq_l) in zip(records[::2], records[1::2]):
+        pairs.append((head_h, seq_h, seq_l))
+
+    return pairs
+
+
+def read_manifest(filename, delimiter=None):
+    """Read a CSV/TSV manifest with the columns id, heavy and light.
+
+    Returns a list of (id, heavy sequence, light sequence)
+    """
+    if delimiter is None:
+        delimiter = "\t" if filename.endswith((".tsv", ".tab")) else ","
+
+    pairs = []
+    with open(filename, newline="") as fhIn:
+        reader = csv.DictReader(fhIn, delimiter=delimiter)
+        missing = [c for c in MANIFEST_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(
+                "Missing column(s) {} in {}".format(", ".join(missing), filename)
+            )
+        for row in reader:
+            pairs.append(
+                (
+                    row["id"].strip(),
+                    row["heavy"].strip().upper(),
+                    row["light"].strip().upper(),
+                )
+            )
+
+    return pairs
+
+
+def read_pairs(filename, input_format="auto"):
+    """Read the heavy/light pairs of a batch"""
+    if input_format == "auto":
+        if filename.endswith((".csv", ".tsv", ".tab")):
+            input_format = "manifest"
+        else:
+            input_format = "fasta"
+
+    if input_format == "fasta":
+        pairs = read_paired_fasta(filename)
+    else:
+        pairs = read_manifest(filename)
+
+    # Antibody IDs are used as folder names
+    seen = set()
+    for ab_id, _, _ in pairs:
+        if not ab_id or "/" in ab_id:
+            raise ValueError(f"Invalid antibody id: '{ab_id}'")
+        if ab_id in seen:
+            raise ValueError(f"Duplicated antibody id: '{ab_id}'")
+        seen.add(ab_id)
+
+    return pairs
+
+
+def prepare_job(output_path, ab_id, heavy_seq, light_seq):
+    """Create the job folder of one antibody and write its fasta files"""
+    jobid = os.path.join(output_path, ab_id) + "/"
+    os.makedirs(jobid, exist_ok=True)
+
+    with open(os.path.join(jobid, "heavy.fasta"), "w") as fhOut:
+        fhOut.write(f">{ab_id}_H\n{heavy_seq}\n")
+    with open(os.path.join(jobid, "light.fasta"), "w") as fhOut:
+        fhOut.write(f">{ab_id}_L\n{light_seq}\n")
+
+    return jobid
+
+
+def protein_sequence(seq, header):
+    """Translate DNA sequences and check the amino acids of a chain.
+
+    Returns the protein sequence and an error message (empty if there are no errors)
+    """
+    if not seq:
+        return seq, f"No sequence present for {header}. Please check your input"
+
+    if ji.isDNA(seq):
+        seq = ji.translate(seq)
+
+    if not ji.isProtein(seq):
+        return seq, header + " includes unknown amino acids. Please check your sequence"
+
+    return seq, ""
+
+
+def batch_features(
+    pairs,
+    output_path,
+    num_threads=1,
+    hmm_backend="hmmer",
+    germline_backend="igblastp",
+    germline_index=None,
+    cache=None,
+    work_dir=None,
+):
+    """Calculate the features of all the antibodies of a batch.
+
+    Every external tool is run once for the whole batch, with its input and output
+    piped. In debug mode (jobinput.debug_files), they are kept in work_dir
+    (default: the batch/ folder of output_path). The failures are reported per
+    antibody.
+    output_path = folder of the job folders of the antibodies, with their fasta
+    and features files (None to write nothing, the job folders are then None)
+    hmm_backend = "native" to classify and align the chains in-process instead of
+    with hmmscan and hmmalign
+    germline_backend = "kmer" to assign the germlines with the k-mer index of
+    germline_kmer instead of igblastp, memory-mapped from germline_index if given
+    cache = cache.StageCache of the results of the scan, align and germline stages
+
+    Returns a dictionary {id: error message} of the failed antibodies and a list
+    of (id, job folder, output of proABC.chain_features) of the other ones
+    """
+    if work_dir is None and output_path is not None:
+        work_dir = os.path.join(output_path, "batch")
+    if work_dir is not None:
+        work_dir = os.path.join(work_dir, "")
+        if ji.debug_files():
+            os.makedirs(work_dir, exist_ok=True)
+
+    status = {}
+    sequences = {}
+    for ab_id, heavy_seq, light_seq in pairs:
+        if output_path is not None:
+            prepare_job(output_path, ab_id, heavy_seq, light_seq)
+        for chain, seq in (("H", heavy_seq), ("L", light_seq)):
+            sequences[ab_id, chain], error = protein_sequence(seq, f"{ab_id}_{chain}")
+            if error and ab_id not in status:
+                status[ab_id] = error
+
+    def failed(query):
+        return query[0] in status
+
+    # Identify the isotype of all the chains
+    def scan(query_ids):
+        _, diagnostics = ji.classify_isotypes(
+            {q: sequences[q] for q in query_ids},
+            work_dir,
+            cpu=num_threads,
+            native=hmm_backend == "native",
+        )
+        return {q: diagnostics[q]["evalues"] for q in query_ids}
+
+    with trace.span("scan", sequences=len(sequences)):
+        evalues = run_stage(
+            cache,
+            "scan",
+            {q: seq for q, seq in sequences.items() if not failed(q)},
+            scan,
+            ji.scan_databases(),
+            hmm_backend,
+        )
+    isotypes = {}
+    for (ab_id, chain), chain_evalues in evalues.items():
+        isotype, error = ji.isotype_from_evalues(chain_evalues)
+        isotypes[ab_id, chain] = isotype
+        if failed((ab_id, chain)):
+            continue
+        if error:
+            status[ab_id] = ji.ISOTYPE_ERRORS[error].format(
+                header=f"{ab_id}_{chain}", seq=sequences[ab_id, chain]
+            )
+        elif not isotype:
+            status[ab_id] = "antibody is missing {} chain".format(
+                "heavy" if chain == "H" else "light"
+            )
+        elif (chain, isotype) in WRONG_CHAIN_ERRORS:
+            status[ab_id] = WRONG_CHAIN_ERRORS[chain, isotype]
+
+    # Align the chains, one hmmalign run per isotype
+    def align(query_ids):
+        return ji.align_batch(
+            {q: sequences[q] for q in query_ids},
+            isotypes,
+            work_dir,
+            native=hmm_backend == "native",
+        )
+
+    aligned = {}
+    with trace.span("align", sequences=len(evalues)):
+        for isotype, hmm in ji.HMM_FILES.items():
+            aligned.update(
+                run_stage(
+                    cache,
+                    "align",
+                    {
+                        q: seq
+                        for q, seq in sequences.items()
+                        if not failed(q) and isotypes.get(q) == isotype
+                    },
+                    align,
+                    [os.path.join(ji.MARKOV_MODELS, hmm)],
+                    hmm_backend,
+                )
+            )
+    for (ab_id, chain), aln in aligned.items():
+        if not aln and not failed((ab_id, chain)):
+            status[ab_id] = ji.ISOTYPE_ERRORS[
+                "failed_" + isotypes[ab_id, chain]
+            ].format(seq=sequences[ab_id, chain])
+
+    # Calculate the germlines, one igblastp run per database. As in the single
+    # antibody mode, the germline of a chain is searched with its aligned residues
+    # (without the leader or constant region of the input)
+    germlines = {}
+    for isotype, ig_database in IG_DATABASES.items():
+        chains = {
+            q: aligned[q].replace("-", "")
+            for q in sequences
+            if not failed(q) and isotypes[q] == isotype
+        }
+
+        def assign(query_ids):
+            germ, no_hits = ji.germline_batch(
+                {q: chains[q] for q in query_ids},
+                ig_database,
+                work_dir,
+                f"batch_germline_{isotype}",
+                num_threads,
+                native=germline_backend == "kmer",
+                index_dir=germline_index,
+            )
+            # Chains without hits are cached with an empty germline
+            return {q: germ.get(q, "") for q in query_ids}
+
+        with trace.span("germline", sequences=len(chains), isotype=isotype):
+            germ = run_stage(
+                cache, "germline", chains, assign, [ig_database], germline_backend
+            )
+        for (ab_id, chain), germline in germ.items():
+            if germline:
+                germlines[ab_id, chain] = germline
+            else:
+                status[ab_id] = (
+                    f"No hits found in the germline database for: {ab_id}_{chain}"
+                )
+
+    # Canonical structures and loop lengths of every antibody
+    jobs = []
+    for ab_id, _, _ in pairs:
+        if ab_id in status:
+            continue
+        isotype_L = isotypes[ab_id, "L"]
+        try:
+            with trace.span("numbering", ab_id):
+                features = pr.chain_features(
+                    aligned[ab_id, "H"],
+                    aligned[ab_id, "L"],
+                    isotype_L,
+                    germlines[ab_id, "H"],
+                    germlines[ab_id, "L"],
+                )
+        except Exception as err:
+            status[ab_id] = str(err)
+            continue
+        jobid = None
+        if output_path is not None:
+            jobid = os.path.join(output_path, ab_id) + "/"
+            features[0].to_csv(path_or_buf=os.path.join(jobid, f"{ab_id}-features.csv"))
+        jobs.append((ab_id, jobid, features))
+
+    return status, jobs
+
+
+def chunks(n_items, chunk_size):
+    """Yield the slices of consecutive chunks"""
+    for start in range(0, n_items, chunk_size):
+        yield slice(start, min(start + chunk_size, n_items))
+
+
+def available_cpus():
+    """Number of CPUs the process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _chunk_features(pairs, output_path, work_dir, options, cache_dir, cache_size):
+    """batch_features of a chunk of antibodies, run in a worker process.
+
+    The metrics collected by the worker are returned with the output
+    """
+    cache = StageCache(cache_dir, cache_size) if cache_dir else None
+    status, jobs = batch_features(pairs, output_path, *options, cache, work_dir)
+    return status, jobs, metrics.REGISTRY.drain() if metrics.enabled() else None
+
+
+def feature_chunks(
+    pairs,
+    output_path,
+    workers=1,
+    chunk_size=256,
+    options=(),
+    cache_dir=None,
+    cache_size=DEFAULT_MAX_SIZE,
+):
+    """Calculate the features of a batch, in chunks spread over a pool of processes.
+
+    options = num_threads, hmm_backend, germline_backend and germline_index
+    of batch_features
+
+    Yields the output of batch_features for every chunk, as soon as it is done
+    (the whole batch at once if there is a single worker)
+    """
+    if workers <= 1 or len(pairs) <= 1:
+        cache = StageCache(cache_dir, cache_size) if cache_dir else None
+        yield batch_features(pairs, output_path, *options, cache)
+        return
+
+    # Chunks small enough to keep all the workers busy
+    size = min(chunk_size, -(-len(pairs) // workers))
+
+    # New interpreters, so the workers do not inherit the state of the network
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                _chunk_features,
+                pairs[chunk],
+                output_path,
+                os.path.join(output_path, f"batch_{num}"),
+                options,
+                cache_dir,
+                cache_size,
+            )
+            for num, chunk in enumerate(chunks(len(pairs), size))
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            status, jobs, values = future.result()
+            if values is not None:
+                metrics.REGISTRY.merge(values)
+            yield status, jobs
+
+
+def encode_jobs(jobs):
+    """Stack the encoded inputs of the network for a list of antibodies.
+
+    jobs = list of (id, job folder, output of proABC.chain_features)
+
+    Returns the encoded sequences and the categorized features
+    """
+    import pandas as pd
+
+    df = pd.concat([features[0] for _, _, features in jobs], ignore_index=True)
+    with trace.span("categorize_X_data", antibodies=len(jobs)):
+        feat_data = cn.categorize_X_data(df)
+    with trace.span("encode_X_sequence", antibodies=len(jobs)):
+        seq_data = cn.encode_X_sequence(
+            df.loc[:, ["heavy_seq", "light_seq"]], pr.SEQ_ENCODING, add_position=1
+        )
+    return seq_data, feat_data
+
+
+def predict_jobs(jobs, engine="tf", chunk_size=256):
+    """Run the network on the features of a list of antibodies.
+
+    jobs = list of (id, job folder, output of proABC.chain_features)
+
+    Yields every job with the predictions of the network for its antibody (1D array)
+    """
+    if not jobs:
+        return
+
+    seq_data, feat_data = encode_jobs(jobs)
+    tot, hps = pr.model_parameters(seq_data)
+
+    # Load the network once and predict chunk by chunk
+    with trace.span("model_build"):
+        model = cn.get_predictor(
+            pr.MODEL_PATH, hps, seq_data.shape[1:], feat_data.shape[1], engine
+        )
+
+    for chunk in chunks(len(jobs), chunk_size):
+        with trace.span("predict", antibodies=chunk.stop - chunk.start):
+            y_pred = model.predict((seq_data[chunk], feat_data[chunk]))
+        for job, y in zip(jobs[chunk], y_pred):
+            yield job, np.asarray(y)
+
+
+def write_prediction(jobid, ab_id, heavy_out, light_out):
+    """Write the predictions of an antibody to its job folder"""
+    with trace.span("write_csv", ab_id):
+        heavy_out.to_csv(path_or_buf=os.path.join(jobid, "heavy-pred.csv"))
+        light_out.to_csv(path_or_buf=os.path.join(jobid, "light-pred.csv"))
+
+
+def progress_line(done, total, failed, elapsed, skipped=0):
+    """Line reporting the progress of a batch.
+
+    done = antibodies processed, including the skipped ones
+    failed = antibodies which failed
+    elapsed = time since the beginning of the batch, in seconds
+    skipped = antibodies taken from the cache, left out of the rate
+    """
+    rate = (done - skipped) / elapsed if elapsed > 0 else 0.0
+    if done >= total:
+        eta = "done"
+    elif rate > 0:
+        seconds = round((total - done) / rate)
+        eta = "ETA {}:{:02d}:{:02d}".format(
+            seconds // 3600, seconds // 60 % 60, seconds % 60
+        )
+    else:
+        eta = "ETA unknown"
+    percent = 100 * done / total if total else 100.0
+    return (
+        f"{done}/{total} antibodies ({percent:.1f}%), {failed} failed, "
+        f"{rate:.2f} antibodies/s, {eta}"
+    )
+
+
+def batch_prediction(
+    input_file,
+    output_path,
+    input_format="auto",
+    chunk_size=256,
+    consolidated=False,
+    engine="tf",
+    num_threads=1,
+    hmm_backend="hmmer",
+    germline_backend="igblastp",
+    germline_index=None,
+    cache_dir=None,
+    cache_size=DEFAULT_MAX_SIZE,
+    workers=1,
+    metrics_file=None,
+    progress=None,
+):
+    """Make the proABC 2 predictions for all the antibodies of a batch.
+
+    cache_dir = folder of the cache of the per-chain stages and of the
+    predictions (default: no cache)
+    cache_size = size limit of the cache in bytes, shared by the stages and
+    the predictions
+    workers = number of processes calculating the features
+    metrics_file = file where the metrics are written after every chunk, in
+    the Prometheus text format (the metrics must be enabled, see metrics.enable)
+    progress = file where a progress line is written after every chunk
+    (e.g. sys.stderr)
+
+    Returns a data-frame with the status of every antibody
+    """
+    import pandas as pd
+
+    pairs = read_pairs(input_file, input_format)
+    os.makedirs(output_path, exist_ok=True)
+    start = time.monotonic()
+
+    # Take the antibodies already predicted from the cache
+    results = {}
+    stage_size, result_size = split_size(cache_size)
+    if cache_dir:
+        result_cache = ResultCache(os.path.join(cache_dir, "predictions"), result_size)
+        params = f"{engine}/{hmm_backend}/{germline_backend}"
+        keys = {
+            ab_id: pr.result_key(result_cache, heavy_seq, light_seq, params)
+            for ab_id, heavy_seq, light_seq in pairs
+        }
+        for ab_id, heavy_seq, light_seq in pairs:
+            result = result_cache.get_key(keys[ab_id])
+            if result is not None:
+                results[ab_id] = pr.unpack_result(result)
+                jobid = prepare_job(output_path, ab_id, heavy_seq, light_seq)
+                with open(os.path.join(jobid, f"{ab_id}-features.csv"), "w") as fh:
+                    fh.write(result["features"])
+                metrics.record_status("OK")
+    cached = len(results)
+
+    # Calculate the features of every other antibody and predict them
+    status = {}
+    try:
+        for chunk_status, jobs in feature_chunks(
+            [pair for pair in pairs if pair[0] not in results],
+            output_path,
+            workers,
+            chunk_size,
+            (num_threads, hmm_backend, germline_backend, germline_index),
+            cache_dir,
+            stage_size,
+        ):
+            status.update(chunk_status)
+            for message in chunk_status.values():
+                metrics.record_status(message)
+            for (ab_id, _, features), y in predict_jobs(jobs, engine, chunk_size):
+                results[ab_id] = (y,) + tuple(features[1:])
+                metrics.record_status("OK")
+                if cache_dir:
+                    result_cache.put_key(keys[ab_id], pr.pack_result(y, features))
+
+            if metrics_file:
+                metrics.write(metrics_file)
+            if progress is not None:
+                line = progress_line(
+                    len(results) + len(status),
+                    len(pairs),
+                    len(status),
+                    time.monotonic() - start,
+                    cached,
+                )
+                print(line, file=progress, flush=True)
+    finally:
+        # Also written if the batch stops, to see how far it went
+        if metrics_file:
+            metrics.write(metrics_file)
+
+    # Write the predictions, in input order
+    heavy_all = []
+    light_all = []
+    for ab_id, _, _ in pairs:
+        if ab_id not in results:
+            continue
+
+        with trace.span("format_output", ab_id):
+            heavy_out, light_out = pr.format_output(*results[ab_id])
+        if consolidated:
+            heavy_all.append(heavy_out.assign(ID=ab_id))
+            light_all.append(light_out.assign(ID=ab_id))
+        else:
+            write_prediction(
+                os.path.join(output_path, ab_id), ab_id, heavy_out, light_out
+            )
+        status[ab_id] = "OK"
+
+    if heavy_all:
+        cols = ["ID", "Chothia", "Sequence"] + pr.OUTPUT_NAMES
+        pd.concat(heavy_all, ignore_index=True)[cols].to_csv(
+            path_or_buf=os.path.join(output_path, "heavy-pred.csv")
+        )
+        pd.concat(light_all, ignore_index=True)[cols].to_csv(
+            path_or_buf=os.path.join(output_path, "light-pred.csv")
+        )
+
+    # Write the status of every antibody, in input order
+    df_status = pd.DataFrame(
+        [(ab_id, status[ab_id]) for ab_id, _, _ in pairs], columns=["ID", "Status"]
+    )
+    df_status.to_csv(path_or_buf=os.path.join(output_path, "batch-status.csv"))
+
+    return df_status
+
+
+def main():
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(
+        description="It predicts the antibody residues that will make contact with the antigen for a batch of antibodies",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "input",
+        help="Paired multi-record FASTA file (heavy chain followed by its light chain)\n"
+        "or CSV/TSV manifest with the columns: id, heavy, light",
+    )
+    parser.add_argument(
+        "output", help="Path to the folder where the predictions are written"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["auto", "fasta", "manifest"],
+        default="auto",
+        help="Format of the input file (default: guessed from the extension)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="Number of antibodies given to the network at once (default: 256)",
+    )
+    parser.add_argument(
+        "--consolidated",
+        action="store_true",
+        help="Write a single heavy-pred.csv and light-pred.csv for the whole batch",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=cn.ENGINES,
+        default="tf",
+        help="Implementation of the network: TensorFlow (default) or NumPy",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads of hmmscan and igblastp (default: 1)",
+    )
+    parser.add_argument(
+        "--hmm-backend",
+        choices=HMM_BACKENDS,
+        default="hmmer",
+        help="Classify and align the chains with HMMER (default) or in-process with NumPy",
+    )
+    parser.add_argument(
+        "--germline-backend",
+        choices=GERMLINE_BACKENDS,
+        default="igblastp",
+        help="Assign the germlines with igblastp (default) or with a k-mer index",
+    )
+    parser.add_argument(
+        "--germline-index",
+        help="Folder where the k-mer index is saved and memory-mapped from\n"
+        "(default: built in memory)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=available_cpus(),
+        help="Number of processes calculating the features (default: number of\n"
+        "available CPUs, %(default)s)",
+    )
+    pr.add_cache_arguments(parser)
+    pr.add_debug_arguments(parser)
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write the metrics of the run (antibodies, failures, stage latencies,\n"
+        "cache hits, tool runs) to FILE after every chunk, in the Prometheus\n"
+        "text format",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Print the progress and the estimated time left to the standard error\n"
+        "after every chunk",
+    )
+    trace.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be a positive integer")
+    if args.threads < 1:
+        parser.error("--threads must be a positive integer")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be a positive integer")
+
+    # Set in the environment, so that the workers inherit them
+    if args.debug_files:
+        os.environ[ji.DEBUG_FILES_ENV] = "1"
+    trace.enable(args.trace, args.profile)
+    if args.metrics:
+        metrics.enable()
+
+    try:
+        df_status = batch_prediction(
+            args.input,
+            args.output,
+            args.format,
+            args.chunk_size,
+            args.consolidated,
+            args.engine,
+            args.threads,
+            args.hmm_backend,
+            args.germline_backend,
+            args.germline_index,
+            args.cache,
+            args.cache_size * 1024**2,
+            args.workers,
+            args.metrics,
+            sys.stderr if args.progress else None,
+        )
+    except Exception as err:
+        print("ERROR in proABC-2 batch prediction:")
+        print(err)
+        raise SystemExit(1)
+
+    failed = df_status[df_status["Status"] != "OK"]
+    print(f"{len(df_status) - len(failed)} of {len(df_status)} antibodies predicted")
+    for ab_id, message in failed.itertuples(index=False):
+        print(f"{ab_id}: {message}")
+
+
+if __name__ == "__main__":
+    main()
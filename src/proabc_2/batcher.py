@@ -0,0 +1,176 @@
+"""
+Dynamic micro-batching of concurrent calls.
+
+A MicroBatcher runs a function on batches of items: the items submitted by
+concurrent callers are queued and collected by a worker thread until the
+batch is full or the oldest item has waited max_wait seconds, then the
+function is called once for the whole batch and the results are scattered
+back to the callers.
+
+The queue is bounded: when it is full, submit() raises queue.Full, so the
+callers can reject the request instead of piling up work (map() cancels the
+items of the request already queued, which are then skipped by the worker).
+The depth of the queue seen by every new item and the size of every batch are
+recorded in histograms.
+"""
+
+import bisect
+import concurrent.futures
+import queue
+import threading
+import time
+
+# Upper bounds of the buckets of the histograms
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+# Item telling the worker to stop
+_STOP = object()
+
+
+class Histogram:
+    """Counts of the observed values in buckets with the given upper bounds"""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def merge(self, counts, total):
+        """Add the bucket counts and the sum of a histogram with the same bounds"""
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += sum(counts)
+            self.sum += total
+
+    def snapshot(self):
+        """Cumulative counts of every bucket, with the total count and sum"""
+        with self._lock:
+            buckets = {}
+            total = 0
+            for bound, count in zip(self.bounds + ["+Inf"], self.counts):
+                total += count
+                buckets[str(bound)] = total
+            return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+class MicroBatcher:
+    """Group the concurrent calls of a function into batches.
+
+    function = function taking a list of items and returning the list of
+    their results, in the same order
+    max_batch_size = maximum number of items per call of the function
+    max_wait = maximum time an item waits for the batch to fill, in seconds
+    max_queue = maximum number of items waiting in the queue
+    """
+
+    def __init__(self, function, max_batch_size=50, max_wait=0.005, max_queue=1024):
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+
+        self._queue = queue.Queue(max_queue)
+        self._stopped = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, item, timeout=0):
+        """Queue an item, returning the concurrent.futures.Future of its result.
+
+        timeout = time to wait for a free place in the queue, in seconds (None
+        to wait forever), queue.Full is raised when it expires
+        """
+        future = concurrent.futures.Future()
+        self.queue_depth.observe(self._queue.qsize())
+        self._queue.put((item, future), block=timeout != 0, timeout=timeout or None)
+        return future
+
+    def free(self):
+        """Number of free places in the queue"""
+        return self.max_queue - self._queue.qsize()
+
+    def map(self, items, timeout=0):
+        """Results of a list of items, which can be batched with other callers.
+
+        If queue.Full is raised for an item, the items queued before it are
+        cancelled, so that no work is done for a rejected request
+        """
+        futures = []
+        try:
+            for item in items:
+                futures.append(self.submit(item, timeout))
+        except queue.Full:
+            for future in futures:
+                future.cancel()
+            raise
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """Wait for an item, then collect the batch it belongs to"""
+        first = self._queue.get()
+        if first is _STOP:
+            self._stopped = True
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    entry = self._queue.get(timeout=remaining)
+                else:
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish the current batch before stopping
+                self._stopped = True
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            # Skip the items cancelled while they were queued
+            batch = [
+                (item, future)
+                for item, future in self._next_batch()
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            self.batch_size.observe(len(batch))
+            items = [item for item, _ in batch]
+            try:
+                results = self.function(items)
+            except Exception as err:
+                for _, future in batch:
+                    future.set_exception(err)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+    def stats(self):
+        """Histograms of the queue depth and of the batch size"""
+        return {
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+    def close(self):
+        """Stop the worker once the queued items are processed"""
+        self._queue.put(_STOP)
+        self._worker.join()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+"""
+Per-stage timing benchmark of proABC-2 on synthetic antibodies.
+
+The synthetic heavy/light pairs are assembled from the bundled germline
+databases: a human or mouse V gene with a few point mutations, a random
+junction and a human or mouse J gene. They only depend on the seed, so every run
+benchmarks the same antibodies.
+
+The stages are run by the functions of the batch mode (the per-chain tools
+once for the whole batch, the network once per chunk) and the wall time of
+each of them is taken from the stage_seconds metric of their trace spans, for
+every batch size. The results are written as JSON, with the number of failed
+antibodies by reason, so that they can be compared over time:
+
+    python -m proabc_2.benchmark --sizes 1 100 10000 --output benchmark.json
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import proabc_2.batch as ba
+import proabc_2.cnn as cn
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2 import metrics, trace
+from proabc_2.germline_kmer import read_fasta
+from proabc_2.profile_hmm import AMINO_ACIDS
+
+# Timed stages of the batch mode, in the order they run (the runs of the
+# external tools are included in the scan, align and germline stages)
+STAGES = [
+    "scan",
+    "align",
+    "germline",
+    "numbering",
+    "categorize_X_data",
+    "encode_X_sequence",
+    "model_build",
+    "predict",
+    "format_output",
+    "write_csv",
+]
+
+# Default batch sizes
+SIZES = [1, 100, 10000]
+
+# Species of the germlines of the synthetic antibodies
+SPECIES = ["Homo", "Mus"]
+
+# V genes of every isotype, they must end with the conserved cysteine
+V_GENES = {"H": pr.IG_DATABASE_H, "K": pr.IG_DATABASE_K, "L": pr.IG_DATABASE_L}
+V_PATTERN = re.compile("Y[YFH]C[A-Z]{0,8}$")
+
+# Human and mouse J genes (end of the CDR3 and framework 4). They are not
+# read from database/IGxJp.fasta, where most of them are translated in other
+# reading frames
+J_GENES = {
+    "H": [
+        "AEYFQHWGQGTLVTVSS",
+        "YWYFDLWGRGTLVTVSS",
+        "DAFDIWGQGTMVTVSS",
+        "YFDYWGQGTLVTVSS",
+        "YYYYYGMDVWGQGTTVTVSS",
+        "YWYFDVWGAGTTVTVSS",
+        "YAMDYWGQGTSVTVSS",
+    ],
+    "K": [
+        "WTFGQGTKVEIK",
+        "YTFGQGTKLEIK",
+        "FTFGPGTKVDIK",
+        "LTFGGGTKVEIK",
+        "ITFGQGTRLEIK",
+        "WTFGGGTKLEIK",
+    ],
+    "L": [
+        "YVFGTGTKVTVL",
+        "VVFGGGTKLTVL",
+        "WVFGGGTKLTVL",
+        "WVFGGGTKVTVL",
+    ],
+}
+
+# Range of the number of random residues between the V and the J gene
+JUNCTION_LENGTHS = {"H": (3, 12), "K": (0, 2), "L": (0, 2)}
+
+# Fraction of the residues of the V gene mutated
+MUTATION_RATE = 0.02
+
+# Fraction of kappa light chains
+KAPPA_FRACTION = 0.6
+
+
+def read_genes(filename, pattern):
+    """Sequences of the genes of a germline database, of the SPECIES only,
+    matching pattern and without unknown residues"""
+    genes = []
+    for header, seq in zip(*read_fasta(filename)):
+        species = header.split("|")[-1]
+        if species in SPECIES and pattern.search(seq) and set(seq) <= set(AMINO_ACIDS):
+            genes.append(seq)
+    return genes
+
+
+def synthetic_chain(rng, isotype, v_genes):
+    """Random chain of an isotype: mutated V gene, junction and J gene"""
+    residues = list(rng.choice(v_genes[isotype]))
+    for pos in range(len(residues)):
+        # The cysteines and tryptophans are kept, as they anchor the alignment
+        if residues[pos] not in "CW" and rng.random() < MUTATION_RATE:
+            residues[pos] = rng.choice(AMINO_ACIDS)
+
+    junction = rng.randint(*JUNCTION_LENGTHS[isotype])
+    residues += [rng.choice(AMINO_ACIDS) for _ in range(junction)]
+
+    return "".join(residues) + rng.choice(J_GENES[isotype])
+
+
+def synthetic_pairs(n, seed=0):
+    """Reproducible synthetic antibodies.
+
+    Returns a list of (id, heavy sequence, light sequence)
+    """
+    v_genes = {isotype: read_genes(f, V_PATTERN) for isotype, f in V_GENES.items()}
+
+    rng = random.Random(seed)
+    pairs = []
+    for num in range(n):
+        light = "K" if rng.random() < KAPPA_FRACTION else "L"
+        pairs.append(
+            (
+                f"synthetic{num}",
+                synthetic_chain(rng, "H", v_genes),
+                synthetic_chain(rng, light, v_genes),
+            )
+        )
+    return pairs
+
+
+@contextlib.contextmanager
+def stage_seconds():
+    """Collect the wall time of the stages traced with trace.span() inside the
+    block, from the stage_seconds metric.
+
+    Yields a dictionary {stage: seconds}, filled when the block ends. The
+    metrics collected before the block are kept
+    """
+    was_enabled = metrics.enabled()
+    previous = metrics.REGISTRY.drain()
+    os.environ[metrics.METRICS_ENV] = "1"
+    seconds = {}
+    try:
+        yield seconds
+    finally:
+        values = metrics.REGISTRY.drain()
+        if not was_enabled:
+            del os.environ[metrics.METRICS_ENV]
+        metrics.REGISTRY.merge(previous)
+        if was_enabled:
+            metrics.REGISTRY.merge(values)
+
+        for (name, labels), (_, total) in values["histograms"].items():
+            if name == "stage_seconds":
+                seconds[dict(labels)["stage"]] = total
+
+
+def run_stages(
+    pairs,
+    work_dir,
+    engine="tf",
+    hmm_backend="hmmer",
+    germline_backend="igblastp",
+    num_threads=1,
+    chunk_size=256,
+    network=True,
+):
+    """Run the stages of the batch mode on a batch of antibodies, timing each of them.
+
+    network = False to skip the network, the outputs are then formatted
+    from zero predictions
+
+    Returns the seconds spent in every stage of STAGES and a dictionary
+    {id: error message} of the antibodies which failed
+    """
+    with stage_seconds() as seconds:
+        status, jobs = ba.batch_features(
+            pairs, work_dir, num_threads, hmm_backend, germline_backend
+        )
+
+        if network:
+            predictions = ba.predict_jobs(jobs, engine, chunk_size)
+        elif jobs:
+            seq_data, _ = ba.encode_jobs(jobs)
+            tot, _ = pr.model_parameters(seq_data)
+            predictions = zip(jobs, np.zeros((len(jobs), tot), dtype=np.float32))
+        else:
+            predictions = []
+
+        for (ab_id, jobid, features), y in predictions:
+            with trace.span("format_output", ab_id):
+                heavy_out, light_out = pr.format_output(y, *features[1:])
+            ba.write_prediction(jobid, ab_id, heavy_out, light_out)
+
+    return {stage: seconds[stage] for stage in STAGES if stage in seconds}, status
+
+
+def benchmark(
+    sizes=SIZES,
+    repeat=1,
+    seed=0,
+    engine="tf",
+    hmm_backend="hmmer",
+    germline_backend="igblastp",
+    num_threads=1,
+    chunk_size=256,
+    network=True,
+    work_dir=None,
+):
+    """Time the stages for every batch size.
+
+    repeat = number of runs of every size, the fastest time of every stage is kept
+    (the first run also includes the loading of the resources)
+    work_dir = folder of the job folders (default: a temporary folder)
+
+    Returns a JSON serializable dictionary
+    """
+    results = []
+    for size in sizes:
+        pairs = synthetic_pairs(size, seed)
+        runs = []
+        for num in range(repeat):
+            with tempfile.TemporaryDirectory(
+                prefix="proabc2-bench-", dir=work_dir
+            ) as tmp:
+                seconds, status = run_stages(
+                    pairs,
+                    tmp,
+                    engine,
+                    hmm_backend,
+                    germline_backend,
+                    num_threads,
+                    chunk_size,
+                    network,
+                )
+            runs.append(seconds)
+
+        stages = {}
+        for stage in STAGES:
+            times = [seconds[stage] for seconds in runs if stage in seconds]
+            if times:
+                stages[stage] = {
+                    "seconds": min(times),
+                    "per_antibody": min(times) / size,
+                    "runs": times,
+                }
+        results.append(
+            {
+                "batch_size": size,
+                "failed": len(status),
+                "failure_reasons": dict(
+                    collections.Counter(
+                        ji.error_reason(message) for message in status.values()
+                    )
+                ),
+                "total_seconds": sum(stage["seconds"] for stage in stages.values()),
+                "stages": stages,
+            }
+        )
+
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": ba.available_cpus(),
+        "seed": seed,
+        "repeat": repeat,
+        "engine": engine if network else None,
+        "hmm_backend": hmm_backend,
+        "germline_backend": germline_backend,
+        "threads": num_threads,
+        "chunk_size": chunk_size,
+        "results": results,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Time the stages of proABC-2 on synthetic antibodies",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+        help="Batch sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of runs of every batch size, the fastest is kept (default: 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic antibodies (default: 0)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=cn.ENGINES,
+        default="tf",
+        help="Implementation of the network: TensorFlow (default) or NumPy",
+    )
+    parser.add_argument(
+        "--no-network",
+        action="store_true",
+        help="Skip the network, the outputs are formatted from zero predictions",
+    )
+    parser.add_argument(
+        "--hmm-backend",
+        choices=ba.HMM_BACKENDS,
+        default="hmmer",
+        help="Classify and align the chains with HMMER (default) or in-process with NumPy",
+    )
+    parser.add_argument(
+        "--germline-backend",
+        choices=ba.GERMLINE_BACKENDS,
+        default="igblastp",
+        help="Assign the germlines with igblastp (default) or with a k-mer index",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads of hmmscan and igblastp (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="Number of antibodies given to the network at once (default: 256)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        metavar="DIR",
+        help="Folder of the temporary job folders (default: system temporary folder)",
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="JSON file of the results (default: standard output)",
+    )
+    args = parser.parse_args()
+
+    if min(args.sizes) < 1:
+        parser.error("--sizes must be positive integers")
+    if args.repeat < 1:
+        parser.error("--repeat must be a positive integer")
+
+    results = benchmark(
+        args.sizes,
+        args.repeat,
+        args.seed,
+        args.engine,
+        args.hmm_backend,
+        args.germline_backend,
+        args.threads,
+        args.chunk_size,
+        not args.no_network,
+        args.work_dir,
+    )
+
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
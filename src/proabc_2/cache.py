@@ -0,0 +1,340 @@
+"""
+Content-addressed caches of the pipeline: per-chain stages and predictions.
+
+The result of a stage (E-values of the isotype scan, aligned sequence,
+germline) is stored as a small JSON file named after the hash of the stage,
+the chain sequence, the parameters of the stage and the checksum of the
+database files it depends on (profile HMMs, germline database). Editing a
+database therefore invalidates its entries.
+
+The cache is shared by the single and batch runs and by concurrent processes
+(entries are written atomically). When it grows over its size limit, the
+least recently used entries are removed. The size is only calculated on the
+first write of a process, then kept up to date with its writes and corrected
+by every eviction.
+
+The predictions of the network for a heavy/light pair are cached in the same
+way by ResultCache, keyed by the two sequences and the checksums of the
+checkpoint and of the encoding file, with an additional in-memory tier for
+the long-running processes. The two caches of a cache folder share its size
+limit (see split_size).
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from proabc_2 import metrics
+
+# Default size limit of the cache, in bytes
+DEFAULT_MAX_SIZE = 256 * 1024**2
+
+# Fraction of the size limit kept after an eviction
+EVICTION_TARGET = 0.9
+
+# Default number of predictions kept in memory by ResultCache
+MEMORY_ENTRIES = 1024
+
+# Fraction of the size limit of a cache folder given to the predictions, the
+# rest is given to the per-chain stages
+RESULT_FRACTION = 0.5
+
+# Size of the caches written by this process, by folder: calculated on the
+# first write and then updated by the writes, so the folder is only walked
+# once per process however many StageCache objects are created
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _file_checksum(filename, mtime, size):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fh:
+        for block in iter(functools.partial(fh.read, 1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_checksum(filename):
+    """SHA-256 of the content of a file, calculated once per version of the file"""
+    stat = os.stat(filename)
+    return _file_checksum(os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+
+class StageCache:
+    """On-disk cache of the results of the pipeline stages.
+
+    cache_dir = folder of the cache, created if needed
+    max_size = size limit of the cache in bytes
+    """
+
+    # Extension of the files of the entries
+    SUFFIX = ".json"
+
+    # Name of the cache in the metrics
+    NAME = "stage"
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entries(self):
+        """Paths of all the entries of the cache"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(self.SUFFIX):
+                    yield os.path.join(root, name)
+
+    def _add_size(self, delta):
+        """Add delta to the size of the cache, returning the new size"""
+        folder = os.path.abspath(self.cache_dir)
+        with _sizes_lock:
+            if folder not in _sizes:
+                _sizes[folder] = sum(os.path.getsize(f) for f in self._entries())
+            _sizes[folder] += delta
+            return _sizes[folder]
+
+    @property
+    def size(self):
+        """Size of the entries of the cache in bytes, as seen by this process"""
+        return self._add_size(0)
+
+    def key(self, stage, sequence, databases=(), params=""):
+        """Hash of a stage of a sequence.
+
+        databases = files the stage depends on
+        params = any other setting changing the result (e.g. the backend)
+        """
+        digest = hashlib.sha256()
+        for part in [stage, sequence, params] + [file_checksum(f) for f in databases]:
+            digest.update(part.encode() + b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.SUFFIX)
+
+    def _read(self, fh):
+        """Decode an entry from a binary file"""
+        return json.loads(fh.read().decode())
+
+    def _write(self, value, fh):
+        """Encode an entry to a binary file"""
+        fh.write(json.dumps(value).encode())
+
+    def get(self, stage, sequence, databases=(), params=""):
+        """Cached result of a stage, None if it is not in the cache"""
+        return self.get_key(self.key(stage, sequence, databases, params))
+
+    def put(self, stage, sequence, value, databases=(), params=""):
+        """Store the result of a stage (any JSON serializable value)"""
+        self.put_key(self.key(stage, sequence, databases, params), value)
+
+    def get_key(self, key):
+        """Cached entry with the given key, None if it is not in the cache"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                value = self._read(fh)
+            # The modification time is the time of the last use
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            metrics.inc("cache_requests_total", cache=self.NAME, result="miss")
+            return None
+
+        self.hits += 1
+        metrics.inc("cache_requests_total", cache=self.NAME, result="hit")
+        return value
+
+    def put_key(self, key, value):
+        """Store an entry with the given key"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._add_size(0)  # size before the entry, if it is not known yet
+
+        # Write to a temporary file first, so readers never see partial entries
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            self._write(value, fh)
+        delta = os.path.getsize(tmp_name)
+        try:
+            # The entry replaces the previous one with the same key
+            delta -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp_name, path)
+
+        if self._add_size(delta) > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in
+        EVICTION_TARGET of its size limit"""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+        with _sizes_lock:
+            _sizes[os.path.abspath(self.cache_dir)] = total
+
+    def run(self, stage, sequences, compute, databases=(), params=""):
+        """Results of a stage for many sequences, computing only the missing ones.
+
+        sequences = dictionary with the query id as key and the string identifying
+        the input of the stage (e.g. the sequence) as value
+        compute = function taking the list of the missing query ids and
+        returning a dictionary {query id: result}
+
+        Returns a dictionary {query id: result}, the results which are missing
+        from the output of compute are not stored
+        """
+        results = {}
+        missing = []
+        for query_id, sequence in sequences.items():
+            value = self.get(stage, sequence, databases, params)
+            if value is None:
+                missing.append(query_id)
+            else:
+                results[query_id] = value
+
+        if missing:
+            computed = compute(missing)
+            for query_id, value in computed.items():
+                self.put(stage, sequences[query_id], value, databases, params)
+            results.update(computed)
+
+        return results
+
+
+def _frozen(result):
+    """Copy of a result with read-only float32 arrays"""
+    frozen = {}
+    for name, value in result.items():
+        if not isinstance(value, str):
+            value = np.array(value, dtype=np.float32)
+            value.flags.writeable = False
+        frozen[name] = value
+    return frozen
+
+
+class ResultCache(StageCache):
+    """Two-tier cache of the predictions of the network.
+
+    The last max_entries results used are kept in memory and, if cache_dir is
+    given, all the results are also stored on disk as .npz files (float32
+    predictions and the strings needed to format them).
+    A result is a dictionary of strings and of arrays, which must not be modified.
+    The memory tier can be shared by the threads of a process
+    """
+
+    SUFFIX = ".npz"
+    NAME = "result"
+
+    def __init__(
+        self, cache_dir=None, max_size=DEFAULT_MAX_SIZE, max_entries=MEMORY_ENTRIES
+    ):
+        self.memory = collections.OrderedDict()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            super().__init__(cache_dir, max_size)
+        else:
+            self.cache_dir = None
+            self.hits = 0
+            self.misses = 0
+
+    def _read(self, fh):
+        with np.load(fh, allow_pickle=False) as npz:
+            return {k: str(v[()]) if v.dtype.kind == "U" else v for k, v in npz.items()}
+
+    def _write(self, value, fh):
+        np.savez(fh, **value)
+
+    def _remember(self, key, value):
+        """Add a result to the memory tier, forgetting the least recently used"""
+        with self._lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def get_key(self, key):
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                metrics.inc("cache_requests_total", cache=self.NAME, result="hit")
+                return value
+
+        if self.cache_dir is None:
+            self.misses += 1
+            metrics.inc("cache_requests_total", cache=self.NAME, result="miss")
+            return None
+
+        value = super().get_key(key)
+        if value is not None:
+            value = _frozen(value)
+            self._remember(key, value)
+        return value
+
+    def put_key(self, key, value):
+        value = _frozen(value)
+        self._remember(key, value)
+        if self.cache_dir is not None:
+            super().put_key(key, value)
+
+
+def split_size(max_size):
+    """Size limits of the StageCache and of the ResultCache sharing a cache
+    folder whose size limit is max_size"""
+    result_size = int(max_size * RESULT_FRACTION)
+    return max_size - result_size, result_size
+
+
+def run_stage(cache, stage, sequences, compute, databases=(), params=""):
+    """Results of a stage for many sequences, as StageCache.run.
+
+    Everything is computed if cache is None
+    """
+    if cache is None:
+        return compute(list(sequences))
+    return cache.run(stage, sequences, compute, databases, params)
+
+
+def cached(cache, stage, sequence, compute, databases=(), params=""):
+    """Result of a stage for one sequence, compute() is only called if it is not
+    in the cache (or if cache is None)"""
+    if cache is not None:
+        value = cache.get(stage, sequence, databases, params)
+        if value is not None:
+            return value
+
+    value = compute()
+    if cache is not None:
+        cache.put(stage, sequence, value, databases, params)
+    return value
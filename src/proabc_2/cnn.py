@@ -1,15 +1,16 @@
+import functools
 import os
 import warnings
 
 import numpy as np
-import pandas as pd
 
+# TensorFlow is only imported when the model is built, so the NumPy engine
+# (proabc_2.cnn_numpy) can run without it
 warnings.filterwarnings("ignore")
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-import tensorflow as tf
-from tensorflow.keras import Model
-from tensorflow.keras import backend as K
-from tensorflow.keras.layers import Conv1D, Dense, Dropout, Flatten, MaxPooling1D
+
+# Available implementations of the network
+ENGINES = ["tf", "numpy"]
 
 """Data processing"""
 
@@ -112,93 +113,90 @@ def valid_X_categories():
     return valid_cat
 
 
+# Order of the features given to the network: loop lengths, then the
+# one-hot encoding of the canonical structures and of the germlines
+LOOP_LENGTH_FEATURES = [
+    "H_HV1_len",
+    "H_HV2_len",
+    "H_HV3_len",
+    "L_HV1_len",
+    "L_HV2_len",
+    "L_HV3_len",
+]
+CATEGORICAL_FEATURES = [
+    "H_CanHV1",
+    "H_CanHV2",
+    "H_CanHV3",
+    "L_CanHV1",
+    "L_CanHV2",
+    "L_CanHV3",
+    "H_Germline",
+    "L_Germline",
+]
+
+
+def compile_feature_schema(valid_cats):
+    """Column of every category of the categorical features in the feature matrix.
+
+    Returns a dictionary {feature: {category: column}} and the number of columns
+    """
+    columns = {}
+    n_columns = len(LOOP_LENGTH_FEATURES)
+    for feature in CATEGORICAL_FEATURES:
+        columns[feature] = {
+            str(cat): n_columns + num for num, cat in enumerate(valid_cats[feature])
+        }
+        n_columns += len(valid_cats[feature])
+    return columns, n_columns
+
+
+FEATURE_COLUMNS, N_FEATURES = compile_feature_schema(valid_X_categories())
+
+
+def feature_values(records, feature):
+    """Values of one feature for a batch of records.
+
+    records = data-frame, dictionary of columns, structured array or list of
+    dictionaries (one per record)
+    """
+    if isinstance(records, (list, tuple)):
+        return np.array([record[feature] for record in records], dtype=object)
+    return np.asarray(records[feature], dtype=object).ravel()
+
+
 def categorize_X_data(a_df):
-    """Categorizes the data into valid categories (valid_cats) which are ready as input into a network."""
-    tmp_data = a_df.copy()
-    valid_cats = valid_X_categories()
-
-    germ_df = pd.concat(
-        [
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["H_Germline"], categories=valid_cats["H_Germline"]
-                ),
-                prefix="H_G",
-            ),
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["L_Germline"], categories=valid_cats["L_Germline"]
-                ),
-                prefix="L_G",
-            ),
-        ],
-        axis=1,
-        sort=False,
-    )
-    H_can_df = pd.concat(
-        [
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["H_CanHV1"].astype(str), categories=valid_cats["H_CanHV1"]
-                ),
-                prefix="H_Can1",
-            ),
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["H_CanHV2"].astype(str), categories=valid_cats["H_CanHV2"]
-                ),
-                prefix="H_Can2",
-            ),
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["H_CanHV3"].astype(str), categories=valid_cats["H_CanHV3"]
-                ),
-                prefix="H_Can3",
-            ),
-        ],
-        axis=1,
-        sort=False,
-    )
+    """Categorizes the data into valid categories (valid_cats) which are ready as input into a network.
 
-    L_can_df = pd.concat(
-        [
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["L_CanHV1"].astype(str), categories=valid_cats["L_CanHV1"]
-                ),
-                prefix="L_Can1",
-            ),
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["L_CanHV2"].astype(str), categories=valid_cats["L_CanHV2"]
-                ),
-                prefix="L_Can2",
-            ),
-            pd.get_dummies(
-                pd.Categorical(
-                    tmp_data["L_CanHV3"].astype(str), categories=valid_cats["L_CanHV3"]
-                ),
-                prefix="L_Can3",
-            ),
-        ],
-        axis=1,
-        sort=False,
-    )
-    HV_len_df = tmp_data.loc[
-        :,
-        ["H_HV1_len", "H_HV2_len", "H_HV3_len", "L_HV1_len", "L_HV2_len", "L_HV3_len"],
-    ]
-    feat_data = pd.concat([H_can_df, L_can_df, germ_df], axis=1)
-    feat_data.index = tmp_data.index
-    return pd.concat([HV_len_df, feat_data], axis=1).to_numpy(dtype=float)
+    Values which are not a valid category are encoded as all zeros.
+    """
+    n_records = len(feature_values(a_df, LOOP_LENGTH_FEATURES[0]))
+    feat_data = np.zeros((n_records, N_FEATURES), dtype=np.float32)
+
+    for num, feature in enumerate(LOOP_LENGTH_FEATURES):
+        feat_data[:, num] = feature_values(a_df, feature).astype(np.float32)
+
+    # Column of the one-hot encoding of every record and categorical feature
+    rows = []
+    cols = []
+    for feature in CATEGORICAL_FEATURES:
+        values = feature_values(a_df, feature).astype(str)
+        uniques, inverse = np.unique(values, return_inverse=True)
+        columns = np.array([FEATURE_COLUMNS[feature].get(v, -1) for v in uniques])
+        feat_cols = columns[inverse.ravel()]
+        valid = feat_cols >= 0
+        rows.append(np.flatnonzero(valid))
+        cols.append(feat_cols[valid])
+
+    feat_data[np.concatenate(rows), np.concatenate(cols)] = 1
+    return feat_data
 
 
 def encode_X_sequence(a_df, encoding, add_position=1):
     """Encodes sequences based on encoding scheme with padding for even length."""
     a_array = a_df.sum(axis=1).values
-    embedding_dic = embedding_read(encoding)
+    lookup, matrix = load_encoding(encoding)
     tmp_data = list(str_padding(a_array, length="max"))
-    return give_score(tmp_data, embedding_dic, add_position)
+    return encode_sequences(tmp_data, lookup, matrix, add_position)
 
 
 def embedding_read(Embedding_file):
@@ -212,6 +210,63 @@ def embedding_read(Embedding_file):
     return embedding_dic
 
 
+def encoding_table(score_dic):
+    """Turns the embedding dictionary into a lookup table and a matrix.
+
+    lookup = array of 256 integers giving the row of the matrix of every
+    (ASCII) residue code, -1 if the residue is not in the embedding
+    matrix = (alphabet x dims) float32 array
+    """
+    alphabet = list(score_dic)
+    lookup = np.full(256, -1, dtype=np.intp)
+    lookup[[ord(j) for j in alphabet]] = np.arange(len(alphabet))
+    matrix = np.array([score_dic[j] for j in alphabet], dtype=np.float32)
+    return lookup, matrix
+
+
+@functools.lru_cache(maxsize=None)
+def load_encoding(Embedding_file):
+    """Read the embedding file once and return its lookup table and matrix"""
+    lookup, matrix = encoding_table(embedding_read(Embedding_file))
+    # Shared between calls, so it must not be modified
+    lookup.flags.writeable = False
+    matrix.flags.writeable = False
+    return lookup, matrix
+
+
+@functools.lru_cache(maxsize=None)
+def position_channel(length):
+    """Normalized position of every residue in a sequence of the given length"""
+    channel = np.arange(length, dtype=np.float32) / length
+    channel.flags.writeable = False
+    return channel
+
+
+def encode_sequences(a_array, lookup, matrix, add_position=0):
+    """Applies the embedding to a batch of sequences of the same length.
+
+    Returns a (N, L, D) float32 array, where D is the number of dimensions of
+    the embedding plus one if the position of the residues is added.
+    """
+    n_seq = len(a_array)
+    length = len(a_array[0]) if n_seq else 0
+    if any(len(i) != length for i in a_array):
+        raise ValueError("All the sequences must have the same length")
+
+    # Turn the sequences into integer codes
+    codes = np.frombuffer("".join(a_array).encode("ascii", "replace"), dtype=np.uint8)
+    rows = lookup[codes].reshape(n_seq, length)
+    if (rows < 0).any():
+        raise KeyError(chr(codes[np.argmax(rows.ravel() < 0)]))
+
+    dims = matrix.shape[1]
+    out = np.empty((n_seq, length, dims + int(bool(add_position))), dtype=np.float32)
+    np.take(matrix, rows, axis=0, out=out[:, :, :dims])
+    if add_position:
+        out[:, :, dims] = position_channel(length)
+    return out
+
+
 def str_padding(a_array, length="max"):
     """Padding using X to each string in a nested list, in order to make all
     strings the same length. Padding is on both sides of the string.
@@ -236,22 +291,21 @@ def give_score(a_array, score_dic, add_position=0):
     Additionally a normalization of the position of the residue within the
     sequence can also be added.
     """
-    if add_position == 0:
-        return np.array([np.array([score_dic[j] for j in i]) for i in a_array])
-    elif add_position == 1:
-        return np.array(
-            [
-                np.array([score_dic[j] + [num / len(i)] for num, j in enumerate(i)])
-                for i in a_array
-            ]
-        )
+    lookup, matrix = encoding_table(score_dic)
+    return encode_sequences(list(a_array), lookup, matrix, add_position)
 
 
 """Model"""
 
 
-def create_proABC_v2(hps):
-    """Creates the model 'proABC_v2' and initializes it."""
+def create_proABC_v2(hps, compile=True):
+    """Creates the model 'proABC_v2' and initializes it.
+
+    The model is compiled for training unless compile=False
+    """
+    import tensorflow as tf
+    from tensorflow.keras import Model
+    from tensorflow.keras.layers import Conv1D, Dense, Dropout, Flatten, MaxPooling1D
 
     class proABC_v2(Model):
         def __init__(self, hps):
@@ -287,7 +341,8 @@ def create_proABC_v2(hps):
             return self.d2(x1)
 
     model = proABC_v2(hps)
-    model.compile(loss=[focal_loss()], metrics=["accuracy"], optimizer="sgd")
+    if compile:
+        model.compile(loss=[focal_loss()], metrics=["accuracy"], optimizer="sgd")
 
     return model
 
@@ -297,6 +352,8 @@ def focal_loss(gamma=4, alpha=0.2, mask_val=-1):
 
     Written by Martin Closter Jespersen.
     """
+    import tensorflow as tf
+    from tensorflow.keras import backend as K
 
     def focal_loss_fixed(y_true, y_pred):
         y_mask = tf.cast(
@@ -323,20 +380,96 @@ def focal_loss(gamma=4, alpha=0.2, mask_val=-1):
     return focal_loss_fixed
 
 
-def predict(out, hps, model_name, x_data):
-    """Initialize the model with the correct weights and make the predictions"""
+class Predictor:
+    """Inference-only proABC_v2 network.
+
+    The network is built once in its own graph from the known input shapes,
+    the trained weights are restored from the checkpoint and the session is
+    kept open, so predict() can be called any number of times.
+    """
 
-    # Create a vector of 0s in order to initialize the model
-    # The out of the model is a numpy array of length 297 * (number of predicted interactions)
-    y_target = np.zeros((1, out), dtype=int)
-    tf.keras.backend.clear_session()
-    proABC_model = create_proABC_v2(hps)
+    def __init__(self, model_name, hps, seq_shape=(297, 21), n_features=N_FEATURES):
+        import tensorflow as tf
+        from tensorflow.keras import backend as K
 
-    #  Initialize the model with random weights
-    proABC_model.fit(x_data, y_target, epochs=1, verbose=0)
+        self.hps = hps
+        self.graph = tf.Graph()
+        self.session = tf.Session(graph=self.graph)
 
-    # Load in the correct weights from a trained model
-    proABC_model.load_weights(model_name)
+        with self.graph.as_default(), self.session.as_default():
+            # Dropout layers behave as in inference
+            K.set_learning_phase(0)
+
+            self.model = create_proABC_v2(hps, compile=False)
+
+            # Calling the model on placeholders creates its variables
+            self.x_seq = tf.placeholder(
+                tf.float32, shape=(None,) + tuple(seq_shape), name="x_seq"
+            )
+            self.x_feat = tf.placeholder(
+                tf.float32, shape=(None, n_features), name="x_feat"
+            )
+            self.y_pred = self.model((self.x_seq, self.x_feat))
+
+            # Load in the correct weights from a trained model
+            self.model.load_weights(model_name)
+
+        self.graph.finalize()
+
+    def predict(self, x_data):
+        """Make the predictions for a batch of encoded sequences and features"""
+        seq_data, feat_data = x_data
+        n_batch = self.hps["N_BATCH"]
+
+        y_pred = [np.zeros((0, self.hps["y_out"]), dtype=np.float32)]
+        for start in range(0, len(seq_data), n_batch):
+            y_pred.append(
+                self.session.run(
+                    self.y_pred,
+                    feed_dict={
+                        self.x_seq: seq_data[start : start + n_batch],
+                        self.x_feat: feat_data[start : start + n_batch],
+                    },
+                )
+            )
+
+        return np.concatenate(y_pred, axis=0)
+
+    def close(self):
+        """Release the session of the network"""
+        self.session.close()
+
+
+_predictors = {}
+
+
+def get_predictor(model_name, hps, seq_shape, n_features, engine="tf"):
+    """Return the predictor of a model, which is created only once per process.
+
+    engine = "tf" (cnn.Predictor) or "numpy" (cnn_numpy.NumpyPredictor)
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', choose from {ENGINES}")
+
+    key = (engine, model_name, hps["y_out"], tuple(seq_shape), n_features)
+    if key not in _predictors:
+        if engine == "numpy":
+            from proabc_2.cnn_numpy import NumpyPredictor
+
+            _predictors[key] = NumpyPredictor(model_name, hps, seq_shape, n_features)
+        else:
+            _predictors[key] = Predictor(model_name, hps, seq_shape, n_features)
+    return _predictors[key]
+
+
+def predict(out, hps, model_name, x_data, engine="tf"):
+    """Initialize the model with the correct weights and make the predictions"""
+    seq_data, feat_data = x_data
+    hps = dict(hps, y_out=out)
+
+    proABC_model = get_predictor(
+        model_name, hps, seq_data.shape[1:], feat_data.shape[1], engine
+    )
 
     # Make predictions
     y_pred = proABC_model.predict(x_data)
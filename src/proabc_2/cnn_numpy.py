@@ -0,0 +1,375 @@
+"""
+NumPy implementation of the forward pass of the proABC_v2 network.
+
+The trained variables are read once from the data/proABC_v2 checkpoint
+(TensorFlow TensorBundle format, parsed here without TensorFlow) or from an
+exported .npz file, and the whole batch is predicted with vectorized
+convolutions, poolings and matrix products.
+
+The outputs are meant to match the ones of cnn.Predictor within TOLERANCE
+(absolute difference of the predicted probabilities). This is checked by
+tests/test_cnn_numpy.py::test_tf_parity, which needs TensorFlow and all the
+shards of the checkpoint; the forward pass is otherwise only tested against a
+reference implementation with random weights, so the parity with TensorFlow
+on the trained network is unverified where these are not available.
+"""
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+# Maximum absolute difference with the TensorFlow predictions (see test_tf_parity)
+TOLERANCE = 1e-5
+
+# Layers of the network and their variables
+LAYERS = ["conv11", "conv12", "conv2", "d1", "d2"]
+VARIABLES = ["kernel", "bias"]
+
+# Positions of chain H in the encoded sequences, the rest belongs to chain L
+H_LENGTH = 153
+
+"""Checkpoint reader"""
+
+# Magic number at the end of the index file (LevelDB table format)
+TABLE_MAGIC = 0xDB4775248B80FB57
+FOOTER_LENGTH = 48
+
+# TensorFlow data types of the variables which can be read
+TF_DTYPES = {
+    1: np.dtype("<f4"),  # DT_FLOAT
+    2: np.dtype("<f8"),  # DT_DOUBLE
+    3: np.dtype("<i4"),  # DT_INT32
+    9: np.dtype("<i8"),  # DT_INT64
+}
+
+
+def _read_varint(buf, pos):
+    """Decode a base 128 varint. Returns the value and the new position"""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_fields(buf):
+    """Decode the fields of a protocol buffer message.
+
+    Returns a list of (field number, value), where value is an int or bytes
+    """
+    fields = []
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _read_varint(buf, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            value = struct.unpack_from("<Q", buf, pos)[0]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = bytes(buf[pos : pos + length])
+            pos += length
+        elif wire_type == 5:
+            value = struct.unpack_from("<I", buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protocol buffer wire type {wire_type}")
+        fields.append((number, value))
+    return fields
+
+
+def _read_block(data, handle):
+    """Return the (key, value) entries of a block of the index file"""
+    offset, pos = _read_varint(handle, 0)
+    size, _ = _read_varint(handle, pos)
+
+    compression = data[offset + size]
+    if compression != 0:
+        raise ValueError("Compressed checkpoint index files are not supported")
+
+    block = data[offset : offset + size]
+    num_restarts = struct.unpack_from("<I", block, size - 4)[0]
+    end = size - 4 * (num_restarts + 1)
+
+    entries = []
+    key = b""
+    pos = 0
+    while pos < end:
+        shared, pos = _read_varint(block, pos)
+        non_shared, pos = _read_varint(block, pos)
+        value_length, pos = _read_varint(block, pos)
+        key = key[:shared] + bytes(block[pos : pos + non_shared])
+        pos += non_shared
+        entries.append((key, bytes(block[pos : pos + value_length])))
+        pos += value_length
+    return entries
+
+
+def _parse_entry(value):
+    """Decode a BundleEntryProto: data type, shape, shard, offset and size"""
+    entry = {"dtype": 0, "shape": [], "shard_id": 0, "offset": 0, "size": 0}
+    for number, field in _read_fields(value):
+        if number == 1:
+            entry["dtype"] = field
+        elif number == 2:
+            for dim_number, dim in _read_fields(field):
+                if dim_number == 2:
+                    size = dict(_read_fields(dim)).get(1, 0)
+                    entry["shape"].append(size)
+        elif number == 3:
+            entry["shard_id"] = field
+        elif number == 4:
+            entry["offset"] = field
+        elif number == 5:
+            entry["size"] = field
+    return entry
+
+
+def read_checkpoint_index(model_name):
+    """Read the index of a TensorFlow checkpoint.
+
+    Returns the number of data shards and a dictionary with the name of every
+    saved tensor as key and its BundleEntryProto (as a dictionary) as value
+    """
+    with open(model_name + ".index", "rb") as f:
+        data = f.read()
+
+    footer = data[-FOOTER_LENGTH:]
+    if struct.unpack("<Q", footer[-8:])[0] != TABLE_MAGIC:
+        raise ValueError(f"{model_name}.index is not a TensorFlow checkpoint index")
+
+    # Skip the handle of the meta-index block to get the one of the index block
+    _, pos = _read_varint(footer, 0)
+    _, pos = _read_varint(footer, pos)
+    index_handle = footer[pos:]
+
+    num_shards = 1
+    entries = {}
+    for _, block_handle in _read_block(data, index_handle):
+        for key, value in _read_block(data, block_handle):
+            if key == b"":
+                # Header of the bundle
+                num_shards = dict(_read_fields(value)).get(1, 1)
+            else:
+                entries[key.decode()] = _parse_entry(value)
+
+    return num_shards, entries
+
+
+def read_checkpoint(model_name, names=None):
+    """Read the tensors of a TensorFlow checkpoint as NumPy arrays.
+
+    model_name = prefix of the checkpoint files (e.g. data/proABC_v2)
+    names = names of the tensors to read, all the numerical ones by default
+    """
+    num_shards, entries = read_checkpoint_index(model_name)
+    if names is None:
+        names = [k for k, v in entries.items() if v["dtype"] in TF_DTYPES]
+
+    tensors = {}
+    shards = {}
+    try:
+        for name in names:
+            if name not in entries:
+                raise KeyError(f"{name} not found in checkpoint {model_name}")
+            entry = entries[name]
+            if entry["dtype"] not in TF_DTYPES:
+                raise ValueError(f"Unsupported data type of {name} in {model_name}")
+
+            shard_id = entry["shard_id"]
+            if shard_id not in shards:
+                shards[shard_id] = open(
+                    f"{model_name}.data-{shard_id:05d}-of-{num_shards:05d}", "rb"
+                )
+            fh = shards[shard_id]
+            fh.seek(entry["offset"])
+            buf = fh.read(entry["size"])
+
+            tensors[name] = np.frombuffer(buf, dtype=TF_DTYPES[entry["dtype"]]).reshape(
+                entry["shape"]
+            )
+    finally:
+        for fh in shards.values():
+            fh.close()
+
+    return tensors
+
+
+def checkpoint_name(layer, variable):
+    """Name of a variable of the network in the object-based checkpoint"""
+    return f"{layer}/{variable}/.ATTRIBUTES/VARIABLE_VALUE"
+
+
+def load_weights(model_name):
+    """Load the variables of the network.
+
+    model_name = prefix of the TensorFlow checkpoint or path to a .npz file
+    Returns a dictionary with 'layer/variable' as key and a float32 array as value
+    """
+    if model_name.endswith(".npz"):
+        with np.load(model_name) as npz:
+            weights = {k: npz[k] for k in npz.files}
+    else:
+        names = {
+            f"{layer}/{var}": checkpoint_name(layer, var)
+            for layer in LAYERS
+            for var in VARIABLES
+        }
+        tensors = read_checkpoint(model_name, list(names.values()))
+        weights = {k: tensors[v] for k, v in names.items()}
+
+    missing = [
+        f"{layer}/{var}"
+        for layer in LAYERS
+        for var in VARIABLES
+        if f"{layer}/{var}" not in weights
+    ]
+    if missing:
+        raise KeyError("Missing variable(s) in {}: {}".format(model_name, missing))
+
+    return {k: np.ascontiguousarray(v, dtype=np.float32) for k, v in weights.items()}
+
+
+def export_npz(model_name, npz_file):
+    """Export the variables of the network from a checkpoint to a .npz file"""
+    weights = load_weights(model_name)
+    np.savez(npz_file, **weights)
+
+
+"""Layers"""
+
+
+def conv1d(x, kernel, bias):
+    """1D convolution ('valid' padding, stride 1) of a batch.
+
+    x = (batch, length, channels), kernel = (width, channels, filters)
+    """
+    width = kernel.shape[0]
+    out_len = x.shape[1] - width + 1
+    out = np.empty((x.shape[0], out_len, kernel.shape[2]), dtype=np.float32)
+    out[...] = bias
+    for j in range(width):
+        out += x[:, j : j + out_len, :] @ kernel[j]
+    return out
+
+
+def max_pooling1d(x, pool_size, strides):
+    """1D max pooling ('valid' padding) of a batch"""
+    n_out = (x.shape[1] - pool_size) // strides + 1
+    windows = np.arange(n_out)[:, None] * strides + np.arange(pool_size)
+    return x[:, windows, :].max(axis=2)
+
+
+def elu(x):
+    """Exponential linear unit"""
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+
+def sigmoid(x):
+    """Logistic function"""
+    return 1 / (1 + np.exp(-x))
+
+
+class NumpyPredictor:
+    """proABC_v2 network running on NumPy.
+
+    It has the same interface as cnn.Predictor
+    """
+
+    def __init__(self, model_name, hps, seq_shape=(297, 21), n_features=110):
+        self.hps = hps
+        self.weights = load_weights(model_name)
+        self.check_shapes(seq_shape, n_features)
+
+    def check_shapes(self, seq_shape, n_features):
+        """Check that the variables fit the shape of the inputs"""
+        w = self.weights
+        length, channels = seq_shape
+
+        if w["conv11/kernel"].shape[1] != channels:
+            raise ValueError(
+                f"The network expects {w['conv11/kernel'].shape[1]} values per residue, got {channels}"
+            )
+
+        # Length of the flattened convolutional output
+        len_h = (H_LENGTH - 2 - 10) // 3 + 1
+        len_l = (length - H_LENGTH - 2 - 10) // 3 + 1
+        len_2 = (len_h + len_l - 2 - 6) // 3 + 1
+        n_conv = len_2 * w["conv2/kernel"].shape[2]
+
+        if w["d1/kernel"].shape[0] != n_conv + n_features:
+            raise ValueError(
+                f"The network expects {w['d1/kernel'].shape[0] - n_conv} features, got {n_features}"
+            )
+        if w["d2/kernel"].shape[1] != self.hps["y_out"]:
+            raise ValueError(
+                f"The network has {w['d2/kernel'].shape[1]} outputs, {self.hps['y_out']} expected"
+            )
+
+    def forward(self, x_seq, x_feat):
+        """Forward pass of the network (as cnn.create_proABC_v2 in inference)"""
+        w = self.weights
+
+        x11, x12 = x_seq[:, :H_LENGTH], x_seq[:, H_LENGTH:]
+        x11 = max_pooling1d(
+            elu(conv1d(x11, w["conv11/kernel"], w["conv11/bias"])), 10, 3
+        )
+        x12 = max_pooling1d(
+            elu(conv1d(x12, w["conv12/kernel"], w["conv12/bias"])), 10, 3
+        )
+
+        x1 = np.concatenate([x11, x12], axis=1)
+        x1 = max_pooling1d(elu(conv1d(x1, w["conv2/kernel"], w["conv2/bias"])), 6, 3)
+
+        x1 = np.concatenate([x1.reshape(x1.shape[0], -1), x_feat], axis=1)
+        x1 = elu(x1 @ w["d1/kernel"] + w["d1/bias"])
+
+        return sigmoid(x1 @ w["d2/kernel"] + w["d2/bias"])
+
+    def predict(self, x_data):
+        """Make the predictions for a batch of encoded sequences and features"""
+        seq_data, feat_data = x_data
+        n_batch = self.hps["N_BATCH"]
+
+        x_seq = np.asarray(seq_data, dtype=np.float32)
+        x_feat = np.asarray(feat_data, dtype=np.float32)
+
+        y_pred = [np.zeros((0, self.hps["y_out"]), dtype=np.float32)]
+        for start in range(0, len(x_seq), n_batch):
+            y_pred.append(
+                self.forward(
+                    x_seq[start : start + n_batch], x_feat[start : start + n_batch]
+                )
+            )
+
+        return np.concatenate(y_pred, axis=0)
+
+    def close(self):
+        """Nothing to release, present for compatibility with cnn.Predictor"""
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Export the variables of the proABC_v2 network to a .npz file"
+    )
+    parser.add_argument("checkpoint", help="Prefix of the TensorFlow checkpoint")
+    parser.add_argument("npz", help="Output .npz file")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.checkpoint + ".index"):
+        parser.error(f"{args.checkpoint}.index not found")
+
+    export_npz(args.checkpoint, args.npz)
+
+
+if __name__ == "__main__":
+    main()
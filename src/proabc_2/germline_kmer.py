@@ -0,0 +1,409 @@
+"""
+Germline assignment without igblastp.
+
+The V genes of a germline database (database/IGHVp.fasta, IGKVp.fasta or
+IGLVp.fasta) are indexed once by their k-mers. The candidates of a chain are
+the germlines sharing the most k-mers with it and the assigned germline is
+the candidate with the best local alignment score (BLOSUM62 and gap costs of
+igblastp), calculated for all the candidates at once. Only the IGxVn-Species
+label of the germline is used by the network, see jobinput.germline_label.
+
+The index can be saved to a folder and memory-mapped, so that it is built
+only once for many processes.
+"""
+
+import argparse
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+from proabc_2.profile_hmm import AMINO_ACIDS, RESIDUE_INDEX
+
+# Length of the indexed k-mers
+KMER_SIZE = 3
+
+# Candidates aligned to every chain: the germlines sharing the most k-mers
+# with the chain among the N_LABELS best germline labels (IGxVn-Species)
+N_LABELS = 12
+N_PER_LABEL = 4
+
+# Minimum local alignment score of a hit
+MIN_SCORE = 50
+
+# Gap costs of igblastp: a gap of length n costs GAP_OPEN + n * GAP_EXTEND
+GAP_OPEN = 11
+GAP_EXTEND = 1
+
+# Half width of the band of diagonals of the local alignments
+BAND = 12
+
+# Maximum number of chains compared at once with the candidates
+CHUNK_SIZE = 32
+
+# Residue codes of the non standard residues and of the padding
+GAP = len(AMINO_ACIDS)
+PAD = GAP + 1
+
+# Substitution scores of the amino acids (BLOSUM62), in the order of AMINO_ACIDS
+# fmt: off
+BLOSUM62 = [
+    [ 4,  0, -2, -1, -2,  0, -2, -1, -1, -1, -1, -2, -1, -1, -1,  1,  0,  0, -3, -2],  # A
+    [ 0,  9, -3, -4, -2, -3, -3, -1, -3, -1, -1, -3, -3, -3, -3, -1, -1, -1, -2, -2],  # C
+    [-2, -3,  6,  2, -3, -1, -1, -3, -1, -4, -3,  1, -1,  0, -2,  0, -1, -3, -4, -3],  # D
+    [-1, -4,  2,  5, -3, -2,  0, -3,  1, -3, -2,  0, -1,  2,  0,  0, -1, -2, -3, -2],  # E
+    [-2, -2, -3, -3,  6, -3, -1,  0, -3,  0,  0, -3, -4, -3, -3, -2, -2, -1,  1,  3],  # F
+    [ 0, -3, -1, -2, -3,  6, -2, -4, -2, -4, -3,  0, -2, -2, -2,  0, -2, -3, -2, -3],  # G
+    [-2, -3, -1,  0, -1, -2,  8, -3, -1, -3, -2,  1, -2,  0,  0, -1, -2, -3, -2,  2],  # H
+    [-1, -1, -3, -3,  0, -4, -3,  4, -3,  2,  1, -3, -3, -3, -3, -2, -1,  3, -3, -1],  # I
+    [-1, -3, -1,  1, -3, -2, -1, -3,  5, -2, -1,  0, -1,  1,  2,  0, -1, -2, -3, -2],  # K
+    [-1, -1, -4, -3,  0, -4, -3,  2, -2,  4,  2, -3, -3, -2, -2, -2, -1,  1, -2, -1],  # L
+    [-1, -1, -3, -2,  0, -3, -2,  1, -1,  2,  5, -2, -2,  0, -1, -1, -1,  1, -1, -1],  # M
+    [-2, -3,  1,  0, -3,  0,  1, -3,  0, -3, -2,  6, -2,  0,  0,  1,  0, -3, -4, -2],  # N
+    [-1, -3, -1, -1, -4, -2, -2, -3, -1, -3, -2, -2,  7, -1, -2, -1, -1, -2, -4, -3],  # P
+    [-1, -3,  0,  2, -3, -2,  0, -3,  1, -2,  0,  0, -1,  5,  1,  0, -1, -2, -2, -1],  # Q
+    [-1, -3, -2,  0, -3, -2,  0, -3,  2, -2, -1,  0, -2,  1,  5, -1, -1, -3, -3, -2],  # R
+    [ 1, -1,  0,  0, -2,  0, -1, -2,  0, -2, -1,  1, -1,  0, -1,  4,  1, -2, -3, -2],  # S
+    [ 0, -1, -1, -1, -2, -2, -2, -1, -1, -1, -1,  0, -1, -1, -1,  1,  5,  0, -2, -2],  # T
+    [ 0, -1, -3, -2, -1, -3, -3,  3, -2,  1,  1, -3, -2, -2, -3, -2,  0,  4, -3, -1],  # V
+    [-3, -2, -4, -3,  1, -2, -2, -3, -3, -2, -1, -4, -4, -2, -3, -3, -2, -3, 11,  2],  # W
+    [-2, -2, -3, -2,  3, -3,  2, -1, -2, -1, -1, -2, -3, -1, -2, -2, -2, -1,  2,  7],  # Y
+]
+# fmt: on
+
+# Scores of all the residue codes: -1 for the non standard residues (as X) and
+# a large penalty for the padding, which stops the alignments
+SCORES = np.full((PAD + 1, PAD + 1), -1, dtype=np.int32)
+SCORES[:GAP, :GAP] = BLOSUM62
+SCORES[PAD, :] = SCORES[:, PAD] = -1000
+
+# Arrays of a saved index
+INDEX_ARRAYS = ["offsets", "postings", "residues", "labels"]
+
+
+def read_fasta(filename):
+    """Read the headers and the sequences of a FASTA file"""
+    headers = []
+    sequences = []
+    with open(filename) as fhIn:
+        for line in fhIn:
+            line = line.strip()
+            if line.startswith(">"):
+                headers.append(line[1:])
+                sequences.append("")
+            elif line and headers:
+                sequences[-1] += line.upper()
+    return headers, sequences
+
+
+def encode(sequences, length=None):
+    """Residue codes of the sequences, padded with PAD.
+
+    Returns a (N, L) uint8 array and the length of every sequence
+    """
+    lengths = np.array([len(s) for s in sequences], dtype=np.int32)
+    if length is None:
+        length = max(lengths, default=0)
+    residues = np.full((len(sequences), length), PAD, dtype=np.uint8)
+    for num, seq in enumerate(sequences):
+        buf = np.frombuffer(seq.encode("ascii", "replace"), dtype=np.uint8)
+        residues[num, : len(buf)] = RESIDUE_INDEX[buf]
+    return residues, lengths
+
+
+def kmer_codes(residues, kmer_size=KMER_SIZE):
+    """Code of the k-mers starting at every position of the sequences.
+
+    Returns a (N, L - k + 1) array, -1 for the k-mers with a non standard residue
+    """
+    n_windows = max(residues.shape[1] - kmer_size + 1, 0)
+    codes = np.zeros((residues.shape[0], n_windows), dtype=np.int64)
+    valid = np.ones(codes.shape, dtype=bool)
+    for j in range(kmer_size):
+        window = residues[:, j : j + n_windows].astype(np.int64)
+        codes = codes * GAP + np.minimum(window, GAP - 1)
+        valid &= window < GAP
+    return np.where(valid, codes, -1)
+
+
+class KmerIndex:
+    """Inverted index of the k-mers of a germline database.
+
+    subjects = headers of the germline sequences
+    offsets, postings = germlines containing every k-mer code c, as
+    postings[offsets[c]:offsets[c + 1]]
+    residues = encoded germline sequences
+    labels = index of the germline label of every germline
+    """
+
+    def __init__(self, subjects, offsets, postings, residues, labels, kmer_size):
+        self.subjects = subjects
+        self.offsets = offsets
+        self.postings = postings
+        self.residues = residues
+        self.labels = labels
+        self.kmer_size = kmer_size
+
+    @classmethod
+    def build(cls, ig_database, kmer_size=KMER_SIZE):
+        """Index the sequences of a FASTA file"""
+        import proabc_2.jobinput as ji
+
+        subjects, sequences = read_fasta(ig_database)
+        residues, _ = encode(sequences)
+        _, labels = np.unique(
+            [ji.germline_label(subject) for subject in subjects], return_inverse=True
+        )
+        codes = kmer_codes(residues, kmer_size)
+
+        # Unique (k-mer, germline) pairs, sorted by k-mer
+        germ = np.broadcast_to(np.arange(len(subjects))[:, None], codes.shape)
+        pairs = np.unique(codes[codes >= 0] * len(subjects) + germ[codes >= 0])
+        postings = (pairs % len(subjects)).astype(np.int32)
+        counts = np.bincount(pairs // len(subjects), minlength=GAP**kmer_size)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return cls(
+            subjects, offsets, postings, residues, labels.astype(np.int32), kmer_size
+        )
+
+    def save(self, index_dir):
+        """Write the index to a folder, as .npy files and a list of subjects"""
+        os.makedirs(index_dir, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(index_dir, "subjects.txt"), "w") as fh:
+            fh.write("\n".join(self.subjects) + "\n")
+
+    @classmethod
+    def load(cls, index_dir, kmer_size=KMER_SIZE):
+        """Read an index written by save, with its arrays memory-mapped"""
+        arrays = [
+            np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in INDEX_ARRAYS
+        ]
+        with open(os.path.join(index_dir, "subjects.txt")) as fh:
+            subjects = fh.read().splitlines()
+        return cls(subjects, *arrays, kmer_size)
+
+    def shared_kmers(self, codes):
+        """Number of distinct k-mers shared by the sequences and every germline.
+
+        codes = (N, W) k-mer codes of the sequences, as given by kmer_codes
+        Returns a (N, number of germlines) array
+        """
+        n_subjects = len(self.subjects)
+        shared = np.zeros((codes.shape[0], n_subjects), dtype=np.int32)
+        for num, row in enumerate(codes):
+            row = np.unique(row[row >= 0])
+            start, stop = self.offsets[row], self.offsets[row + 1]
+            # Concatenate the postings of all the k-mers of the sequence
+            size = stop - start
+            positions = np.arange(size.sum()) + np.repeat(
+                start - np.cumsum(size) + size, size
+            )
+            shared[num] = np.bincount(self.postings[positions], minlength=n_subjects)
+        return shared
+
+    def diagonals(self, residues, candidates):
+        """Diagonal with the most identical residues of every pair.
+
+        residues = (N, L) encoded sequences
+        candidates = (N, C) indices of the candidate germlines of every sequence
+        Returns the (N, C) offsets of the diagonals (germline - query position)
+        """
+        germ = np.asarray(self.residues)[candidates]
+        length_q = residues.shape[1]
+
+        # Germline positions aligned with the sequence on every diagonal
+        # (a read-only view of the padded germlines, sliding_window_view needs
+        # numpy 1.20)
+        padding = ((0, 0), (0, 0), (length_q - 1, length_q - 1))
+        padded = np.pad(germ, padding, constant_values=PAD)
+        n_diagonals = padded.shape[2] - length_q + 1
+        windows = np.lib.stride_tricks.as_strided(
+            padded,
+            shape=padded.shape[:2] + (n_diagonals, length_q),
+            strides=padded.strides + padded.strides[2:],
+            writeable=False,
+        )
+        query = np.where(residues < GAP, residues, PAD + 1)[:, None, None, :]
+        counts = (windows == query).sum(axis=3, dtype=np.int32)
+        return counts.argmax(axis=2) - length_q + 1
+
+    def local_scores(self, residues, candidates):
+        """Local alignment scores of the sequences and their candidate germlines.
+
+        Smith-Waterman with affine gaps in a band of 2 * BAND + 1 diagonals
+        around the one given by diagonals, one position of the sequences at a
+        time for all the pairs.
+        residues = (N, L) encoded sequences
+        candidates = (N, C) indices of the candidate germlines of every sequence
+        Returns the (N, C) best scores
+        """
+        germ = np.asarray(self.residues)[candidates]
+        length_q = residues.shape[1]
+        offsets = np.arange(-BAND, BAND + 1)
+        columns = offsets + BAND
+
+        # Band of every pair in the germline padded on both sides, as indices
+        # of the flattened germlines
+        padding = ((0, 0), (0, 0), (length_q + BAND, length_q + BAND))
+        germ = np.pad(germ, padding, constant_values=PAD)
+        first = self.diagonals(residues, candidates) + length_q + BAND
+        first = (
+            first + np.arange(candidates.size).reshape(candidates.shape) * germ.shape[2]
+        )
+        first = first[..., None] + offsets
+        germ = germ.ravel()
+
+        shape = first.shape
+        best = np.zeros(candidates.shape, dtype=np.int32)
+        prev = np.zeros(shape, dtype=np.int32)
+        gap_q = np.full(shape, -GAP_OPEN, dtype=np.int32)
+        for i in range(length_q):
+            score = SCORES[residues[:, i, None, None], germ[first + i]]
+
+            # Gap in the germline (same germline position in the previous row)
+            up = np.full(shape, -GAP_OPEN, dtype=np.int32)
+            up[..., :-1] = np.maximum(
+                prev[..., 1:] - GAP_OPEN - GAP_EXTEND, gap_q[..., 1:] - GAP_EXTEND
+            )
+            gap_q = up
+            row = np.maximum(np.maximum(prev + score, gap_q), 0)
+
+            # Gap in the sequence, from any previous germline position of the row
+            gap_g = np.maximum.accumulate(row + GAP_EXTEND * columns, axis=2)
+            row[..., 1:] = np.maximum(
+                row[..., 1:],
+                gap_g[..., :-1] - GAP_OPEN - GAP_EXTEND * columns[1:],
+            )
+
+            best = np.maximum(best, row.max(axis=2))
+            prev = row
+        return best
+
+    def candidates(self, shared):
+        """Germlines with the most shared k-mers among the best germline labels.
+
+        shared = (N, number of germlines) shared k-mers, as given by shared_kmers
+        Returns a (N, N_LABELS * N_PER_LABEL) array of germline indices, padded
+        with the best germline
+        """
+        candidates = np.empty((len(shared), N_LABELS * N_PER_LABEL), dtype=np.intp)
+        for num, row in enumerate(shared):
+            # Germlines sorted by shared k-mers and by position in the database
+            order = np.argsort(-row, kind="stable")
+            labels = self.labels[order]
+
+            # Best labels, in the order of their best germline
+            _, first = np.unique(labels, return_index=True)
+            best = labels[np.sort(first)[:N_LABELS]]
+
+            # Rank of every germline among the ones of the same label
+            selected = np.isin(labels, best)
+            order, labels = order[selected], labels[selected]
+            by_label = np.argsort(labels, kind="stable")
+            start = np.searchsorted(labels[by_label], labels[by_label])
+            rank = np.empty(len(labels), dtype=np.intp)
+            rank[by_label] = np.arange(len(labels)) - start
+
+            chosen = order[rank < N_PER_LABEL]
+            candidates[num] = chosen[0]
+            candidates[num, : len(chosen)] = chosen
+        return candidates
+
+    def assign(self, sequences):
+        """Germline with the best local alignment of every sequence.
+
+        Returns the list of the subjects of the best germlines (empty if no
+        candidate has a score of at least MIN_SCORE)
+        """
+        subjects = []
+        for start in range(0, len(sequences), CHUNK_SIZE):
+            residues, _ = encode(sequences[start : start + CHUNK_SIZE])
+            shared = self.shared_kmers(kmer_codes(residues, self.kmer_size))
+            candidates = self.candidates(shared)
+            scores = self.local_scores(residues, candidates)
+
+            best = np.argmax(scores, axis=1)
+            for num, cand in enumerate(best):
+                if scores[num, cand] >= MIN_SCORE:
+                    subjects.append(self.subjects[candidates[num, cand]])
+                else:
+                    subjects.append("")
+        return subjects
+
+
+@functools.lru_cache(maxsize=None)
+def _load_index(ig_database, index_dir):
+    if index_dir is None:
+        return KmerIndex.build(ig_database)
+
+    # One folder per database, rebuilt if the database is more recent
+    folder = os.path.join(index_dir, f"{os.path.basename(ig_database)}.k{KMER_SIZE}")
+    stamp = os.path.join(folder, "subjects.txt")
+    if not os.path.isfile(stamp) or os.path.getmtime(stamp) < os.path.getmtime(
+        ig_database
+    ):
+        KmerIndex.build(ig_database).save(folder)
+    return KmerIndex.load(folder)
+
+
+def load_index(ig_database, index_dir=None):
+    """Index of a germline database, built only once per process.
+
+    index_dir = folder where the index is saved and memory-mapped from
+    (default: kept in memory)
+    """
+    if index_dir is not None:
+        index_dir = os.path.abspath(index_dir)
+    return _load_index(os.path.abspath(ig_database), index_dir)
+
+
+def agreement(sequences, ig_database, work_dir):
+    """Compare the germlines with the ones of igblastp.
+
+    sequences = dictionary with the query id as key and the protein sequence as value
+    Returns the fraction of identical germlines and the list of the query ids
+    with different germlines
+    """
+    import proabc_2.jobinput as ji
+
+    reference, _ = ji.germline_batch(sequences, ig_database, work_dir, "agreement")
+    native, _ = ji.germline_batch(
+        sequences, ig_database, work_dir, "agreement", native=True
+    )
+
+    different = [q for q in sequences if reference.get(q) != native.get(q)]
+    return 1 - len(different) / max(len(sequences), 1), different
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Check the k-mer germlines against the ones of igblastp"
+    )
+    parser.add_argument("fasta", help="FASTA file with the sequences of the chains")
+    parser.add_argument(
+        "isotype", choices=["H", "K", "L"], help="Isotype of all the chains"
+    )
+    args = parser.parse_args()
+
+    database = os.path.join(
+        os.path.dirname(__file__), "database", f"IG{args.isotype}Vp.fasta"
+    )
+    headers, seqs = read_fasta(args.fasta)
+    sequences = dict(zip(headers, seqs))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rate, different = agreement(sequences, database, work_dir + "/")
+
+    print(f"{rate:.2%} of {len(sequences)} germlines identical to igblastp")
+    for query_id in different:
+        print(query_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,157 @@ import re
 import subprocess as sub
 from pathlib import Path
 
-from Bio.Seq import Seq
+from proabc_2 import metrics, trace
+from proabc_2.cache import cached
+from proabc_2.germline_kmer import load_index
+from proabc_2.ParseHmmer import (
+    parse_align,
+    parse_align_multi,
+    parse_hmmscan,
+    parse_hmmscan_models,
+    parse_hmmscan_queries,
+)
+from proabc_2.profile_hmm import align_sequences, scan_sequences
+
+from . import tool_path
+
+# Folder of the bundled profile HMMs
+MARKOV_MODELS = os.path.join(os.path.dirname(__file__), "MarkovModels/")
+
+# Profile HMMs of the chain isotypes: file and name of the model
+HMM_FILES = {"H": "HEAVY.hmm", "K": "KAPPA.hmm", "L": "LAMBDA.hmm"}
+HMM_NAMES = {"H": "selexoneheavy4", "K": "selexonekappa", "L": "selexonelambda2"}
+
+# Pressed database containing the three models above
+HMM_DATABASE = "CHAINS.hmm"
+
+# Extensions of the binary files written by hmmpress
+PRESSED_SUFFIXES = [".h3f", ".h3i", ".h3m", ".h3p"]
+
+# Options of hmmscan reading the sequences from the standard input and writing
+# the domain table (instead of the main output) to the standard output
+HMMSCAN_PIPE = ["--qformat", "fasta", "-o", os.devnull, "--domtblout", "/dev/stdout"]
+
+# Options of hmmalign reading the sequences from the standard input
+HMMALIGN_PIPE = ["--trim", "--informat", "fasta"]
+
+# E-value threshold to assign a chain to an isotype
+ISOTYPE_THR = float(10e-40)
+
+# Environment variable keeping the input and output of the external tools
+# in files, to debug them
+DEBUG_FILES_ENV = "PROABC2_DEBUG_FILES"
+
+# Reasons why a chain is not assigned to an isotype
+ISOTYPE_ERRORS = {
+    # more than one domain found in the input sequence. HMM failed to align sequence
+    "failed_H": "Alignment failed for chain H:\n{seq}",
+    "failed_K": "Alignment failed for chain L (Kappa):\n{seq}",
+    "failed_L": "Alignment failed for chain L (Lambda):\n{seq}",
+    "not_antibody": "Your input sequence has not been recognized as an antibody. Please check your input: {header}",
+    "single_chain": "Single chain antibody found in {header}. Please provide heavy and light chain as separate sequences.",
+}
+
+# Category of the errors of write_error (and of the failures of the batches),
+# the first pattern found in the message
+ERROR_REASONS = [
+    ("Error with hmmscan", "hmmscan_error"),
+    ("Error with hmmalign", "hmmalign_error"),
+    ("Error in running igblastp", "igblastp_error"),
+    ("No hits found", "no_germline"),
+    ("not been recognized as an antibody", "not_antibody"),
+    ("Single chain antibody", "single_chain"),
+    ("Alignment failed", "alignment_failed"),
+    ("found when", "wrong_chain"),
+    ("missing", "missing_chain"),
+    ("empty", "invalid_input"),
+    ("Missing header", "invalid_input"),
+    ("No sequence present", "invalid_input"),
+    ("More than one header", "invalid_input"),
+    ("Invalid character", "invalid_input"),
+    ("unknown amino acids", "invalid_input"),
+]
+
+
+def work_file(jobid, name):
+    """Path of a file of the working folder of a batch, None if the batch has no
+    folder (nothing is written then)"""
+    return os.path.join(jobid, name) if jobid is not None else None
+
+
+def job_file(jobid, name, work_dir=None):
+    """Path of a working file of a job, in work_dir if given or else in jobid"""
+    if work_dir:
+        return os.path.join(work_dir, name)
+    return jobid + name
+
+
+def hmmer_exec(program):
+    """Path of a HMMER program (hmmscan or hmmalign)"""
+    return str(Path(tool_path("HMMER_PATH"), program))
+
+
+def igblastp_exec():
+    """Path of igblastp, which also needs the IGDATA variable"""
+    tool_path("IGDATA")
+    return str(Path(tool_path("IGBLAST_PATH"), "igblastp"))
+
+
+def translate(seq):
+    """Translate a DNA sequence, removing the stop codons"""
+    # Biopython is only imported for DNA input
+    from Bio.Seq import Seq
+
+    return str(Seq(seq).translate()).replace("*", "")
 
-from proabc_2.ParseHmmer import read_align, readhmmscan
 
-from . import HMMER_PATH, IGBLAST_PATH
+def debug_files():
+    """Check if the input and output of the external tools are kept in files"""
+    return os.environ.get(DEBUG_FILES_ENV, "") not in ("", "0")
 
 
-def read_input_single(file, jobid, hmmpath):
+def run_tool(command, query, jobid, error, debug_names=()):
+    """Run an external tool with the query on its standard input.
+
+    error = beginning of the error message if the tool writes to its standard error
+    debug_names = files where the query and the output are written (None to
+    skip one of them), only if debug_files() is set
+
+    Returns the lines of the standard output
+    """
+    tool = os.path.basename(command[0])
+    metrics.inc("subprocesses_total", tool=tool)
+    with trace.span(tool, sequences=query.count(">")) as span:
+        p = sub.Popen(command, stdin=sub.PIPE, stdout=sub.PIPE, stderr=sub.PIPE)
+        out, errors = p.communicate(query.encode())
+        span["exit_code"] = p.returncode
+    out = out.decode()
+
+    if debug_names and debug_files():
+        for name, content in zip(debug_names, (query, out)):
+            if name:
+                with open(name, "w") as fh:
+                    fh.write(content)
+
+    # If there are errors stop the program
+    if errors:
+        write_error(f"{error}: {errors}", jobid)
+
+    return out.splitlines(keepends=True)
+
+
+def read_input_single(file, jobid, hmmpath, cache=None, work_dir=None):
     """Read input file. Check if sequence is a protein or a nucleotide. Scan and align the sequences.
     Return a dictionary with sequence header as key and heavy and light chain as sequences.
+
+    cache = cache.StageCache of the results of hmmscan and hmmalign
+    work_dir = private folder of the input file and of the working files
+    (default: the input file is in jobid and the working files in its tmp/ folder)
     """
-    thr = float(10e-40)
+    thr = ISOTYPE_THR
     aligned = ""
     isotype = ""
-    filename = f"{jobid}{file}"
+    filename = job_file(jobid, file, work_dir)
     handle = open(filename, "r")
     # can be heavy or light
     header = ""
@@ -41,10 +177,8 @@ def read_input_single(file, jobid, hmmpath):
                     jobid,
                 )
 
-                line = Seq(line.replace("\n", ""))
                 # Translate sequence using biopython
-                line = str(line.translate())
-                line = line.replace("*", "")
+                line = translate(line.replace("\n", ""))
                 # check if translated sequence has strange amino acid inside
                 if not isProtein(line):
                     write_error(
@@ -67,13 +201,14 @@ def read_input_single(file, jobid, hmmpath):
                         jobid,
                     )
 
-            searchInputName = os.path.join(jobid, "tmp", "search.fasta")
-            searchOutputName = os.path.join(jobid, "tmp", "scan.txt")
-            alignOutputName = os.path.join(jobid, "tmp", "align.ali")
-
-            fh = open(searchInputName, "w")
-            fh.write(">" + header + "\n" + line + "\n")
-            fh.close()
+            # The sequence is piped to hmmscan and hmmalign. In debug mode, their
+            # input and output are kept in files named after this chain
+            name = os.path.splitext(file)[0]
+            tmp_dir = work_dir or os.path.join(jobid, "tmp")
+            searchInputName = os.path.join(tmp_dir, f"{name}_search.fasta")
+            searchOutputName = os.path.join(tmp_dir, f"{name}_scan.txt")
+            alignOutputName = os.path.join(tmp_dir, f"{name}_align.ali")
+            query = ">" + header + "\n" + line + "\n"
 
             # Define paths to .hmm files
             if os.path.exists(os.path.join(jobid, "MarkovModels/")):
@@ -82,55 +217,50 @@ def read_input_single(file, jobid, hmmpath):
                 base_dir = os.path.dirname(__file__)
                 src_path = os.path.join(base_dir, "MarkovModels/")
 
-            heavy_hmm = os.path.join(src_path, "HEAVY.hmm")
-            kapp_hmm = os.path.join(src_path, "KAPPA.hmm")
-            lambda_hmm = os.path.join(src_path, "LAMBDA.hmm")
+            heavy_hmm = os.path.join(src_path, HMM_FILES["H"])
+            kapp_hmm = os.path.join(src_path, HMM_FILES["K"])
+            lambda_hmm = os.path.join(src_path, HMM_FILES["L"])
 
             # Calculate evalues
-            evalueH = float(
-                scan(searchInputName, heavy_hmm, hmmpath, jobid, searchOutputName)
-            )
-            evalueK = float(
-                scan(searchInputName, kapp_hmm, hmmpath, jobid, searchOutputName)
-            )
-            evalueL = float(
-                scan(searchInputName, lambda_hmm, hmmpath, jobid, searchOutputName)
+            evalues = cached(
+                cache,
+                "scan",
+                line,
+                lambda: scan_chains(
+                    query,
+                    src_path,
+                    hmmpath,
+                    jobid,
+                    (searchInputName, searchOutputName),
+                ),
+                scan_databases(src_path),
+                "hmmer",
             )
 
-            # more than one domain found in the input sequence. HMM failed to align sequence
-            if not evalueH:
-                message = "Alignment failed for chain H:\n" + line
-                write_error(message, jobid)
-
-            if not evalueK:
-                message = "Alignment failed for chain L (Kappa):\n" + line
-                write_error(message, jobid)
-
-            if not evalueL:
-                message = "Alignment failed for chain L (Lambda):\n" + line
-                write_error(message, jobid)
-
-            if (evalueH > thr) and (evalueK > thr) and (evalueL > thr):
-
-                message = "Your input sequence has not been recognized as an antibody. Please check your input: {}".format(
-                    header
-                )
-                write_error(message, jobid)
-
-            if (evalueH < thr and evalueK < thr) or (evalueH < thr and evalueL < thr):
-                message = "Single chain antibody found in {}. Please provide heavy and light chain as separate sequences.".format(
-                    header
-                )
+            # identify isotype
+            found, error = isotype_from_evalues(evalues, thr)
+            if error:
+                message = ISOTYPE_ERRORS[error].format(header=header, seq=line)
                 write_error(message, jobid)
 
-            # identify isotype
-            if evalueH < thr:
+            if found == "H":
 
                 if file == "light_format.fasta":
                     warn = "Heavy chain found when light expected"
                     write_error(warn, jobid)
-                aligned = align(
-                    searchInputName, heavy_hmm, hmmpath, jobid, alignOutputName
+                aligned = cached(
+                    cache,
+                    "align",
+                    line,
+                    lambda: align(
+                        query,
+                        heavy_hmm,
+                        hmmpath,
+                        jobid,
+                        (searchInputName, alignOutputName),
+                    ),
+                    [heavy_hmm],
+                    "hmmer",
                 )
 
                 if not aligned:
@@ -138,12 +268,23 @@ def read_input_single(file, jobid, hmmpath):
                     write_error(message, jobid)
                 isotype = "H"
 
-            if (evalueK < evalueL) and (evalueK < thr):
+            if found == "K":
                 if file == "heavy_format.fasta":
                     warn = "Kappa chain found when heavy expected."
                     write_error(warn, jobid)
-                aligned = align(
-                    searchInputName, kapp_hmm, hmmpath, jobid, alignOutputName
+                aligned = cached(
+                    cache,
+                    "align",
+                    line,
+                    lambda: align(
+                        query,
+                        kapp_hmm,
+                        hmmpath,
+                        jobid,
+                        (searchInputName, alignOutputName),
+                    ),
+                    [kapp_hmm],
+                    "hmmer",
                 )
 
                 if not aligned:
@@ -151,12 +292,23 @@ def read_input_single(file, jobid, hmmpath):
                     write_error(message, jobid)
                 isotype = "K"
 
-            if (evalueL < evalueK) and (evalueL < thr):
+            if found == "L":
                 if file == "heavy_format.fasta":
                     warn = "Lambda chain found when heavy expected."
                     write_error(warn, jobid)
-                aligned = align(
-                    searchInputName, lambda_hmm, hmmpath, jobid, alignOutputName
+                aligned = cached(
+                    cache,
+                    "align",
+                    line,
+                    lambda: align(
+                        query,
+                        lambda_hmm,
+                        hmmpath,
+                        jobid,
+                        (searchInputName, alignOutputName),
+                    ),
+                    [lambda_hmm],
+                    "hmmer",
                 )
 
                 if not aligned:
@@ -168,6 +320,115 @@ def read_input_single(file, jobid, hmmpath):
     return aligned, isotype
 
 
+def isotype_from_evalues(evalues, thr=ISOTYPE_THR):
+    """Identify the isotype of a chain from its E-values against the H, K and L models.
+
+    Returns the isotype (H, K, L or empty) and the key in ISOTYPE_ERRORS of the
+    reason why the chain has been rejected (empty if it has not)
+    """
+    evalueH = float(evalues["H"])
+    evalueK = float(evalues["K"])
+    evalueL = float(evalues["L"])
+
+    for isotype, evalue in (("H", evalueH), ("K", evalueK), ("L", evalueL)):
+        if not evalue:
+            return "", "failed_" + isotype
+
+    if (evalueH > thr) and (evalueK > thr) and (evalueL > thr):
+        return "", "not_antibody"
+
+    if (evalueH < thr and evalueK < thr) or (evalueH < thr and evalueL < thr):
+        return "", "single_chain"
+
+    if evalueH < thr:
+        return "H", ""
+
+    if (evalueK < evalueL) and (evalueK < thr):
+        return "K", ""
+
+    if (evalueL < evalueK) and (evalueL < thr):
+        return "L", ""
+
+    return "", ""
+
+
+def classify_isotypes(sequences, jobid, src_path=None, cpu=None, native=False):
+    """Identify the isotype of many sequences with a single hmmscan run.
+
+    sequences = dictionary with the query id as key and the protein sequence as value
+    jobid = working folder of the batch (None for no folder)
+    cpu = number of worker threads of hmmscan (default: HMMER default)
+    native = score the sequences with profile_hmm instead of hmmscan (no domains
+    are reported in the diagnostics)
+
+    Returns a dictionary {query id: isotype} (empty isotype if the sequence has been
+    rejected) and a dictionary of diagnostics {query id: {"evalues": {H, K, L},
+    "domains": {H, K, L}, "error": key in ISOTYPE_ERRORS or empty}}
+    """
+    if src_path is None:
+        src_path = MARKOV_MODELS
+
+    # Sequences are given to hmmscan with their index as name
+    query_ids = list(sequences)
+    if not query_ids:
+        return {}, {}
+
+    if native:
+        scores = scan_sequences(
+            os.path.join(src_path, HMM_DATABASE), [sequences[q] for q in query_ids]
+        )
+        isotypes = {}
+        diagnostics = {}
+        for num, query_id in enumerate(query_ids):
+            evalues = {
+                isotype: float(scores[name][num]) for isotype, name in HMM_NAMES.items()
+            }
+            isotypes[query_id], error = isotype_from_evalues(evalues)
+            diagnostics[query_id] = {
+                "evalues": evalues,
+                "domains": None,
+                "error": error,
+            }
+        return isotypes, diagnostics
+
+    searchInputName = work_file(jobid, "batch_search.fasta")
+    searchOutputName = work_file(jobid, "batch_scan.txt")
+    query = "".join(
+        f">{num}\n{sequences[query_id]}\n" for num, query_id in enumerate(query_ids)
+    )
+
+    # build hmmscan command
+    hmmscan_exec = hmmer_exec("hmmscan")
+    command = [hmmscan_exec, "-Z", "1", "--domZ", "1"]
+    if cpu is not None:
+        command += ["--cpu", str(cpu)]
+    command += HMMSCAN_PIPE + [os.path.join(src_path, HMM_DATABASE), "-"]
+
+    # run hmmscan and parse its output
+    output = run_tool(
+        command,
+        query,
+        jobid,
+        "Error with hmmscan",
+        (searchInputName, searchOutputName),
+    )
+    hits = parse_hmmscan_queries(output, HMM_NAMES.values())
+
+    isotypes = {}
+    diagnostics = {}
+    for num, query_id in enumerate(query_ids):
+        query_hits = hits.get(str(num), {})
+        evalues = {}
+        domains = {}
+        for isotype, name in HMM_NAMES.items():
+            evalues[isotype], domains[isotype] = query_hits.get(name, (1, 0))
+
+        isotypes[query_id], error = isotype_from_evalues(evalues)
+        diagnostics[query_id] = {"evalues": evalues, "domains": domains, "error": error}
+
+    return isotypes, diagnostics
+
+
 def isDNA(seq):
     """Check if nucleotide.
 
@@ -227,108 +488,318 @@ def isProtein(seq):
     return pp
 
 
-def scan(searchInputName, hmm, hmmpath, jobid, searchOutputName):
-    """Scan sequence with HMM"""
+def scan(query, hmm, hmmpath, jobid, debug_names=()):
+    """Scan sequence with HMM
+
+    query = sequence in FASTA format
+    debug_names = files of the input and output of hmmscan in debug mode
+    """
 
     # build hmmscan command
-    hmmscan_exec = str(Path(HMMER_PATH, "hmmscan"))
-    command = [
-        hmmscan_exec,
-        "--domtblout",
-        searchOutputName,
-        hmm,
-        searchInputName,
-    ]
+    hmmscan_exec = hmmer_exec("hmmscan")
+    command = [hmmscan_exec] + HMMSCAN_PIPE + [hmm, "-"]
 
-    # run hmmscan
-    p = sub.Popen(command, stdout=sub.PIPE, stderr=sub.PIPE)
-    out, errors = p.communicate()
+    # run hmmscan and parse its output
+    output = run_tool(command, query, jobid, "Error with hmmscan", debug_names)
+    score = parse_hmmscan(output)
 
-    # If there are errors stop the program
-    if errors:
-        # write errors
-        write_error(f"Error with hmmscan: {errors}", jobid)
+    return score
 
-    # parse hmmscan output file
-    score = readhmmscan(searchOutputName)
 
-    return score
+def scan_databases(src_path=None):
+    """Files the scan of the isotypes depends on, to key its cache entries: the
+    database of the three models and its pressed files, or the files of the
+    single models if the database is not pressed (see scan_chains)"""
+    if src_path is None:
+        src_path = MARKOV_MODELS
+
+    database = os.path.join(src_path, HMM_DATABASE)
+    if os.path.isfile(database + ".h3m"):
+        models = [database]
+    else:
+        models = [os.path.join(src_path, hmm) for hmm in HMM_FILES.values()]
 
+    files = []
+    for model in models:
+        files.append(model)
+        files += [
+            model + suffix
+            for suffix in PRESSED_SUFFIXES
+            if os.path.isfile(model + suffix)
+        ]
+    return files
 
-def get_germline(jobid, ig_database, chain, germfile):
+
+def scan_chains(query, src_path, hmmpath, jobid, debug_names=()):
+    """Scan sequence with the HMMs of the three isotypes in a single hmmscan run.
+
+    query = sequence in FASTA format
+    debug_names = files of the input and output of hmmscan in debug mode
+
+    Returns a dictionary with the isotype as key and the E-value as value
+    """
+    database = os.path.join(src_path, HMM_DATABASE)
+
+    # Fall back to one scan per model if there is no pressed database
+    if not os.path.isfile(database + ".h3m"):
+        return {
+            isotype: scan(
+                query,
+                os.path.join(src_path, hmm),
+                hmmpath,
+                jobid,
+                debug_names,
+            )
+            for isotype, hmm in HMM_FILES.items()
+        }
+
+    # build hmmscan command
+    # E-values are calculated as for a database with a single model,
+    # so they are the same as the ones of separate scans
+    hmmscan_exec = hmmer_exec("hmmscan")
+    command = [hmmscan_exec, "-Z", "1", "--domZ", "1"] + HMMSCAN_PIPE + [database, "-"]
+
+    # run hmmscan and parse its output
+    output = run_tool(command, query, jobid, "Error with hmmscan", debug_names)
+    evalues = parse_hmmscan_models(output, HMM_NAMES.values())
+
+    return {isotype: evalues[name] for isotype, name in HMM_NAMES.items()}
+
+
+def get_germline(jobid, ig_database, chain, germfile, work_dir=None):
     """Calculate the germline
 
-    chain = path to the .fasta file of the desired chain
-    germfile = path to the output of igblastp
+    chain = path to the .fasta file of the desired chain, piped to igblastp
+    germfile = path to the output of igblastp, only written in debug mode
+    work_dir = folder of the .fasta file (default: jobid)
+    """
+    with open(job_file(jobid, chain, work_dir)) as f:
+        query = f.read()
+
+    igbplastp_exec = igblastp_exec()
+    command = [igbplastp_exec, "-germline_db_V", ig_database]
+    output = run_tool(
+        command,
+        query,
+        jobid,
+        f"Error in running igblastp for {germfile}",
+        (None, germfile),
+    )
+
+    line = "".join(output).split("\n")
+    # Raise an error if there are no hits from igblastp
+    if "***** No hits found *****" in line:
+        message = f"No hits found for: {germfile}"
+        write_error(message, jobid)
+
+    germ_spec = germline_label(line[11])
+
+    return germ_spec
+
+
+def germline_label(subject_id):
+    """Germline label (IGxVn-Species) of an igblastp hit.
+
+    subject_id = header of the germline sequence (e.g. KT723008|IGHV1-10*01|Bos)
+    """
+    match = subject_id.split("|")
+    species = re.match("\w+", match[2]).group()
+    germ = re.match("IG\wV\d+", match[1]).group()
+    return f"{germ}-{species}"
+
+
+def parse_germline_table(lines):
+    """Parse the tabular output (-outfmt 7) of igblastp.
+
+    Returns a dictionary with the query id as key and the subject id of its
+    top hit as value (empty if there are no hits for the query)
+    """
+    top_hits = {}
+    query = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("# Query:"):
+            query = line[len("# Query:") :].strip()
+            top_hits[query] = ""
+
+        elif line and not line.startswith("#") and query is not None:
+            # The hit lines may start with the type of the segment (V)
+            fields = line.split("\t")
+            if fields[0] == query:
+                subject = fields[1]
+            elif len(fields) > 2 and fields[1] == query:
+                subject = fields[2]
+            else:
+                continue
+
+            # Hits are sorted by E-value, keep the first one
+            if not top_hits[query]:
+                top_hits[query] = subject
+
+    return top_hits
+
+
+def read_germline_table(germfile):
+    """Parse the tabular output file (-outfmt 7) of igblastp"""
+    with open(germfile) as f:
+        return parse_germline_table(f)
+
+
+def igblastp_batch(seqs, ig_database, jobid, name, num_threads=1):
+    """Run igblastp once for a list of sequences.
+
+    Returns the list of the subject ids of their top hits (empty if no hits)
     """
-    igbplastp_exec = str(Path(IGBLAST_PATH, "igblastp"))
+    # Sequences are given to igblastp with their index as name
+    germInputName = work_file(jobid, f"{name}.fasta")
+    germfile = work_file(jobid, f"{name}.germ")
+    query = "".join(f">{num}\n{seq}\n" for num, seq in enumerate(seqs))
+
+    igbplastp_exec = igblastp_exec()
     command = [
         igbplastp_exec,
         "-germline_db_V",
         ig_database,
-        "-query",
-        jobid + chain,
-        "-out",
-        germfile,
+        "-outfmt",
+        "7",
+        "-num_threads",
+        str(num_threads),
     ]
-    p = sub.Popen(command, stderr=sub.PIPE)
-    out, errors = p.communicate()
+    output = run_tool(
+        command,
+        query,
+        jobid,
+        f"Error in running igblastp for {germfile or name}",
+        (germInputName, germfile),
+    )
+
+    top_hits = parse_germline_table(output)
+    return [top_hits.get(str(num), "") for num in range(len(seqs))]
+
+
+def germline_batch(
+    sequences,
+    ig_database,
+    jobid,
+    name,
+    num_threads=1,
+    native=False,
+    index_dir=None,
+):
+    """Calculate the germlines of many sequences with a single igblastp run.
+
+    sequences = dictionary with the query id as key and the protein sequence as value
+    ig_database = germline database (IGHVp, IGKVp or IGLVp)
+    jobid = working folder of the batch (None for no folder)
+    name = name of the input and output files of igblastp
+    native = assign the germlines with the k-mer index of germline_kmer instead
+    of igblastp, index_dir = folder of its memory-mapped index (default: in memory)
+
+    Returns a dictionary {query id: germline} and the list of the query ids
+    without any hit
+    """
+    query_ids = list(sequences)
+    if not query_ids:
+        return {}, []
+
+    seqs = [sequences[query_id] for query_id in query_ids]
+    if native:
+        subjects = load_index(ig_database, index_dir).assign(seqs)
+    else:
+        subjects = igblastp_batch(seqs, ig_database, jobid, name, num_threads)
+
+    germlines = {}
+    no_hits = []
+    for query_id, subject in zip(query_ids, subjects):
+        if subject:
+            germlines[query_id] = germline_label(subject)
+        else:
+            no_hits.append(query_id)
 
-    if errors:
-        write_error(f"Error in running igblastp for {germfile}: {errors}", jobid)
+    return germlines, no_hits
 
-    with open(germfile) as f:
-        line = f.read().split("\n")
-        # Raise an error if there are no hits from igblastp
-        if "***** No hits found *****" in line:
-            message = f"No hits found for: {germfile}"
-            write_error(message, jobid)
 
-        match = line[11].split("|")
-        species = re.match("\w+", match[2]).group()
-        germ = re.match("IG\wV\d+", match[1]).group()
-        germ_spec = f"{germ}-{species}"
+def align(query, hmm, hmmpath, jobid, debug_names=()):
+    """Align sequence with HMM
 
-    return germ_spec
+    query = sequence in FASTA format
+    debug_names = files of the input and output of hmmalign in debug mode
+    """
 
+    # build hmmalign command
+    hmmalign_exec = hmmer_exec("hmmalign")
+    command = [hmmalign_exec] + HMMALIGN_PIPE + [hmm, "-"]
 
-def align(searchInputName, hmm, hmmpath, jobid, alignOutputName):
-    """Align sequence with HMM"""
+    # Run hmmalign and parse the alignment
+    output = run_tool(command, query, jobid, "Error with hmmalign", debug_names)
+    aligned = parse_align(output)
 
-    # hmmalign output file
-    fhIn = open(alignOutputName, "w")
-    # build hmmalign command
-    hmmalign_exec = str(Path(HMMER_PATH, "hmmalign"))
-    command = [hmmalign_exec, "--trim", hmm, searchInputName]
+    return aligned
 
-    # Run hmmalign
-    p = sub.Popen(command, stdout=fhIn, stderr=sub.PIPE)
-    out, errors = p.communicate()
 
-    # If there are still errors stop the program
-    if errors:
-        # write errors
-        write_error(f"Error with hmmalign: {errors}", jobid)
+def align_batch(sequences, isotypes, jobid, src_path=None, native=False):
+    """Align many sequences with one hmmalign run per isotype.
 
-    # Parsing alignment file
-    aligned = read_align(alignOutputName)
+    sequences = dictionary with the query id as key and the protein sequence as value
+    isotypes = dictionary with the query id as key and the isotype (H, K or L) as value.
+    Sequences without isotype are not aligned.
+    jobid = working folder of the batch (None for no folder)
+    native = align in-process with profile_hmm instead of hmmalign
 
-    fhIn.close()
-    return aligned
+    Returns a dictionary {query id: aligned sequence}, the aligned sequence is empty
+    if the alignment failed
+    """
+    if src_path is None:
+        src_path = MARKOV_MODELS
+
+    aligned = {}
+    for isotype, hmm in HMM_FILES.items():
+        query_ids = [q for q in sequences if isotypes.get(q) == isotype]
+        if not query_ids:
+            continue
+
+        if native:
+            alignments = align_sequences(
+                os.path.join(src_path, hmm), [sequences[q] for q in query_ids]
+            )
+            aligned.update(zip(query_ids, alignments))
+            continue
+
+        # Sequences are given to hmmalign with their index as name
+        alignInputName = work_file(jobid, f"batch_align_{isotype}.fasta")
+        alignOutputName = work_file(jobid, f"batch_align_{isotype}.ali")
+        query = "".join(
+            f">{num}\n{sequences[query_id]}\n" for num, query_id in enumerate(query_ids)
+        )
+
+        # build hmmalign command
+        hmmalign_exec = hmmer_exec("hmmalign")
+        command = [hmmalign_exec] + HMMALIGN_PIPE + [os.path.join(src_path, hmm), "-"]
+
+        # Run hmmalign and parse the alignment
+        output = run_tool(
+            command,
+            query,
+            jobid,
+            "Error with hmmalign",
+            (alignInputName, alignOutputName),
+        )
+        alignments = parse_align_multi(output)
+        for num, query_id in enumerate(query_ids):
+            aligned[query_id] = alignments.get(str(num), "")
 
+    return aligned
 
-def rmTmpFile(jobid):
-    """Remove  file from tmp folder"""
-    for f in os.listdir(jobid + "tmp/"):
-        os.remove(jobid + "tmp/" + f)
 
+def BothChains(session, jobid, work_dir=None):
+    """Check if input antibodies have both chains
 
-def BothChains(session, jobid):
-    """Check if input antibodies have both chains"""
+    work_dir = folder of the formatted .fasta files (default: jobid)
+    """
     count = 0
 
-    OutH = open(jobid + "heavy_format.fasta", "w")  # TODO to modify
-    OutL = open(jobid + "light_format.fasta", "w")
+    OutH = open(job_file(jobid, "heavy_format.fasta", work_dir), "w")
+    OutL = open(job_file(jobid, "light_format.fasta", work_dir), "w")
 
     for key in session:
 
@@ -375,11 +846,33 @@ def BothChains(session, jobid):
     return session
 
 
+class JobError(SystemExit):
+    """Error stopping a job, the message is written to its error.log"""
+
+    def __init__(self, message):
+        super().__init__("An error occurred. Check error.log file")
+        self.message = message
+
+
 def write_error(message, jobid):
-    """Open error.log write error and exit job"""
-    with open(jobid + "error.log", "w") as fhErr:
-        fhErr.write("{}\n".format(message))
-    raise SystemExit("An error occurred. Check error.log file")
+    """Append the error to error.log and exit job.
+
+    The file is not overwritten, so the errors of the jobs sharing a folder
+    are all kept. Nothing is written if jobid is None
+    """
+    if jobid is not None:
+        os.makedirs(jobid, exist_ok=True)
+        with open(jobid + "error.log", "a") as fhErr:
+            fhErr.write("{}\n".format(message))
+    raise JobError(message)
+
+
+def error_reason(message):
+    """Category of an error message (see ERROR_REASONS), "other" if it is unknown"""
+    for pattern, reason in ERROR_REASONS:
+        if pattern in message:
+            return reason
+    return "other"
 
 
 def write_warning(message, jobid):
@@ -485,7 +978,11 @@ def checkInput(input, jobid):
                 write_error(message, jobid)
 
 
-def oneLiner_fasta(jobid, fileIn, fileOut):
+def oneLiner_fasta(jobid, fileIn, fileOut, work_dir=None):
+    """Write a FASTA file with the sequence on a single line.
+
+    work_dir = folder of the output file (default: jobid)
+    """
     with open(jobid + fileIn, "r") as fhIn:
         seq = ""
         header = ""
@@ -501,5 +998,5 @@ def oneLiner_fasta(jobid, fileIn, fileOut):
                 seq = seq + line.upper()
 
     # write file in jobpath
-    with open(jobid + fileOut, "w") as fhOut:
+    with open(job_file(jobid, fileOut, work_dir), "w") as fhOut:
         fhOut.write(header + "\n" + seq + "\n")
@@ -0,0 +1,203 @@
+"""
+Throughput and latency metrics of proABC-2, in the Prometheus text format.
+
+The counters and histograms of a process are kept in a Registry:
+
+    proabc2_antibodies_total           antibodies processed (predicted or failed)
+    proabc2_antibody_failures_total    failed antibodies, by reason
+                                       (jobinput.error_reason of the message)
+    proabc2_stage_seconds              wall time of the stages traced with
+                                       trace.span(), by stage
+    proabc2_cache_requests_total       lookups in the caches, by cache and result
+    proabc2_subprocesses_total         runs of the external tools, by tool
+
+The metrics are collected when the PROABC2_METRICS environment variable is
+set (by enable()), so that the worker processes of a batch collect them too
+and send them back to the main process with their results (drain() and
+merge()). The batch program writes them to a file, in the format read by the
+textfile collector of the Prometheus node exporter, and the prediction server
+answers them on GET /metrics.
+"""
+
+import os
+import tempfile
+import threading
+
+from proabc_2.batcher import Histogram
+
+# Environment variable enabling the collection of the metrics
+METRICS_ENV = "PROABC2_METRICS"
+
+# Prefix of the names of the metrics
+PREFIX = "proabc2_"
+
+# Upper bounds of the buckets of the stage latencies, in seconds
+STAGE_SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]
+
+# Type and description of every metric
+METRICS = {
+    "antibodies_total": ("counter", "Antibodies processed (predicted or failed)"),
+    "antibody_failures_total": ("counter", "Failed antibodies by reason"),
+    "cache_requests_total": ("counter", "Lookups in the caches by cache and result"),
+    "subprocesses_total": ("counter", "Runs of the external tools by tool"),
+    "stage_seconds": ("histogram", "Wall time of the stages in seconds"),
+    "queue_depth": ("histogram", "Items in the queue of the batcher at submission"),
+    "batch_size": ("histogram", "Items per forward pass of the batcher"),
+}
+
+# Buckets of the histograms collected by the registry
+BUCKETS = {"stage_seconds": STAGE_SECONDS_BUCKETS}
+
+
+def _escape(value):
+    """Label value with the backslashes, quotes and new lines escaped"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    """Prometheus label set of a sorted tuple of (name, value)"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Counters and histograms of a process, shared by its threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name, **labels):
+        """Histogram with the given name and labels, created if needed"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(BUCKETS[name])
+            return self.histograms[key]
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram"""
+        self.histogram(name, **labels).observe(value)
+
+    def drain(self):
+        """Take the values collected so far, to be merged in another registry.
+
+        The registry is emptied and the values are returned as a picklable
+        dictionary
+        """
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+        return {
+            "counters": counters,
+            "histograms": {
+                key: (hist.counts, hist.sum) for key, hist in histograms.items()
+            },
+        }
+
+    def merge(self, values):
+        """Add the values taken from another registry by drain()"""
+        for (name, labels), value in values["counters"].items():
+            self.inc(name, value, **dict(labels))
+        for (name, labels), (counts, total) in values["histograms"].items():
+            self.histogram(name, **dict(labels)).merge(counts, total)
+
+    def text(self, histograms=None):
+        """The metrics in the Prometheus text format.
+
+        histograms = other histograms to export, dictionary {name: Histogram}
+        (e.g. the ones of a batcher.MicroBatcher)
+        """
+        with self._lock:
+            samples = {}
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), hist in self.histograms.items():
+                samples.setdefault(name, []).append((labels, hist.snapshot()))
+        for name, hist in (histograms or {}).items():
+            samples.setdefault(name, []).append(((), hist.snapshot()))
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = METRICS[name]
+            full_name = PREFIX + name
+            lines.append(f"# HELP {full_name} {description}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in sorted(samples[name], key=lambda s: s[0]):
+                if kind == "counter":
+                    lines.append(f"{full_name}{_labels(labels)} {_number(value)}")
+                    continue
+                for bound, count in value["buckets"].items():
+                    bucket = _labels(labels + (("le", bound),))
+                    lines.append(f"{full_name}_bucket{bucket} {count}")
+                lines.append(
+                    f"{full_name}_sum{_labels(labels)} {_number(value['sum'])}"
+                )
+                lines.append(f"{full_name}_count{_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# Registry of the process
+REGISTRY = Registry()
+
+
+def enabled():
+    """True if the metrics are collected"""
+    return bool(os.environ.get(METRICS_ENV))
+
+
+def enable():
+    """Collect the metrics in this process and in its workers"""
+    os.environ[METRICS_ENV] = "1"
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter of the process, if the metrics are collected"""
+    if enabled():
+        REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Add a value to a histogram of the process, if the metrics are collected"""
+    if enabled():
+        REGISTRY.observe(name, value, **labels)
+
+
+def record_status(message):
+    """Count a processed antibody, and its failure (by jobinput.error_reason of
+    the message) if the status is not OK"""
+    if not enabled():
+        return
+    REGISTRY.inc("antibodies_total")
+    if message != "OK":
+        from proabc_2.jobinput import error_reason
+
+        REGISTRY.inc("antibody_failures_total", reason=error_reason(message))
+
+
+def write(filename, registry=None):
+    """Write the metrics to a file, replaced at once so that it is never read
+    half written.
+
+    registry = Registry to write (default: the one of the process)
+    """
+    if registry is None:
+        registry = REGISTRY
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as fh:
+        fh.write(registry.text())
+    os.chmod(tmp_name, 0o644)
+    os.replace(tmp_name, filename)
@@ -9,15 +9,26 @@
 #
 
 import argparse
+import concurrent.futures
 import copy
+import functools
+import glob
 import os
+import tempfile
 
 import numpy as np
-import pandas as pd
 
 import proabc_2.cnn as cn
 import proabc_2.jobinput as ji
 import proabc_2.numbering as nb
+from proabc_2 import trace
+from proabc_2.cache import (
+    DEFAULT_MAX_SIZE,
+    ResultCache,
+    StageCache,
+    cached,
+    split_size,
+)
 
 __author__ = [
     "Francesco Ambrosetti",
@@ -33,47 +44,109 @@ __email__ = [
     "b.jimenezgarcia@uu.nl",
 ]
 
+# Bundled resources
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+# file to encode the sequences
+SEQ_ENCODING = os.path.join(BASE_DIR, "data", "Sparse_encoding_v2.txt")
+# igblastp database for heavy Kappa and Light chain
+IG_DATABASE_H = os.path.join(BASE_DIR, "database", "IGHVp.fasta")
+IG_DATABASE_K = os.path.join(BASE_DIR, "database", "IGKVp.fasta")
+IG_DATABASE_L = os.path.join(BASE_DIR, "database", "IGLVp.fasta")
+# trained weights of the network
+MODEL_PATH = os.path.join(BASE_DIR, "data", "proABC_v2")
+
+# type of interaction predicted
+OUTPUT_NAMES = ["pt", "hb", "hy"]
+
 
 def get_features(
-    jobid, hmmpath, light, heavy, ig_database_H, ig_database_K, ig_database_L, log_file
+    jobid,
+    hmmpath,
+    light,
+    heavy,
+    ig_database_H,
+    ig_database_K,
+    ig_database_L,
+    log_file,
+    cache=None,
 ):
     """Calculate features necessary to run proABC 2:
     - Aligned sequences
     - Germlines
     - Canonical structures
     - Loop lengths
+
+    cache = cache.StageCache, the results of hmmscan, hmmalign and igblastp
+    found in it are reused
     """
+    args = (
+        hmmpath,
+        light,
+        heavy,
+        ig_database_H,
+        ig_database_K,
+        ig_database_L,
+        log_file,
+        cache,
+    )
 
+    # Private working folder, so that predictions can share the job folder.
+    # It is kept in debug mode, with the input and output of the tools
+    if ji.debug_files():
+        work_dir = tempfile.mkdtemp(prefix="tmp-", dir=jobid)
+        return _features(jobid, work_dir, *args)
+
+    with tempfile.TemporaryDirectory(prefix="tmp-", dir=jobid) as work_dir:
+        return _features(jobid, work_dir, *args)
+
+
+def _features(
+    jobid,
+    work_dir,
+    hmmpath,
+    light,
+    heavy,
+    ig_database_H,
+    ig_database_K,
+    ig_database_L,
+    log_file,
+    cache,
+):
     fhLog = log_file
 
     # Path to executable
     TargetName = jobid.replace("/", "")
 
     # Check for input in heavy and light fasta
-    fhLog.write("Checking input heavy chain sequence\n")
-    ji.checkInput(heavy, jobid)
+    with trace.span("checkInput"):
+        fhLog.write("Checking input heavy chain sequence\n")
+        ji.checkInput(heavy, jobid)
 
-    fhLog.write("Checking input light chain sequence\n")
-    ji.checkInput(light, jobid)
+        fhLog.write("Checking input light chain sequence\n")
+        ji.checkInput(light, jobid)
 
     # Write as a single one-line-sequence file
     format_heavy = "heavy_format.fasta"
     format_light = "light_format.fasta"
-    ji.oneLiner_fasta(jobid, heavy, format_heavy)
-    ji.oneLiner_fasta(jobid, light, format_light)
+    with trace.span("oneLiner_fasta"):
+        ji.oneLiner_fasta(jobid, heavy, format_heavy, work_dir)
+        ji.oneLiner_fasta(jobid, light, format_light, work_dir)
 
-    # Generate working folders
-    if not os.path.exists(os.path.join(jobid, "alignments")):
-        os.makedirs(os.path.join(jobid, "alignments"))
-    if not os.path.exists(os.path.join(jobid, "tmp")):
-        os.makedirs(os.path.join(jobid, "tmp"))
+    # Generate output folders
+    os.makedirs(os.path.join(jobid, "alignments"), exist_ok=True)
 
     # Run HMM to get chain isotype
     fhLog.write("HMM Scanning to identify the isotype of the input chains\n")
     myAb = {"input": {"H": "", "L": "", "K": ""}}
 
+    # Both chains are scanned and aligned at the same time
+    chain_H, chain_L = run_chains(
+        lambda: ji.read_input_single(format_heavy, jobid, hmmpath, cache, work_dir),
+        lambda: ji.read_input_single(format_light, jobid, hmmpath, cache, work_dir),
+    )
+
     # Chain H
-    Seq, isotype = ji.read_input_single(format_heavy, jobid, hmmpath)
+    Seq, isotype = chain_H
     fhLog.write(heavy + " sequence is " + Seq + "\n")
     fhLog.write("Isotype is " + isotype + "\n")
 
@@ -81,87 +154,149 @@ def get_features(
         myAb["input"][isotype] = Seq
 
     # Chain L
-    Seq, isotype = ji.read_input_single(format_light, jobid, hmmpath)
+    Seq, isotype = chain_L
     fhLog.write(light + " sequence is " + Seq + "\n")
     fhLog.write("Isotype is " + isotype + "\n")
 
     if isotype:
         myAb["input"][isotype] = Seq
 
-    # Remove tmp file
-    ji.rmTmpFile(jobid)
-    os.removedirs(os.path.join(jobid, "tmp"))
-
     # Check if antibody contains both chains
-    session = ji.BothChains(myAb, jobid)
+    session = ji.BothChains(myAb, jobid, work_dir)
 
     # Calculate germline for the Heavy chain
     fhLog.write("Calculating germline for heavy chain" "\n")
-    germfile_H = os.path.join(jobid, "heavy.germ")
-    germ_H = ji.get_germline(jobid, ig_database_H, format_heavy, germfile_H)
+    germfile_H = os.path.join(work_dir, "heavy.germ")
+
+    def germline_H():
+        return cached(
+            cache,
+            "germline",
+            myAb["input"]["H"].replace("-", ""),
+            lambda: ji.get_germline(
+                jobid, ig_database_H, format_heavy, germfile_H, work_dir
+            ),
+            [ig_database_H],
+            "igblastp",
+        )
 
     for ab in session:
 
-        # Initialize heavy chain class
-        numbH = nb.H(session[ab]["H"])
-
-        # Get sequence with H3 aligned
-        # GAPs are now between the residues 92 and 104
-        numbH.H3align()
-        seq_H = numbH.alnH3
-
-        # Calculates canonical structures and loop lengths for chain H
-        fhLog.write("Assigning canonical structures to Heavy chain\n")
-        cs_H = numbH.getCs()
-        loop_H = numbH.loopLen()
-
-        # Initialize light chain class
+        # Calculate germline for the light chain
         fhLog.write("Calculating germline for light chain" "\n")
-        germfile_L = os.path.join(jobid, "light.germ")
+        germfile_L = os.path.join(work_dir, "light.germ")
 
         if session[ab]["K"]:  # If isotype is K
             isotype = "K"
-            germ_L = ji.get_germline(jobid, ig_database_K, format_light, germfile_L)
+            ig_database = ig_database_K
 
         elif session[ab]["L"]:  # If isotype is L
             isotype = "L"
-            germ_L = ji.get_germline(jobid, ig_database_L, format_light, germfile_L)
-
-        method = eval("nb." + isotype)
-        numbL = method(session[ab][isotype])
-
-        # Get Light chain sequence
-        seq_L = session[ab][isotype]
+            ig_database = ig_database_L
+
+        def germline_L():
+            return cached(
+                cache,
+                "germline",
+                session[ab][isotype].replace("-", ""),
+                lambda: ji.get_germline(
+                    jobid, ig_database, format_light, germfile_L, work_dir
+                ),
+                [ig_database],
+                "igblastp",
+            )
+
+        # igblastp runs on both chains at the same time
+        germ_H, germ_L = run_chains(germline_H, germline_L)
 
         # Calculates canonical structures and loop lengths
-        fhLog.write("Assigning canonical structures to Light chain\n")
-        cs_L = numbL.getCs()
-        loop_L = numbL.loopLen()
+        fhLog.write("Assigning canonical structures to Heavy and Light chain\n")
+        with trace.span("numbering"):
+            features = chain_features(
+                session[ab]["H"], session[ab][isotype], isotype, germ_H, germ_L
+            )
 
         # Write features file
         fhLog.write("Writing feature .csv file\n")
-        features = {
-            "H_HV1_len": [loop_H[list(loop_H)[0]]],
-            "H_HV2_len": [loop_H[list(loop_H)[1]]],
-            "H_HV3_len": [loop_H[list(loop_H)[2]]],
-            "H_CanHV1": [cs_H[0]],
-            "H_CanHV2": [cs_H[1]],
-            "H_CanHV3": [cs_H[2]],
-            "H_Germline": [germ_H],
-            "L_HV1_len": [loop_L[list(loop_L)[0]]],
-            "L_HV2_len": [loop_L[list(loop_L)[1]]],
-            "L_HV3_len": [loop_L[list(loop_L)[2]]],
-            "L_CanHV1": [cs_L[0]],
-            "L_CanHV2": [cs_L[1]],
-            "L_CanHV3": [cs_L[2]],
-            "L_Germline": [germ_L],
-            "heavy_seq": [seq_H],
-            "light_seq": [seq_L],
-        }
-
-        df_features = pd.DataFrame.from_dict(features)
+        df_features = features[0]
         df_features.to_csv(path_or_buf=jobid + TargetName + "-features.csv")
 
+    return features
+
+
+def run_chains(task_H, task_L):
+    """Run the tasks of the heavy and of the light chain concurrently.
+
+    Returns the results of both tasks. If both fail, the error of the heavy
+    chain is raised, as when the chains were processed one after the other
+    """
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        futures = [
+            trace.run_in_context(executor, task_H),
+            trace.run_in_context(executor, task_L),
+        ]
+        concurrent.futures.wait(futures)
+
+    return [future.result() for future in futures]
+
+
+def chain_features(aligned_H, aligned_L, isotype_L, germ_H, germ_L):
+    """Calculate the features of an antibody from its aligned chains and germlines.
+
+    aligned_H, aligned_L = chains aligned to the HMMs
+    isotype_L = isotype of the light chain (K or L)
+
+    Returns the features data-frame, the numbering, the sequence with H3 aligned
+    and the aligned sequence of chain H, the numbering and the aligned sequence
+    of chain L
+    """
+    # Initialize heavy chain class
+    numbH = nb.H(aligned_H)
+
+    # Get sequence with H3 aligned
+    # GAPs are now between the residues 92 and 104
+    numbH.H3align()
+    seq_H = numbH.alnH3
+
+    # Calculates canonical structures and loop lengths for chain H
+    cs_H = numbH.getCs()
+    loop_H = numbH.loopLen()
+
+    # Initialize light chain class
+    method = getattr(nb, isotype_L)
+    numbL = method(aligned_L)
+
+    # Get Light chain sequence
+    seq_L = aligned_L
+
+    # Calculates canonical structures and loop lengths
+    cs_L = numbL.getCs()
+    loop_L = numbL.loopLen()
+
+    features = {
+        "H_HV1_len": [loop_H[list(loop_H)[0]]],
+        "H_HV2_len": [loop_H[list(loop_H)[1]]],
+        "H_HV3_len": [loop_H[list(loop_H)[2]]],
+        "H_CanHV1": [cs_H[0]],
+        "H_CanHV2": [cs_H[1]],
+        "H_CanHV3": [cs_H[2]],
+        "H_Germline": [germ_H],
+        "L_HV1_len": [loop_L[list(loop_L)[0]]],
+        "L_HV2_len": [loop_L[list(loop_L)[1]]],
+        "L_HV3_len": [loop_L[list(loop_L)[2]]],
+        "L_CanHV1": [cs_L[0]],
+        "L_CanHV2": [cs_L[1]],
+        "L_CanHV3": [cs_L[2]],
+        "L_Germline": [germ_L],
+        "heavy_seq": [seq_H],
+        "light_seq": [seq_L],
+    }
+
+    # pandas is only imported once the features are calculated
+    import pandas as pd
+
+    df_features = pd.DataFrame.from_dict(features)
+
     return (
         df_features,
         numbH.numbering,
@@ -175,6 +310,7 @@ def get_features(
 def reAln_H3(h_pred, h_seq, chothia):
     """It reorders the predictions according
     to the original Chothia alignment"""
+    import pandas as pd
 
     # Build full sequence data-frame
     full_seq = pd.DataFrame([list(h_seq)]).T
@@ -205,116 +341,234 @@ def reAln_H3(h_pred, h_seq, chothia):
     return re_aligned_pred
 
 
-def prediction(input_path, heavy_fasta_file, light_fasta_file):
-    """Make the proABC 2 prediction"""
-    try:
-        # input folder
-        jobid = input_path
+def model_parameters(seq_data):
+    """Define the model parameters for the encoded sequences"""
+    split = len(OUTPUT_NAMES)
+    tot = seq_data.shape[1] * split  # 297 [len H chain + len L chain] * split
+    hps = {"N_BATCH": 50, "y_out": tot}
+    return tot, hps
 
-        # name of the fasta file containing the sequence of the heavy chain
-        heavy = heavy_fasta_file
 
-        # name of the fasta file containing the sequence of the light chain
-        light = light_fasta_file
+def write_output(jobid, y_pred, numb_h, aln_H, seq_h, numb_L, aln_L):
+    """Write the heavy-pred.csv and light-pred.csv files of one antibody.
 
-        # Calculate absolute paths
-        base_dir = os.path.abspath(os.path.dirname(__file__))
-        # file to encode the sequences
-        seq_encoding = os.path.join(base_dir, "data", "Sparse_encoding_v2.txt")
-        # igblastp database for heavy Kappa and Light chain
-        ig_database_H = os.path.join(base_dir, "database", "IGHVp.fasta")
-        ig_database_K = os.path.join(base_dir, "database", "IGKVp.fasta")
-        ig_database_L = os.path.join(base_dir, "database", "IGLVp.fasta")
+    y_pred = predictions of the network for this antibody (1D array)
+    """
+    with trace.span("format_output"):
+        heavy_out, light_out = format_output(
+            y_pred, numb_h, aln_H, seq_h, numb_L, aln_L
+        )
 
-        # only needed if you want to specify the path for HMMER
-        hmmpath = ""
+    # write final csv files
+    with trace.span("write_csv"):
+        heavy_out.to_csv(path_or_buf=os.path.join(jobid, "heavy-pred.csv"))  # chain H
+        light_out.to_csv(path_or_buf=os.path.join(jobid, "light-pred.csv"))  # chain L
 
-        if not jobid.endswith("/"):
-            jobid = jobid + "/"
 
-        # Open file log
-        open(os.path.join(jobid, "session.log"), "w").close()  # create empty file
-        log = open(os.path.join(jobid, "session.log"), "a")
+def format_output(y_pred, numb_h, aln_H, seq_h, numb_L, aln_L):
+    """Build the per-residue output data-frames of one antibody.
 
-        # Get features, aligned chain sequences with GAPs and the Chothia schemes for both chains
-        log.write("Running features calculation\n")
-        df, numb_h, aln_H, seq_h, numb_L, aln_L = get_features(
-            jobid,
-            hmmpath,
-            light,
-            heavy,
-            ig_database_H,
-            ig_database_K,
-            ig_database_L,
-            log,
-        )
+    Returns one data-frame for chain H and one for chain L
+    """
+    import pandas as pd
 
-        # Categorize residue features and encode the sequences
-        log.write("Preparing features for predictions\n")
-        feat_data = cn.categorize_X_data(df)
-        seq_data = cn.encode_X_sequence(
-            df.loc[:, ["heavy_seq", "light_seq"]], seq_encoding, add_position=1
-        )
-        x_data = (seq_data, feat_data)
+    split = len(OUTPUT_NAMES)
+
+    # chain H
+    df_seq_H = pd.DataFrame([numb_h, seq_h], index=["Chothia", "Sequence"]).T
+    len_H = df_seq_H.shape[0]
 
-        # Model
-        log.write("Initializing model and making predictions\n")
+    # chain L
+    df_seq_L = pd.DataFrame([numb_L, aln_L], index=["Chothia", "Sequence"]).T
 
-        # Define model parameters
-        output_names = ["pt", "hb", "hy"]  # type of interaction predicted
-        split = len(output_names)
-        tot = len(seq_data[0] * split)  # 297 [len H chain + len L chain] * split
-        hps = {"N_BATCH": 50, "y_out": tot}
+    for i in range(split):
 
-        # Prediction
-        model_path = os.path.join(base_dir, "data", "proABC_v2")
-        y_pred = cn.predict(tot, hps, model_path, x_data)
+        split_values = np.split(y_pred, split)[i]
 
-        log.write("Creating output file\n")
+        # Chain H
+        h_values = pd.DataFrame(split_values[:len_H])
+        new_h_values = reAln_H3(h_values, aln_H, numb_h)  # retrive original H3 aln
+        df_seq_H = pd.concat([df_seq_H, pd.DataFrame(new_h_values)], axis=1)
 
-        # Return data-frame - one for chain H and one for chain L
-        # chain H
-        df_seq_H = pd.DataFrame([numb_h, seq_h], index=["Chothia", "Sequence"]).T
-        len_H = df_seq_H.shape[0]
+        # Chain L
+        l_values = pd.DataFrame(split_values[len_H:])
+        df_seq_L = pd.concat([df_seq_L, l_values], axis=1)
 
-        # chain L
-        df_seq_L = pd.DataFrame([numb_L, aln_L], index=["Chothia", "Sequence"]).T
+    # define colnames
+    cols = ["Chothia", "Sequence"] + OUTPUT_NAMES
 
-        for i in range(split):
+    # chain H
+    df_seq_H.columns = cols
+    out_h_ng = df_seq_H[df_seq_H["Sequence"] != "-"]  # Remove gaps from the sequence
+    out_h_ng = out_h_ng.round(2)
 
-            split_values = np.split(y_pred[0], split)[i]
+    # chain L
+    df_seq_L.columns = cols
+    out_l_ng = df_seq_L[df_seq_L["Sequence"] != "-"]  # Remove gaps from the sequence
+    out_l_ng = out_l_ng.round(2)
 
-            # Chain H
-            h_values = pd.DataFrame(split_values[:len_H])
-            new_h_values = reAln_H3(h_values, aln_H, numb_h)  # retrive original H3 aln
-            df_seq_H = pd.concat([df_seq_H, pd.DataFrame(new_h_values)], axis=1)
+    return out_h_ng, out_l_ng
 
-            # Chain L
-            l_values = pd.DataFrame(split_values[len_H:])
-            df_seq_L = pd.concat([df_seq_L, l_values], axis=1)
 
-        # define colnames
-        cols = ["Chothia", "Sequence"] + output_names
+@functools.lru_cache(maxsize=None)
+def model_files():
+    """Files the predictions depend on: checkpoint of the network and encoding"""
+    return sorted(glob.glob(MODEL_PATH + "*")) + [SEQ_ENCODING]
 
-        # chain H
-        df_seq_H.columns = cols
-        out_h_ng = df_seq_H[
-            df_seq_H["Sequence"] != "-"
-        ]  # Remove gaps from the sequence
-        out_h_ng = out_h_ng.round(2)
 
-        # write final csv file
-        out_h_ng.to_csv(path_or_buf=os.path.join(jobid, "heavy-pred.csv"))  # chain H
+def result_key(cache, heavy_seq, light_seq, params):
+    """Key of the prediction of an antibody in a ResultCache.
 
-        # chain L
-        df_seq_L.columns = cols
-        out_l_ng = df_seq_L[
-            df_seq_L["Sequence"] != "-"
-        ]  # Remove gaps from the sequence
-        out_l_ng = out_l_ng.round(2)
+    params = settings of the pipeline changing the result (engine, backends)
+
+    The sequences are upper-cased, as they are by every mode before the
+    prediction, so that a lowercase FASTA file finds the same entry
+    """
+    sequence = heavy_seq.upper() + "/" + light_seq.upper()
+    return cache.key("prediction", sequence, model_files(), params)
 
-        # write final csv file
-        out_l_ng.to_csv(path_or_buf=os.path.join(jobid, "light-pred.csv"))  # chain L
+
+def pack_result(y_pred, features):
+    """Entry of a ResultCache with the prediction of an antibody.
+
+    y_pred = predictions of the network for this antibody (1D array)
+    features = output of get_features (or chain_features)
+    """
+    df, numb_h, aln_H, seq_h, numb_L, aln_L = features
+    return {
+        "y_pred": y_pred,
+        "features": df.to_csv(),
+        "numb_h": " ".join(numb_h),
+        "aln_H": aln_H,
+        "seq_h": seq_h,
+        "numb_L": " ".join(numb_L),
+        "aln_L": aln_L,
+    }
+
+
+def unpack_result(result):
+    """Arguments of write_output and format_output stored in a ResultCache entry"""
+    return (
+        result["y_pred"],
+        result["numb_h"].split(),
+        result["aln_H"],
+        result["seq_h"],
+        result["numb_L"].split(),
+        result["aln_L"],
+    )
+
+
+def read_chain(filename):
+    """Sequence of a single chain FASTA file"""
+    with open(filename) as fh:
+        return "".join(line.strip() for line in fh if not line.startswith(">"))
+
+
+def prediction(
+    input_path,
+    heavy_fasta_file,
+    light_fasta_file,
+    engine="tf",
+    cache_dir=None,
+    cache_size=DEFAULT_MAX_SIZE,
+):
+    """Make the proABC 2 prediction
+
+    engine = implementation of the network, "tf" (TensorFlow) or "numpy"
+    cache_dir = folder of the cache of the per-chain stages and of the
+    predictions (default: no cache)
+    cache_size = size limit of the cache in bytes, shared by the stages and
+    the predictions
+    """
+    stage_size, result_size = split_size(cache_size)
+    try:
+        # input folder
+        jobid = input_path
+
+        # name of the fasta file containing the sequence of the heavy chain
+        heavy = heavy_fasta_file
+
+        # name of the fasta file containing the sequence of the light chain
+        light = light_fasta_file
+
+        # only needed if you want to specify the path for HMMER
+        hmmpath = ""
+
+        if not jobid.endswith("/"):
+            jobid = jobid + "/"
+
+        # Open file log
+        open(os.path.join(jobid, "session.log"), "w").close()  # create empty file
+        log = open(os.path.join(jobid, "session.log"), "a")
+
+        # Every stage of the antibody is traced with the name of its folder
+        with trace.span(
+            "prediction", os.path.basename(os.path.normpath(jobid))
+        ) as span:
+            # Look for the antibody in the cache of the predictions
+            result = None
+            if cache_dir:
+                result_cache = ResultCache(
+                    os.path.join(cache_dir, "predictions"), result_size
+                )
+                key = result_key(
+                    result_cache,
+                    read_chain(jobid + heavy),
+                    read_chain(jobid + light),
+                    engine + "/hmmer/igblastp",
+                )
+                result = result_cache.get_key(key)
+            span["cached"] = result is not None
+
+            if result is not None:
+                log.write("Prediction found in the cache\n")
+                with open(jobid + jobid.replace("/", "") + "-features.csv", "w") as fh:
+                    fh.write(result["features"])
+                y_pred, numb_h, aln_H, seq_h, numb_L, aln_L = unpack_result(result)
+
+            else:
+                # Get features, aligned chain sequences with GAPs and the Chothia schemes for both chains
+                log.write("Running features calculation\n")
+                features = get_features(
+                    jobid,
+                    hmmpath,
+                    light,
+                    heavy,
+                    IG_DATABASE_H,
+                    IG_DATABASE_K,
+                    IG_DATABASE_L,
+                    log,
+                    StageCache(cache_dir, stage_size) if cache_dir else None,
+                )
+                df, numb_h, aln_H, seq_h, numb_L, aln_L = features
+
+                # Categorize residue features and encode the sequences
+                log.write("Preparing features for predictions\n")
+                with trace.span("categorize_X_data"):
+                    feat_data = cn.categorize_X_data(df)
+                with trace.span("encode_X_sequence"):
+                    seq_data = cn.encode_X_sequence(
+                        df.loc[:, ["heavy_seq", "light_seq"]],
+                        SEQ_ENCODING,
+                        add_position=1,
+                    )
+                x_data = (seq_data, feat_data)
+
+                # Model
+                log.write("Initializing model and making predictions\n")
+
+                # Define model parameters
+                tot, hps = model_parameters(seq_data)
+
+                # Prediction
+                with trace.span("predict"):
+                    y_pred = cn.predict(tot, hps, MODEL_PATH, x_data, engine)[0]
+                if cache_dir:
+                    result_cache.put_key(key, pack_result(y_pred, features))
+
+            # Return data-frame - one for chain H and one for chain L
+            log.write("Creating output file\n")
+            write_output(jobid, y_pred, numb_h, aln_H, seq_h, numb_L, aln_L)
 
         # Close log file
         log.write("Job completed\n")
@@ -326,6 +580,35 @@ def prediction(input_path, heavy_fasta_file, light_fasta_file):
         raise SystemExit(1)
 
 
+def add_cache_arguments(parser):
+    """Add the options of the stage cache to a command line parser"""
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Folder of the cache of the hmmscan, hmmalign and germline results\n"
+        "and of the predictions (default: no cache)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE // 1024**2,
+        metavar="MB",
+        help="Size limit of the cache in MB, half for the stage results and half\n"
+        "for the predictions; the least recently used results are removed\n"
+        "first (default: %(default)s)",
+    )
+
+
+def add_debug_arguments(parser):
+    """Add the option keeping the files of the external tools to a command line parser"""
+    parser.add_argument(
+        "--debug-files",
+        action="store_true",
+        help="Keep the input and output of hmmscan, hmmalign and igblastp in files\n"
+        f"(also enabled by the {ji.DEBUG_FILES_ENV} environment variable)",
+    )
+
+
 def main():
 
     # Parse command line arguments
@@ -343,11 +626,33 @@ def main():
     parser.add_argument(
         "light", help="Name of the fasta file containing the light chain"
     )
+    parser.add_argument(
+        "--engine",
+        choices=cn.ENGINES,
+        default="tf",
+        help="Implementation of the network: TensorFlow (default) or NumPy",
+    )
+    add_cache_arguments(parser)
+    add_debug_arguments(parser)
+    trace.add_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.cache_size < 1:
+        parser.error("--cache-size must be a positive integer")
+    if args.debug_files:
+        os.environ[ji.DEBUG_FILES_ENV] = "1"
+    trace.enable(args.trace, args.profile)
+
     # Make the prediction
-    prediction(args.folder, args.heavy, args.light)
+    prediction(
+        args.folder,
+        args.heavy,
+        args.light,
+        args.engine,
+        args.cache,
+        args.cache_size * 1024**2,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,747 @@
+"""
+Profile HMMs of the antibody chains in NumPy.
+
+The HMMER3 files of MarkovModels/ are parsed once and the sequences are
+scored and aligned in-process, with dynamic programming vectorized over the
+states of the model and over the sequences of a batch.
+
+The alignments are the optimal accuracy paths of hmmalign (local, single hit
+profile configured for the length of the target sequence), given as the
+string of the match states read by numbering.H, numbering.K and numbering.L,
+as hmmalign --trim and ParseHmmer.read_align. The scores are the Forward
+scores and E-values of hmmscan (local, multiple hits), used to identify the
+isotype of the chains.
+"""
+
+import argparse
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+# Background frequencies of the amino acids used by HMMER (BLOSUM62)
+BACKGROUND = np.array(
+    [
+        0.0787945,
+        0.0151600,
+        0.0535222,
+        0.0668298,
+        0.0397062,
+        0.0695071,
+        0.0229198,
+        0.0590092,
+        0.0594422,
+        0.0963728,
+        0.0237718,
+        0.0414386,
+        0.0482904,
+        0.0395639,
+        0.0540978,
+        0.0683364,
+        0.0540687,
+        0.0673417,
+        0.0114135,
+        0.0304133,
+    ]
+)
+
+# Transitions of every node, in the order of the HMMER3 files
+TRANSITIONS = ["MM", "MI", "MD", "IM", "II", "DM", "DD"]
+MM, MI, MD, IM, II, DM, DD = range(len(TRANSITIONS))
+
+# Prior probability of the null2 model of biased composition
+NULL2_OMEGA = 1.0 / 256.0
+
+# Maximum number of sequences aligned at once (memory of the traceback)
+CHUNK_SIZE = 64
+
+# States of the Viterbi traceback
+STATE_M, STATE_I, STATE_D, STATE_B = range(4)
+
+# Index of every residue, the other characters (e.g. X) are scored as the
+# average residue
+RESIDUE_INDEX = np.full(256, len(AMINO_ACIDS), dtype=np.intp)
+for _num, _aa in enumerate(AMINO_ACIDS):
+    RESIDUE_INDEX[ord(_aa)] = _num
+    RESIDUE_INDEX[ord(_aa.lower())] = _num
+
+
+def _probability(value):
+    """Probability of a field of a HMMER3 file (negative natural log, * = 0)"""
+    return 0.0 if value == "*" else float(np.exp(-float(value)))
+
+
+class ProfileHMM:
+    """Profile HMM read from a HMMER3 file.
+
+    match = (M + 1, 20) emission probabilities of the match states (row 0 unused)
+    insert = (M + 1, 20) emission probabilities of the insert states
+    transitions = (M + 1, 7) transition probabilities of the nodes 0..M
+    stats = dictionary with the calibration of the MSV, VITERBI and FORWARD scores
+    """
+
+    def __init__(self, name, match, insert, transitions, stats):
+        self.name = name
+        self.length = match.shape[0] - 1
+        self.match = match
+        self.insert = insert
+        self.transitions = transitions
+        self.stats = stats
+        self.configure()
+
+    def occupancy(self):
+        """Probability of using the match state of every node"""
+        t = self.transitions
+        occ = np.zeros(self.length + 1)
+        occ[1] = t[0, MI] + t[0, MM]
+        for k in range(2, self.length + 1):
+            occ[k] = (
+                occ[k - 1] * (t[k - 1, MM] + t[k - 1, MI])
+                + (1.0 - occ[k - 1]) * t[k - 1, DM]
+            )
+        return occ
+
+    def configure(self):
+        """Scores of the local profile (log-odds in nats), as in p7_ProfileConfig"""
+        M = self.length
+        with np.errstate(divide="ignore"):
+            # Match emissions with an extra column for the unknown residues
+            msc = np.log(self.match[1:] / BACKGROUND)
+            average = (msc * BACKGROUND).sum(axis=1, keepdims=True)
+            self.msc = np.concatenate([msc, average], axis=1)
+
+            # Transitions of the nodes 1..M-1, the last node only exits
+            tsc = np.full((M + 1, len(TRANSITIONS)), -np.inf)
+            tsc[1:M] = np.log(self.transitions[1:M])
+            self.tsc = tsc
+
+            # Local entry in any match state, weighted by its occupancy
+            occ = self.occupancy()[1:]
+            self.entry = np.log(occ / (occ * np.arange(M, 0, -1)).sum())
+
+    def special(self, seq_length, multihit=False):
+        """Scores of the loop and move transitions of the N, J and C states,
+        which depend on the length of the sequence, and of the E -> C and
+        E -> J transitions
+        """
+        n_j = 1.0 if multihit else 0.0
+        seq_length = np.asarray(seq_length, dtype=float)
+        pmove = (2.0 + n_j) / (seq_length + 2.0 + n_j)
+        if multihit:
+            e_c = e_j = np.log(0.5)
+        else:
+            e_c, e_j = 0.0, -np.inf
+        return np.log1p(-pmove), np.log(pmove), e_c, e_j
+
+
+def read_hmms(filename):
+    """Read all the profile HMMs of a HMMER3 file"""
+    hmms = []
+    with open(filename) as fh:
+        lines = iter(fh.read().splitlines())
+
+    for line in lines:
+        if not line.startswith("HMMER3"):
+            continue
+
+        name = ""
+        stats = {}
+        for line in lines:
+            fields = line.split()
+            if fields[0] == "NAME":
+                name = fields[1]
+            elif fields[0] == "STATS":
+                stats[fields[2]] = (float(fields[3]), float(fields[4]))
+            elif fields[0] == "HMM":
+                break
+
+        # Transition header, then optional COMPO line and node 0
+        next(lines)
+        line = next(lines)
+        if line.split()[0] == "COMPO":
+            line = next(lines)
+        insert = [[_probability(v) for v in line.split()]]
+        transitions = [[_probability(v) for v in next(lines).split()]]
+        match = [[0.0] * len(AMINO_ACIDS)]
+
+        for line in lines:
+            if line.startswith("//"):
+                break
+            fields = line.split()
+            match.append([_probability(v) for v in fields[1 : len(AMINO_ACIDS) + 1]])
+            insert.append([_probability(v) for v in next(lines).split()])
+            transitions.append([_probability(v) for v in next(lines).split()])
+
+        hmms.append(
+            ProfileHMM(
+                name,
+                np.array(match),
+                np.array(insert),
+                np.array(transitions),
+                stats,
+            )
+        )
+
+    return hmms
+
+
+@functools.lru_cache(maxsize=None)
+def load_hmms(filename):
+    """Read the profile HMMs of a file, only once per file"""
+    return tuple(read_hmms(filename))
+
+
+def load_hmm(filename):
+    """Read the first profile HMM of a file, only once per file"""
+    return load_hmms(os.path.abspath(filename))[0]
+
+
+def digitize(sequences):
+    """Index of the residues of the sequences, padded to the longest one.
+
+    Returns a (N, L) array and the length of every sequence
+    """
+    lengths = np.array([len(s) for s in sequences], dtype=np.intp)
+    digital = np.full(
+        (len(sequences), max(lengths, default=0)), len(AMINO_ACIDS), dtype=np.intp
+    )
+    for num, seq in enumerate(sequences):
+        buf = np.frombuffer(seq.encode("ascii", "replace"), dtype=np.uint8)
+        digital[num, : len(buf)] = RESIDUE_INDEX[buf]
+    return digital, lengths
+
+
+def _chain(into, step, accumulate):
+    """Scores of a chain of states along the nodes of a row, e.g. the delete states.
+
+    S[k] = reduce(into[k], S[k-1] + step[k]) is solved for all the nodes at once
+    with a cumulative reduction (np.maximum or np.logaddexp). step[0] is not used
+    """
+    offset = np.cumsum(np.concatenate([[0.0], step[1:]]))
+    with np.errstate(invalid="ignore"):
+        return offset + accumulate(into - offset, axis=-1)
+
+
+def _shift(values, fill=-np.inf):
+    """Values of the previous node (k - 1) for every node k of a row"""
+    shifted = np.full_like(values, fill)
+    shifted[..., 1:] = values[..., :-1]
+    return shifted
+
+
+def _unshift(values, fill=-np.inf):
+    """Values of the next node (k + 1) for every node k of a row"""
+    shifted = np.full_like(values, fill)
+    shifted[..., :-1] = values[..., 1:]
+    return shifted
+
+
+class _Transitions:
+    """Transition scores of a profile, indexed by the node (0..M-1 = nodes 1..M)
+    they start from. Impossible delete to delete transitions get a finite score
+    for the cumulative sums of the delete chains
+    """
+
+    def __init__(self, tsc):
+        M = tsc.shape[0] - 1
+        self.mm, self.mi, self.md, self.im, self.ii, self.dm = (
+            tsc[1 : M + 1, t] for t in (MM, MI, MD, IM, II, DM)
+        )
+        self.dd = np.maximum(tsc[1 : M + 1, DD], -1e10)
+
+
+def _best_path(emit_m, emit_i, loop_n, loop_c, move, tsc, entry, lengths):
+    """Best path of every sequence through a local single hit profile (max-plus).
+
+    emit_m, emit_i = (L, N, M) scores of the residues in the match and insert states
+    loop_n, loop_c = (L, N) scores of the residues in the N and C states
+    move = (N,) score of the N -> B and C -> T transitions
+    tsc = transition scores, entry = scores of the local entry in every match state
+
+    Returns the best scores and, for every sequence, the list of (state, node,
+    residue position) of its path
+    """
+    max_len, n_seq, M = emit_m.shape
+    t = _Transitions(tsc)
+
+    # Scores of the current row and traceback pointers of every row
+    score_m = np.full((n_seq, M), -np.inf)
+    score_i = np.full((n_seq, M), -np.inf)
+    score_d = np.full((n_seq, M), -np.inf)
+    score_n = np.zeros(n_seq)
+    score_c = np.full(n_seq, -np.inf)
+
+    trace_m = np.zeros((max_len + 1, n_seq, M), dtype=np.uint8)
+    trace_i = np.zeros((max_len + 1, n_seq, M), dtype=bool)
+    trace_d = np.zeros((max_len + 1, n_seq, M), dtype=bool)
+    end_row = np.zeros(n_seq, dtype=np.intp)
+    end_node = np.zeros(n_seq, dtype=np.intp)
+
+    for i in range(1, max_len + 1):
+        active = lengths >= i
+
+        # Match states: from M, I or D of the previous node, or local entry
+        prev = np.empty((4, n_seq, M))
+        prev[STATE_M] = _shift(score_m + t.mm)
+        prev[STATE_I] = _shift(score_i + t.im)
+        prev[STATE_D] = _shift(score_d + t.dm)
+        prev[STATE_B] = (score_n + move)[:, None] + entry
+        trace_m[i] = prev.argmax(axis=0)
+        new_m = np.take_along_axis(prev, trace_m[i][None], axis=0)[0]
+        new_m += emit_m[i - 1]
+
+        # Insert states
+        from_m = score_m + t.mi
+        from_i = score_i + t.ii
+        trace_i[i] = from_i > from_m
+        new_i = np.maximum(from_m, from_i) + emit_i[i - 1]
+
+        # Delete states, from M or D of the previous node
+        into_d = _shift(new_m + t.md)
+        new_d = _chain(into_d, _shift(t.dd, 0.0), np.maximum.accumulate)
+        trace_d[i] = into_d < new_d
+
+        # End state: local exit from any match state or from the last delete
+        exit_scores = np.concatenate([new_m, new_d[:, -1:]], axis=1)
+        row_e = exit_scores.max(axis=1)
+
+        # C state: the alignment ends at the best E state of all the rows
+        stay_c = score_c + loop_c[i - 1]
+        ends_here = active & (row_e >= stay_c)
+        end_row[ends_here] = i
+        end_node[ends_here] = exit_scores[ends_here].argmax(axis=1)
+
+        score_m = np.where(active[:, None], new_m, score_m)
+        score_i = np.where(active[:, None], new_i, score_i)
+        score_d = np.where(active[:, None], new_d, score_d)
+        score_c = np.where(active, np.maximum(stay_c, row_e), score_c)
+        score_n = np.where(active, score_n + loop_n[i - 1], score_n)
+
+    scores = score_c + move
+
+    paths = []
+    for num in range(n_seq):
+        if np.isfinite(scores[num]):
+            paths.append(
+                _traceback(
+                    trace_m[:, num],
+                    trace_i[:, num],
+                    trace_d[:, num],
+                    end_row[num],
+                    end_node[num],
+                    M,
+                )
+            )
+        else:
+            paths.append([])
+
+    return scores, paths
+
+
+def _traceback(trace_m, trace_i, trace_d, row, end, M):
+    """Path of a sequence from its pointers, from the end to the begin state"""
+    path = []
+    if end == M:
+        # exit from the last delete state
+        state, k = STATE_D, M - 1
+    else:
+        state, k = STATE_M, end
+
+    while True:
+        if state == STATE_M:
+            path.append((STATE_M, k + 1, row - 1))
+            state = trace_m[row, k]
+            row -= 1
+            k -= 1
+            if state == STATE_B:
+                break
+        elif state == STATE_I:
+            path.append((STATE_I, k + 1, row - 1))
+            state = STATE_I if trace_i[row, k] else STATE_M
+            row -= 1
+        else:
+            path.append((STATE_D, k + 1, None))
+            state = STATE_D if trace_d[row, k] else STATE_M
+            k -= 1
+
+    path.reverse()
+    return path
+
+
+def _emissions(hmm, digital):
+    """(L, N, M) scores of the residues of the sequences in the match states"""
+    return np.moveaxis(hmm.msc[:, digital], 0, -1).swapaxes(0, 1)
+
+
+def viterbi(hmm, sequences):
+    """Viterbi alignment of many sequences to a profile HMM.
+
+    Returns the Viterbi scores (nats) and, for every sequence, the list of
+    (state, node, residue position) of its path through the model
+    """
+    digital, lengths = digitize(sequences)
+    loop, move, _, _ = hmm.special(lengths)
+    emit_m = _emissions(hmm, digital)
+    loops = np.broadcast_to(loop, emit_m.shape[:2])
+
+    return _best_path(
+        emit_m, np.zeros_like(emit_m), loops, loops, move, hmm.tsc, hmm.entry, lengths
+    )
+
+
+def _delete_matrix(tdd):
+    """(M, M) matrix of the products of the delete to delete transitions.
+
+    T[j, k] = tdd[j] * ... * tdd[k - 1], so that the delete chain of a row
+    D[k] = a[k] + D[k - 1] * tdd[k - 1] is the product a @ T
+    """
+    M = len(tdd)
+    chain = np.zeros((M, M))
+    for j in range(M):
+        chain[j, j:] = np.cumprod(np.concatenate([[1.0], tdd[j : M - 1]]))
+    return chain
+
+
+def _scale(rows):
+    """Scale factors of a row of the probability matrices (1 for empty rows)"""
+    scale = np.max([r.max(axis=-1) if r.ndim > 1 else r for r in rows], axis=0)
+    scale[scale == 0] = 1.0
+    return scale
+
+
+class _Probabilities:
+    """Transition and emission probabilities of a profile for the Forward and
+    Backward algorithms, indexed by the node (0..M-1 = nodes 1..M) they start from
+    """
+
+    def __init__(self, hmm):
+        M = hmm.length
+        t = np.exp(hmm.tsc[1 : M + 1])
+        self.mm, self.mi, self.md, self.im, self.ii, self.dm, self.dd = t.T
+        self.delete = _delete_matrix(self.dd)
+        self.entry = np.exp(hmm.entry)
+        self.odds = np.exp(hmm.msc)
+
+
+def forward(hmm, digital, lengths, multihit=False):
+    """Forward algorithm of a local profile, single hit (as hmmalign) or
+    multiple hits (as hmmscan).
+
+    The probabilities are rescaled at every row. Returns the log-likelihood
+    (nats) of every sequence, the scaled (L + 1, N, M) matrices of the M and I
+    states, the scaled (L + 1, N) ones of the N, J and C states and the (L + 1, N)
+    logarithm of the scale of every row
+    """
+    n_seq, max_len = digital.shape
+    M = hmm.length
+    p = _Probabilities(hmm)
+    loop, move, e_c, e_j = (np.exp(x) for x in hmm.special(lengths, multihit))
+
+    fwd_m, fwd_i = np.zeros((2, max_len + 1, n_seq, M))
+    fwd_n, fwd_j, fwd_c, log_scale = np.zeros((4, max_len + 1, n_seq))
+    fwd_n[0] = 1.0
+    score_d = np.zeros((n_seq, M))
+
+    for i in range(1, max_len + 1):
+        begin = (fwd_n[i - 1] + fwd_j[i - 1]) * move
+
+        # Match states: from M, I or D of the previous node, or local entry
+        new_m = _shift(fwd_m[i - 1] * p.mm + fwd_i[i - 1] * p.im + score_d * p.dm, 0)
+        new_m += begin[:, None] * p.entry
+        new_m *= p.odds[:, digital[:, i - 1]].T
+
+        # Insert states (emission odds are one), then delete states
+        new_i = fwd_m[i - 1] * p.mi + fwd_i[i - 1] * p.ii
+        score_d = _shift(new_m * p.md, 0) @ p.delete
+
+        # Local exit from any match or delete state
+        row_e = new_m.sum(axis=1) + score_d.sum(axis=1)
+        new_j = fwd_j[i - 1] * loop + row_e * e_j
+        new_c = fwd_c[i - 1] * loop + row_e * e_c
+        new_n = fwd_n[i - 1] * loop
+
+        scale = _scale([new_m, new_i, new_n, new_j, new_c])
+        fwd_m[i] = new_m / scale[:, None]
+        fwd_i[i] = new_i / scale[:, None]
+        score_d /= scale[:, None]
+        fwd_n[i], fwd_j[i], fwd_c[i] = new_n / scale, new_j / scale, new_c / scale
+        log_scale[i] = log_scale[i - 1] + np.log(scale)
+
+    last = lengths, np.arange(n_seq)
+    with np.errstate(divide="ignore"):
+        scores = np.log(fwd_c[last] * move) + log_scale[last]
+    return scores, (fwd_m, fwd_i, fwd_n, fwd_j, fwd_c), log_scale
+
+
+def backward(hmm, digital, lengths, multihit=False):
+    """Backward algorithm of a local profile.
+
+    Returns the scaled (L + 1, N, M) matrices of the M and I states, the scaled
+    (L + 1, N) ones of the N, J and C states and the (L + 1, N) logarithm of
+    the scale of every row (product of the scales from the row to the end)
+    """
+    n_seq, max_len = digital.shape
+    M = hmm.length
+    p = _Probabilities(hmm)
+    loop, move, e_c, e_j = (np.exp(x) for x in hmm.special(lengths, multihit))
+
+    bck_m, bck_i = np.zeros((2, max_len + 2, n_seq, M))
+    bck_n, bck_j, bck_c, log_scale = np.zeros((4, max_len + 2, n_seq))
+
+    for i in range(max_len, 0, -1):
+        last = lengths == i
+        after = ~last
+
+        # Next row: match states with their emission, nothing after the last residue
+        if i < max_len:
+            next_m = bck_m[i + 1] * p.odds[:, digital[:, i]].T * after[:, None]
+        else:
+            next_m = np.zeros((n_seq, M))
+        next_i = bck_i[i + 1] * after[:, None]
+
+        begin = (next_m * p.entry).sum(axis=1) * move
+        new_c = np.where(last, move, bck_c[i + 1] * loop)
+        new_j = bck_j[i + 1] * after * loop + begin
+        new_n = bck_n[i + 1] * after * loop + begin
+        row_e = (new_c * e_c + new_j * e_j)[:, None]
+
+        # Delete states, chained from the last node to the first one
+        into_d = _unshift(next_m, 0) * p.dm + row_e
+        into_d[:, -1] = row_e[:, 0]
+        score_d = into_d @ p.delete.T
+
+        new_m = (
+            _unshift(next_m, 0) * p.mm
+            + _unshift(score_d, 0) * p.md
+            + next_i * p.mi
+            + row_e
+        )
+        new_m[:, -1] = row_e[:, 0]
+        new_i = _unshift(next_m, 0) * p.im + next_i * p.ii
+
+        scale = _scale([new_m, new_i, new_n, new_j, new_c])
+        bck_m[i] = new_m / scale[:, None]
+        bck_i[i] = new_i / scale[:, None]
+        bck_n[i], bck_j[i], bck_c[i] = new_n / scale, new_j / scale, new_c / scale
+        log_scale[i] = np.log(scale) + np.where(last, 0.0, log_scale[i + 1])
+
+    return (
+        (bck_m[:-1], bck_i[:-1], bck_n[:-1], bck_j[:-1], bck_c[:-1]),
+        log_scale[:-1],
+    )
+
+
+def posterior(hmm, digital, lengths, multihit=False):
+    """Posterior probabilities of the residues in the M, I, N, J and C states.
+
+    Returns the log-likelihood (nats) of every sequence, the (L, N, M) matrices
+    of the M and I states and the (L, N) ones of the N, J and C states,
+    normalized per residue as in p7_GDecoding
+    """
+    loop = np.exp(hmm.special(lengths, multihit)[0])
+    scores, fwd, fwd_scale = forward(hmm, digital, lengths, multihit)
+    bck, bck_scale = backward(hmm, digital, lengths, multihit)
+
+    with np.errstate(invalid="ignore", over="ignore"):
+        # M and I states emit in their row
+        factor = np.exp(fwd_scale[1:] + bck_scale[1:] - scores)
+        post = [f[1:] * b[1:] * factor[..., None] for f, b in zip(fwd[:2], bck[:2])]
+
+        # N, J and C states emit on the transition from the previous row
+        factor = np.exp(fwd_scale[:-1] + bck_scale[1:] - scores) * loop
+        post += [f[:-1] * b[1:] * factor for f, b in zip(fwd[2:], bck[2:])]
+
+        post = [np.nan_to_num(x) for x in post]
+        denom = post[0].sum(axis=2) + post[1].sum(axis=2) + sum(post[2:])
+        denom[denom == 0] = 1.0
+
+    post[0] = post[0] / denom[..., None]
+    post[1] = post[1] / denom[..., None]
+    return [scores] + post[:2] + [x / denom for x in post[2:]]
+
+
+def optimal_accuracy(hmm, sequences):
+    """Optimal accuracy alignment of many sequences, as in hmmalign.
+
+    The path maximizes the sum of the posterior probabilities of its residues
+    among the allowed transitions (p7_GOptimalAccuracy). Returns the scores and
+    the paths as viterbi
+    """
+    digital, lengths = digitize(sequences)
+    _, post_m, post_i, post_n, _, post_c = posterior(hmm, digital, lengths)
+
+    allowed = np.where(np.isfinite(hmm.tsc), 0.0, -np.inf)
+    entry = np.where(np.isfinite(hmm.entry), 0.0, -np.inf)
+
+    return _best_path(
+        post_m,
+        post_i,
+        post_n,
+        post_c,
+        np.zeros(len(sequences)),
+        allowed,
+        entry,
+        lengths,
+    )
+
+
+def null_score(lengths):
+    """Log-likelihood (nats) of the sequences under the null model"""
+    lengths = np.asarray(lengths, dtype=float)
+    return lengths * np.log(lengths / (lengths + 1.0)) - np.log(lengths + 1.0)
+
+
+def null2_bias(hmm, digital, lengths, post_m, post_i, post_n, post_j, post_c):
+    """Score correction (nats) for the biased composition of the sequences.
+
+    The null2 model of HMMER is estimated from the posterior probabilities of
+    the whole sequences, every residue weighted by its probability of being in
+    a domain (the domains of HMMER are not defined here)
+    """
+    padding = np.arange(digital.shape[1]) >= lengths[:, None]
+    in_domain = np.where(padding.T, 0.0, 1.0 - post_n - post_j - post_c)
+    n_domain = np.maximum(in_domain.sum(axis=0), 1e-10)
+
+    # Expected emission odds of every residue in the domains
+    odds = post_m.sum(axis=0) @ np.exp(hmm.msc) + post_i.sum(axis=(0, 2))[:, None]
+    null2 = np.log(np.maximum(odds / n_domain[:, None], 1e-30))
+
+    residue_scores = np.take_along_axis(null2, digital, axis=1) * in_domain.T
+    return np.logaddexp(0.0, np.log(NULL2_OMEGA) + residue_scores.sum(axis=1))
+
+
+def _chunks(sequences):
+    """Chunks of at most CHUNK_SIZE sequences of similar length (less padding).
+
+    Yields the indices of the sequences of every chunk and their sequences
+    """
+    order = sorted(range(len(sequences)), key=lambda num: len(sequences[num]))
+    for start in range(0, len(order), CHUNK_SIZE):
+        indices = order[start : start + CHUNK_SIZE]
+        yield indices, [sequences[num] for num in indices]
+
+
+def forward_scores(hmm, sequences):
+    """Forward scores (bits) of many sequences against a profile HMM, as the
+    sequence scores of hmmscan (multiple hits, null2 correction)
+    """
+    scores = np.zeros(len(sequences))
+    for indices, chunk in _chunks(sequences):
+        digital, lengths = digitize(chunk)
+        fwd, *post = posterior(hmm, digital, lengths, multihit=True)
+        bias = null2_bias(hmm, digital, lengths, *post)
+        scores[indices] = (fwd - null_score(lengths) - bias) / np.log(2)
+    return scores
+
+
+def evalues(hmm, scores, n_models=1):
+    """E-values of Forward scores from the STATS LOCAL FORWARD calibration.
+
+    n_models = size of the database (hmmscan -Z)
+    """
+    tau, lambda_ = hmm.stats["FORWARD"]
+    with np.errstate(over="ignore"):
+        pvalues = np.minimum(np.exp(-lambda_ * (np.asarray(scores) - tau)), 1.0)
+    return pvalues * n_models
+
+
+def scan_sequences(hmm_file, sequences):
+    """Score many sequences against all the profile HMMs of a file, as hmmscan -Z 1.
+
+    Returns a dictionary with the name of every model as key and the array of
+    the E-values of the sequences as value
+    """
+    return {
+        hmm.name: evalues(hmm, forward_scores(hmm, sequences))
+        for hmm in load_hmms(os.path.abspath(hmm_file))
+    }
+
+
+def match_string(hmm, sequence, path):
+    """Aligned sequence of the match states, as ParseHmmer.read_align.
+
+    It is empty if the path has insertions, as for the hmmalign --trim output
+    with '.' in the #=GC RF line
+    """
+    if not path:
+        return ""
+
+    aligned = ["-"] * hmm.length
+    for state, k, pos in path:
+        if state == STATE_I:
+            return ""
+        if state == STATE_M:
+            aligned[k - 1] = sequence[pos]
+
+    return "".join(aligned)
+
+
+def align_sequences(hmm_file, sequences):
+    """Align many sequences to the profile HMM of a file, as hmmalign --trim.
+
+    sequences = list of protein sequences
+    Returns the list of the aligned sequences (empty if the alignment failed)
+    """
+    hmm = load_hmm(hmm_file)
+
+    aligned = [""] * len(sequences)
+    for indices, chunk in _chunks(sequences):
+        _, paths = optimal_accuracy(hmm, chunk)
+        for num, seq, path in zip(indices, chunk, paths):
+            aligned[num] = match_string(hmm, seq, path)
+
+    return aligned
+
+
+def parity(sequences, isotypes, work_dir):
+    """Compare the native alignments with the ones of hmmalign.
+
+    sequences, isotypes = dictionaries with the query id as key, as for
+    jobinput.align_batch. Returns the fraction of identical alignments and the
+    list of the query ids with different alignments
+    """
+    import proabc_2.jobinput as ji
+
+    reference = ji.align_batch(sequences, isotypes, work_dir)
+    native = ji.align_batch(sequences, isotypes, work_dir, native=True)
+
+    different = [q for q in reference if reference[q] != native[q]]
+    return 1 - len(different) / max(len(reference), 1), different
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Check the native alignments against the ones of hmmalign"
+    )
+    parser.add_argument("fasta", help="FASTA file with the sequences of the chains")
+    parser.add_argument(
+        "isotype", choices=["H", "K", "L"], help="Isotype of all the chains"
+    )
+    args = parser.parse_args()
+
+    sequences = {}
+    header = None
+    with open(args.fasta) as fhIn:
+        for line in fhIn:
+            line = line.strip()
+            if line.startswith(">"):
+                header = line[1:]
+                sequences[header] = ""
+            elif line and header is not None:
+                sequences[header] += line.upper()
+
+    isotypes = {q: args.isotype for q in sequences}
+    with tempfile.TemporaryDirectory() as work_dir:
+        agreement, different = parity(sequences, isotypes, work_dir + "/")
+
+    print(f"{agreement:.2%} of {len(sequences)} alignments identical to hmmalign")
+    for query_id in different:
+        print(query_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+
+"""
+Prediction server of proABC-2.
+
+The network, the encoding table, the profile HMMs and the germline indexes
+are loaded once when the server starts, then the antibodies are predicted on
+request. The server listens on localhost (or on a Unix socket) and answers:
+
+    GET  /health   200 as soon as the server is running
+    GET  /ready    200 once the resources are loaded, 503 before
+    GET  /stats    histograms of the queue depth and of the batch size
+    GET  /metrics  metrics of the server in the Prometheus text format
+    POST /predict  predictions of one or more antibodies
+
+The body of /predict is a JSON object with the heavy and light chains of one
+antibody, {"id": ..., "heavy": ..., "light": ...}, or with a list of them,
+{"antibodies": [...]}. Every antibody is returned with its status and, if
+the status is OK, the per-residue tables of heavy-pred.csv and light-pred.csv,
+as a list of records or, with "format": "csv", as the CSV text.
+
+The forward passes of the concurrent requests go through a
+batcher.MicroBatcher, so the network is called once for many antibodies.
+When its queue has no room for the antibodies of a request, /predict answers
+503 right away, before their features are calculated, and 413 if the request
+has more antibodies than the queue can hold.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import queue
+import socketserver
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+import proabc_2.batch as ba
+import proabc_2.cnn as cn
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2 import metrics, trace
+from proabc_2.batcher import MicroBatcher
+from proabc_2.cache import (
+    DEFAULT_MAX_SIZE,
+    MEMORY_ENTRIES,
+    ResultCache,
+    StageCache,
+    split_size,
+)
+from proabc_2.germline_kmer import load_index
+
+# Length of the encoded heavy + light sequences
+SEQ_LENGTH = 297
+
+# Formats of the per-residue tables in the responses
+OUTPUT_FORMATS = ["records", "csv"]
+
+# Maximum size of a request body, in bytes
+MAX_REQUEST_SIZE = 16 * 1024**2
+
+
+class RequestTooLarge(Exception):
+    """Request with more antibodies than the queue of the batcher can hold"""
+
+
+class PredictionService:
+    """proABC-2 pipeline with its resources kept in memory.
+
+    The predictions are also kept in a ResultCache, in memory and, if cache_dir
+    is given, on disk with the results of the per-chain stages.
+
+    max_batch_size, max_wait (seconds) and max_queue = settings of the
+    MicroBatcher of the forward passes
+    """
+
+    def __init__(
+        self,
+        engine="tf",
+        hmm_backend="native",
+        germline_backend="kmer",
+        germline_index=None,
+        num_threads=1,
+        cache_dir=None,
+        cache_size=DEFAULT_MAX_SIZE,
+        memory_entries=MEMORY_ENTRIES,
+        max_batch_size=50,
+        max_wait=0.005,
+        max_queue=1024,
+    ):
+        self.engine = engine
+        self.hmm_backend = hmm_backend
+        self.germline_backend = germline_backend
+        self.germline_index = germline_index
+        self.num_threads = num_threads
+        self.params = f"{engine}/{hmm_backend}/{germline_backend}"
+
+        stage_size, result_size = split_size(cache_size)
+        self.stages = StageCache(cache_dir, stage_size) if cache_dir else None
+        self.results = ResultCache(
+            os.path.join(cache_dir, "predictions") if cache_dir else None,
+            result_size,
+            memory_entries,
+        )
+
+        self.ready = threading.Event()
+        self.error = None
+        self.batcher = MicroBatcher(self._forward, max_batch_size, max_wait, max_queue)
+
+    def _forward(self, items):
+        """Predictions of the network for a list of (encoded sequence, features)"""
+        seq_data = np.stack([seq for seq, _ in items])
+        feat_data = np.stack([feat for _, feat in items])
+        _, hps = pr.model_parameters(seq_data)
+        model = cn.get_predictor(
+            pr.MODEL_PATH, hps, seq_data.shape[1:], feat_data.shape[1], self.engine
+        )
+        with trace.span("predict", antibodies=len(items)):
+            return list(model.predict((seq_data, feat_data)))
+
+    def load(self):
+        """Load the network, the encoding table and the HMM and germline resources"""
+        try:
+            _, matrix = cn.load_encoding(pr.SEQ_ENCODING)
+            seq_shape = (SEQ_LENGTH, matrix.shape[1] + 1)
+            _, hps = pr.model_parameters(np.empty((0,) + seq_shape))
+            cn.get_predictor(pr.MODEL_PATH, hps, seq_shape, cn.N_FEATURES, self.engine)
+
+            if self.hmm_backend == "native":
+                from proabc_2.profile_hmm import load_hmm, load_hmms
+
+                load_hmms(os.path.abspath(ji.MARKOV_MODELS + ji.HMM_DATABASE))
+                for hmm in ji.HMM_FILES.values():
+                    load_hmm(ji.MARKOV_MODELS + hmm)
+
+            if self.germline_backend == "kmer":
+                for ig_database in ba.IG_DATABASES.values():
+                    load_index(ig_database, self.germline_index)
+
+        except Exception as err:
+            self.error = str(err)
+            raise
+
+        self.ready.set()
+
+    def predict(self, pairs):
+        """Make the predictions of a list of (id, heavy sequence, light sequence).
+
+        Returns a dictionary {id: (status, heavy data-frame, light data-frame)},
+        the data-frames of the failed antibodies are None. It raises
+        RequestTooLarge if the antibodies to predict do not fit in the queue of
+        the batcher, and queue.Full if it has no room for them: this is checked
+        before calculating the features, and again when they are queued (other
+        requests may have filled the queue in the meantime). Nothing of the
+        request is then predicted
+        """
+        with trace.span("request", antibodies=len(pairs)) as span:
+            keys = {
+                ab_id: pr.result_key(self.results, heavy_seq, light_seq, self.params)
+                for ab_id, heavy_seq, light_seq in pairs
+            }
+
+            results = {}
+            for ab_id, _, _ in pairs:
+                result = self.results.get_key(keys[ab_id])
+                if result is not None:
+                    results[ab_id] = pr.unpack_result(result)
+
+            status = {}
+            jobs = []
+            todo = [pair for pair in pairs if pair[0] not in results]
+            if len(todo) > self.batcher.max_queue:
+                raise RequestTooLarge(
+                    f"The request has more than {self.batcher.max_queue} antibodies"
+                    " to predict, split it in smaller requests"
+                )
+            if len(todo) > self.batcher.free():
+                raise queue.Full
+            if todo:
+                with tempfile.TemporaryDirectory(prefix="proabc2-") as work_dir:
+                    status, jobs = ba.batch_features(
+                        todo,
+                        work_dir,
+                        self.num_threads,
+                        self.hmm_backend,
+                        self.germline_backend,
+                        self.germline_index,
+                        self.stages,
+                    )
+
+            if jobs:
+                # Forward passes batched with the ones of the other requests
+                seq_data, feat_data = ba.encode_jobs(jobs)
+                y_pred = self.batcher.map(list(zip(seq_data, feat_data)))
+
+                for (ab_id, _, features), y in zip(jobs, y_pred):
+                    self.results.put_key(keys[ab_id], pr.pack_result(y, features))
+                    results[ab_id] = (y,) + tuple(features[1:])
+
+            outputs = {}
+            for ab_id, _, _ in pairs:
+                if ab_id in results:
+                    heavy_out, light_out = pr.format_output(*results[ab_id])
+                    outputs[ab_id] = ("OK", heavy_out, light_out)
+                else:
+                    outputs[ab_id] = (status[ab_id], None, None)
+                metrics.record_status(outputs[ab_id][0])
+            span["cached"] = len(pairs) - len(todo)
+        return outputs
+
+
+def read_request(body):
+    """Read the antibodies of a /predict request.
+
+    Returns the list of (id, heavy sequence, light sequence) and the format of
+    the tables, it raises ValueError if the request is not valid
+    """
+    try:
+        request = json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError("The body of the request is not valid JSON")
+    if not isinstance(request, dict):
+        raise ValueError("The body of the request must be a JSON object")
+
+    output_format = request.get("format", "records")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown format '{output_format}', choose from {OUTPUT_FORMATS}"
+        )
+
+    antibodies = request.get("antibodies", [request])
+    if not isinstance(antibodies, list) or not antibodies:
+        raise ValueError("'antibodies' must be a non-empty list")
+
+    pairs = []
+    for num, antibody in enumerate(antibodies, 1):
+        if not isinstance(antibody, dict):
+            raise ValueError("Every antibody must be a JSON object")
+        ab_id = str(antibody.get("id", f"antibody{num}"))
+        heavy_seq = antibody.get("heavy")
+        light_seq = antibody.get("light")
+        if not isinstance(heavy_seq, str) or not isinstance(light_seq, str):
+            raise ValueError(f"Missing heavy or light chain for '{ab_id}'")
+        pairs.append((ab_id, heavy_seq.strip().upper(), light_seq.strip().upper()))
+
+    # Antibody IDs are used as folder names
+    ids = [ab_id for ab_id, _, _ in pairs]
+    for ab_id in ids:
+        if not ab_id or "/" in ab_id or ab_id.startswith("."):
+            raise ValueError(f"Invalid antibody id: '{ab_id}'")
+    if len(set(ids)) != len(ids):
+        raise ValueError("Duplicated antibody id")
+
+    return pairs, output_format
+
+
+def format_table(df, output_format):
+    """Per-residue table of a response"""
+    if output_format == "csv":
+        return df.to_csv()
+    return json.loads(df.to_json(orient="records"))
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of the requests of the prediction server"""
+
+    server_version = "proABC-2"
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "local"
+
+    def send_json(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, code, text, content_type="text/plain"):
+        body = text.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code, message):
+        self.send_json(code, {"status": "error", "error": message})
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self.send_json(200, service.batcher.stats())
+        elif self.path == "/metrics":
+            text = metrics.REGISTRY.text(
+                {
+                    "queue_depth": service.batcher.queue_depth,
+                    "batch_size": service.batcher.batch_size,
+                }
+            )
+            self.send_text(200, text, "text/plain; version=0.0.4")
+        elif self.path == "/ready":
+            if service.ready.is_set():
+                self.send_json(200, {"status": "ready"})
+            elif service.error is not None:
+                self.send_json(503, {"status": "failed", "error": service.error})
+            else:
+                self.send_json(503, {"status": "loading"})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path != "/predict":
+            self.send_error_json(404, f"Unknown path {self.path}")
+            return
+        if not service.ready.is_set():
+            self.send_error_json(503, "The server is not ready")
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_SIZE:
+            self.send_error_json(413, "The request is too large")
+            return
+
+        try:
+            pairs, output_format = read_request(self.rfile.read(length))
+        except ValueError as err:
+            self.send_error_json(400, str(err))
+            return
+
+        try:
+            outputs = service.predict(pairs)
+        except RequestTooLarge as err:
+            self.send_error_json(413, str(err))
+            return
+        except queue.Full:
+            self.send_error_json(503, "The server is overloaded, try again later")
+            return
+        except (Exception, SystemExit) as err:
+            self.send_error_json(500, str(err))
+            return
+
+        antibodies = []
+        for ab_id, _, _ in pairs:
+            status, heavy_out, light_out = outputs[ab_id]
+            antibody = {"id": ab_id, "status": status}
+            if heavy_out is not None:
+                antibody["heavy"] = format_table(heavy_out, output_format)
+                antibody["light"] = format_table(light_out, output_format)
+            antibodies.append(antibody)
+
+        self.send_json(200, {"antibodies": antibodies})
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """HTTP server listening on a Unix socket"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        # Remove the socket left by a previous server
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(service, host="127.0.0.1", port=8000, unix_socket=None):
+    """HTTP server of a PredictionService, on a TCP port or on a Unix socket"""
+    if unix_socket:
+        server = ThreadingUnixHTTPServer(unix_socket, RequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    return server
+
+
+def main():
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(
+        description="It runs a local server predicting the antibody residues that will make contact with the antigen",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address the server listens on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port the server listens on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Listen on a Unix socket instead of a TCP port",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=cn.ENGINES,
+        default="tf",
+        help="Implementation of the network: TensorFlow (default) or NumPy",
+    )
+    parser.add_argument(
+        "--hmm-backend",
+        choices=ba.HMM_BACKENDS,
+        default="native",
+        help="Implementation of the isotype classification and of the alignments:\n"
+        "profile_hmm, loaded once (default) or HMMER programs",
+    )
+    parser.add_argument(
+        "--germline-backend",
+        choices=ba.GERMLINE_BACKENDS,
+        default="kmer",
+        help="Implementation of the germline assignment: k-mer index of the\n"
+        "germline databases, loaded once (default) or igblastp",
+    )
+    parser.add_argument(
+        "--germline-index",
+        metavar="DIR",
+        help="Folder where the k-mer indexes are saved and memory-mapped from",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads of hmmscan and igblastp (default: 1)",
+    )
+    parser.add_argument(
+        "--memory-entries",
+        type=int,
+        default=MEMORY_ENTRIES,
+        help="Number of predictions kept in memory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=50,
+        help="Maximum number of antibodies per forward pass of the network\n"
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=5,
+        metavar="MS",
+        help="Maximum time an antibody waits for the other ones of its batch,\n"
+        "in milliseconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=1024,
+        help="Maximum number of antibodies waiting for the network, the\n"
+        "requests are rejected when it is reached (default: %(default)s)",
+    )
+    pr.add_cache_arguments(parser)
+    trace.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.threads < 1:
+        parser.error("--threads must be a positive integer")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be a positive integer")
+    if args.memory_entries < 0:
+        parser.error("--memory-entries must not be negative")
+    if args.max_batch_size < 1:
+        parser.error("--max-batch-size must be a positive integer")
+    if args.max_wait < 0:
+        parser.error("--max-wait must not be negative")
+    if args.max_queue < 1:
+        parser.error("--max-queue must be a positive integer")
+    trace.enable(args.trace, args.profile)
+    metrics.enable()
+
+    service = PredictionService(
+        args.engine,
+        args.hmm_backend,
+        args.germline_backend,
+        args.germline_index,
+        args.threads,
+        args.cache,
+        args.cache_size * 1024**2,
+        args.memory_entries,
+        args.max_batch_size,
+        args.max_wait / 1000,
+        args.max_queue,
+    )
+    server = make_server(service, args.host, args.port, args.socket)
+
+    # Load the resources in the background, /health answers in the meantime
+    def load():
+        try:
+            service.load()
+        except Exception as err:
+            print(f"ERROR loading the resources of proABC-2: {err}", file=sys.stderr)
+
+    threading.Thread(target=load, daemon=True).start()
+
+    address = args.socket or f"http://{args.host}:{args.port}"
+    print(f"proABC-2 server listening on {address}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Structured trace of the stages of proABC-2.
+
+Every stage run inside trace.span() is written as one JSON line to the
+trace file: name of the stage, antibody, enclosing stage, wall time, CPU
+time of the process and of its finished subprocesses, growth of the peak
+resident memory, exit code of the external tool (if any) and error (if
+the stage failed). Each stage can also be profiled with cProfile, one
+.prof file per span with the time spent in the span itself (the nested
+spans have their own files).
+
+Tracing is enabled by the PROABC2_TRACE environment variable (path of the
+trace file) and profiling by PROABC2_PROFILE (folder of the .prof files),
+which are set by the --trace and --profile options of the command line
+programs so that the worker processes inherit them. When they are not set,
+span() only costs an environment lookup (two if the metrics are collected,
+see metrics.py, which get the wall time of every span).
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import itertools
+import json
+import os
+import threading
+import time
+
+from proabc_2 import metrics
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Environment variables enabling the trace and the profiles
+TRACE_ENV = "PROABC2_TRACE"
+PROFILE_ENV = "PROABC2_PROFILE"
+
+# Spans open in the current thread (or task), innermost last
+_stack = contextvars.ContextVar("proabc2_spans", default=())
+
+_lock = threading.Lock()
+_tracer = None
+
+
+class _NullSpan:
+    """Span of a disabled trace, the fields set on it are discarded"""
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _TimedSpan:
+    """Span of a disabled trace, only timed for the metrics"""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return {}
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        metrics.observe("stage_seconds", wall, stage=self.stage)
+        return False
+
+
+def _usage():
+    """CPU time of the finished subprocesses and peak resident memory in kB"""
+    if resource is None:
+        return 0.0, 0
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return children.ru_utime + children.ru_stime, peak
+
+
+class Tracer:
+    """Writer of the spans to a JSON-lines file, shared by the threads of a process.
+
+    filename = trace file, the spans are appended to it
+    profile_dir = folder of the cProfile dumps of the spans (default: no profiles)
+    """
+
+    def __init__(self, filename, profile_dir=None):
+        self.filename = filename
+        self.profile_dir = profile_dir
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._fh = open(filename, "a", buffering=1)
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._fh.write(line)
+
+    def close(self):
+        self._fh.close()
+
+    def profile_name(self, stage, antibody):
+        """Path of the cProfile dump of a span"""
+        name = f"{stage}-{antibody or 'batch'}-{os.getpid()}-{next(self._counter)}"
+        return os.path.join(self.profile_dir, name.replace("/", "_") + ".prof")
+
+    @contextlib.contextmanager
+    def span(self, stage, antibody=None, **fields):
+        parents = _stack.get()
+        parent = parents[-1] if parents else None
+        if antibody is None and parent is not None:
+            antibody = parent["antibody"]
+
+        record = {
+            "stage": stage,
+            "antibody": antibody,
+            "parent": parent["stage"] if parent else None,
+            "pid": os.getpid(),
+            "start": time.time(),
+        }
+        record.update(fields)
+
+        # The profile of the enclosing span of this thread is paused, so that
+        # every profile only contains the time spent in its own span
+        thread = threading.get_ident()
+        outer = None
+        for span in reversed(parents):
+            if span["thread"] == thread:
+                outer = span["profiler"]
+                break
+        profiler = cProfile.Profile() if self.profile_dir else None
+        state = {
+            "stage": stage,
+            "antibody": antibody,
+            "thread": thread,
+            "profiler": profiler,
+        }
+
+        token = _stack.set(parents + (state,))
+        children_cpu, peak = _usage()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        if outer is not None:
+            outer.disable()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is running (Python 3.12 allows one per process)
+                profiler = state["profiler"] = None
+        try:
+            yield record
+        except BaseException as err:
+            record["error"] = type(err).__name__
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if outer is not None:
+                outer.enable()
+            record["wall"] = time.perf_counter() - wall
+            metrics.observe("stage_seconds", record["wall"], stage=stage)
+            record["cpu"] = time.process_time() - cpu
+            end_children_cpu, end_peak = _usage()
+            record["children_cpu"] = end_children_cpu - children_cpu
+            record["peak_rss_delta_kb"] = end_peak - peak
+            _stack.reset(token)
+
+            if profiler is not None:
+                record["profile"] = self.profile_name(stage, antibody)
+                profiler.dump_stats(record["profile"])
+            self.write(record)
+
+
+def tracer():
+    """Tracer of the process, None if the trace is not enabled"""
+    global _tracer
+    filename = os.environ.get(TRACE_ENV)
+    if not filename:
+        return None
+
+    settings = (filename, os.environ.get(PROFILE_ENV) or None)
+    with _lock:
+        if _tracer is None or (_tracer.filename, _tracer.profile_dir) != settings:
+            if _tracer is not None:
+                _tracer.close()
+            _tracer = Tracer(*settings)
+        return _tracer
+
+
+def span(stage, antibody=None, **fields):
+    """Context manager tracing a stage, it yields the record of the span.
+
+    antibody = ID of the antibody (default: the one of the enclosing span)
+    fields = other values written in the record (e.g. the number of sequences),
+    more can be set on the record inside the span (e.g. exit_code)
+    """
+    current = tracer()
+    if current is None:
+        return _TimedSpan(stage) if metrics.enabled() else _NULL_SPAN
+    return current.span(stage, antibody, **fields)
+
+
+def run_in_context(executor, function):
+    """Submit a function to an executor, inside the spans of the caller"""
+    return executor.submit(contextvars.copy_context().run, function)
+
+
+def enable(trace_file=None, profile_dir=None):
+    """Enable the trace (and the profiles) for this process and its workers"""
+    if trace_file:
+        os.environ[TRACE_ENV] = os.path.abspath(trace_file)
+    if profile_dir:
+        os.environ[PROFILE_ENV] = os.path.abspath(profile_dir)
+
+
+def add_arguments(parser):
+    """Add the options of the trace to a command line parser"""
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Append a JSON line per stage (timings, memory, exit codes) to FILE\n"
+        f"(also enabled by the {TRACE_ENV} environment variable)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="With --trace, write a cProfile dump of every stage to DIR\n"
+        f"(also enabled by the {PROFILE_ENV} environment variable)",
+    )
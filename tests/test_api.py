@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import proabc_2
+import proabc_2.api as api
+import proabc_2.batch as ba
+
+HEAVY = "EVQLVESGGGLVQPGGSLRLSCAASGYTFTNYGMNWVRQAPGKGLEWVGWINTYTGEPTYAADFKRRFTFSLDTSKSTAYLQMNSLRAEDTAVYYCAKYPHYYGSSHWYFDVWGQGTLVTVSS"
+LIGHT = "DIQMTQSPSSLSASVGDRVTITCSASQDISNYLNWYQQKPGKAPKVLIYFTSSLHSGVPSRFSGSGSGTDFTLTISSLQPEDFATYYCQQYSTVPWTFGQGTKVEIKRTV"
+
+
+@pytest.fixture
+def network(monkeypatch):
+    """Stand-in of the network predicting 0.5 for every residue"""
+
+    def predict_jobs(jobs, engine="tf", chunk_size=256):
+        for job in jobs:
+            _, numb_h, _, _, numb_L, _ = job[2]
+            yield job, np.full(
+                len(api.pr.OUTPUT_NAMES) * (len(numb_h) + len(numb_L)), 0.5
+            )
+
+    monkeypatch.setattr(ba, "predict_jobs", predict_jobs)
+
+
+def test_predict_pairs(tmp_path, monkeypatch, network):
+    # Nothing is written by default
+    monkeypatch.chdir(tmp_path)
+    [(heavy, light)] = proabc_2.predict_pairs([(HEAVY, LIGHT.lower())])
+
+    assert list(tmp_path.iterdir()) == []
+    assert list(heavy.columns) == ["Chothia", "Sequence"] + api.pr.OUTPUT_NAMES
+    assert "".join(heavy["Sequence"]) == HEAVY
+    assert "".join(light["Sequence"]) == LIGHT
+    assert heavy["Chothia"].iloc[0] == "1"
+    assert (light[api.pr.OUTPUT_NAMES] == 0.5).all().all()
+
+
+def test_predict_pairs_errors(tmp_path, monkeypatch, network):
+    monkeypatch.chdir(tmp_path)
+    pairs = [(HEAVY, LIGHT), ("", LIGHT), (LIGHT, LIGHT)]
+
+    with pytest.raises(proabc_2.InvalidSequenceError) as err:
+        proabc_2.predict_pairs(pairs)
+    assert err.value.index == 1
+
+    ok, empty, wrong = proabc_2.predict_pairs(pairs, errors="return")
+    assert len(ok) == 2
+    assert isinstance(empty, ValueError)
+    assert isinstance(wrong, proabc_2.ChainError)
+    assert (wrong.index, wrong.reason) == (2, "wrong_chain")
+    assert list(tmp_path.iterdir()) == []
+
+    proabc_2.predict_pairs(pairs, output_path=str(tmp_path / "out"), errors="return")
+    assert (tmp_path / "out" / "antibody1" / "heavy-pred.csv").exists()
+
+
+def test_predict_pairs_tool_error(monkeypatch):
+    monkeypatch.delenv("HMMER_PATH", raising=False)
+    with pytest.raises(proabc_2.ToolError) as err:
+        proabc_2.predict_pairs([(HEAVY, LIGHT)], hmm_backend="hmmer")
+    assert err.value.reason == "tool_error"
+    assert isinstance(err.value.__cause__, proabc_2.EnvironmentNotSetError)
+
+    monkeypatch.setenv("HMMER_PATH", "/nonexistent/hmmer/bin")
+    with pytest.raises(proabc_2.ToolError) as err:
+        proabc_2.predict_pairs([(HEAVY, LIGHT)], hmm_backend="hmmer")
+    assert isinstance(err.value.__cause__, OSError)
@@ -0,0 +1,121 @@
+from pathlib import Path
+
+import pytest
+
+import proabc_2.batch as ba
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2 import metrics
+from proabc_2.cache import StageCache
+
+HEAVY = "EVQLVESGGGLVQPGGSLRLSCAASGYTFTNYGMNWVRQAPGKGLEWVGWINTYTGEPTYAADFKRRFTFSLDTSKSTAYLQMNSLRAEDTAVYYCAKYPHYYGSSHWYFDVWGQGTLVTVSS"
+LIGHT = "DIQMTQSPSSLSASVGDRVTITCSASQDISNYLNWYQQKPGKAPKVLIYFTSSLHSGVPSRFSGSGSGTDFTLTISSLQPEDFATYYCQQYSTVPWTFGQGTKVEIKRTV"
+
+
+def test_read_paired_fasta(tmp_path):
+    fasta = tmp_path / "pairs.fasta"
+    fasta.write_text(
+        f">ab1 heavy\n{HEAVY[:60]}\n{HEAVY[60:]}\n>ab1_L\n{LIGHT}\n"
+        f">ab2\n{HEAVY.lower()}\n>ab2_L\n{LIGHT}\n"
+    )
+
+    pairs = ba.read_pairs(str(fasta))
+
+    assert pairs == [("ab1", HEAVY, LIGHT), ("ab2", HEAVY, LIGHT)]
+
+
+def test_read_paired_fasta_odd(tmp_path):
+    fasta = tmp_path / "pairs.fasta"
+    fasta.write_text(f">ab1\n{HEAVY}\n")
+
+    with pytest.raises(ValueError):
+        ba.read_pairs(str(fasta))
+
+
+def test_read_manifest(tmp_path):
+    csv_file = tmp_path / "pairs.csv"
+    csv_file.write_text(f"id,heavy,light\nab1,{HEAVY},{LIGHT}\n")
+    tsv_file = tmp_path / "pairs.tsv"
+    tsv_file.write_text(f"id\theavy\tlight\nab1\t{HEAVY}\t{LIGHT}\n")
+
+    assert ba.read_pairs(str(csv_file)) == [("ab1", HEAVY, LIGHT)]
+    assert ba.read_pairs(str(tsv_file)) == [("ab1", HEAVY, LIGHT)]
+
+
+def test_read_manifest_duplicated_id(tmp_path):
+    csv_file = tmp_path / "pairs.csv"
+    csv_file.write_text(f"id,heavy,light\nab1,{HEAVY},{LIGHT}\nab1,{HEAVY},{LIGHT}\n")
+
+    with pytest.raises(ValueError):
+        ba.read_pairs(str(csv_file))
+
+
+def test_feature_chunks(tmp_path, monkeypatch):
+    # The working folders of the chunks are only created with the debug files
+    monkeypatch.setenv(ji.DEBUG_FILES_ENV, "1")
+    pairs = [(f"ab{num}", HEAVY, LIGHT) for num in range(3)] + [("bad", LIGHT, LIGHT)]
+    options = (1, "native", "kmer", None)
+
+    [(status, jobs)] = ba.feature_chunks(pairs, str(tmp_path / "one"), 1, 2, options)
+    chunks = list(ba.feature_chunks(pairs, str(tmp_path / "two"), 2, 2, options))
+
+    assert len(chunks) == 2
+    assert {k: v for s, _ in chunks for k, v in s.items()} == status
+    features = {ab_id: f[0] for _, chunk in chunks for ab_id, _, f in chunk}
+    assert sorted(features) == ["ab0", "ab1", "ab2"]
+    for ab_id, _, f in jobs:
+        assert features[ab_id].equals(f[0])
+    assert (tmp_path / "two" / "batch_1").is_dir()
+
+
+def test_feature_chunks_metrics(tmp_path, monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_ENV, "1")
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+    pairs = [(f"ab{num}", HEAVY, LIGHT) for num in range(3)]
+    options = (1, "native", "kmer", None)
+
+    # The metrics of the workers are merged in the ones of the main process
+    list(ba.feature_chunks(pairs, str(tmp_path), 2, 2, options))
+    assert metrics.REGISTRY.histogram("stage_seconds", stage="numbering").count == 3
+
+
+def test_progress_line():
+    assert (
+        ba.progress_line(30, 100, 2, 10, skipped=10)
+        == "30/100 antibodies (30.0%), 2 failed, 2.00 antibodies/s, ETA 0:00:35"
+    )
+    assert ba.progress_line(100, 100, 0, 10).endswith("10.00 antibodies/s, done")
+
+
+def test_germline_single_and_batch(tmp_path):
+    # Chains with the start of their constant region
+    heavy = HEAVY + "ASTKGPSVFPLAPSSKSTSGGTAALGCLVKDYFPEPVTVSWNSGALTSGVHTFPAVLQ"
+    light = LIGHT + "AAPSVFIFPPSDEQLKSGTASVVCLLNNFYPREAKVQWKVDNALQSGNSQESVTEQD"
+    jobid = str(tmp_path / "single") + "/"
+    Path(jobid).mkdir()
+    Path(jobid, "heavy.fasta").write_text(f">heavy\n{heavy}\n")
+    Path(jobid, "light.fasta").write_text(f">light\n{light}\n")
+    cache = StageCache(str(tmp_path / "cache"))
+
+    with open(jobid + "session.log", "w") as log:
+        single = pr.get_features(
+            jobid,
+            "",
+            "light.fasta",
+            "heavy.fasta",
+            pr.IG_DATABASE_H,
+            pr.IG_DATABASE_K,
+            pr.IG_DATABASE_L,
+            log,
+            cache,
+        )[0]
+    status, [(_, _, features)] = ba.batch_features(
+        [("ab1", heavy, light)], str(tmp_path / "batch"), cache=cache
+    )
+
+    assert status == {}
+    columns = ["H_Germline", "L_Germline"]
+    assert features[0][columns].equals(single[columns])
+    # The scan, align and germline stages of both chains are only computed by
+    # the single mode, the batch finds them in the cache
+    assert cache.misses == 6
@@ -0,0 +1,98 @@
+import queue
+import threading
+
+import pytest
+
+from proabc_2.batcher import Histogram, MicroBatcher
+
+
+def test_histogram():
+    histogram = Histogram([1, 10])
+    for value in [0, 1, 5, 50]:
+        histogram.observe(value)
+
+    assert histogram.snapshot() == {
+        "buckets": {"1": 2, "10": 3, "+Inf": 4},
+        "count": 4,
+        "sum": 56,
+    }
+
+
+def test_batching():
+    batches = []
+
+    def double(items):
+        batches.append(len(items))
+        return [2 * item for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait=0.5)
+    results = {}
+
+    def call(num):
+        results[num] = batcher.map([num, num + 100])
+
+    threads = [threading.Thread(target=call, args=(num,)) for num in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {num: [2 * num, 2 * num + 200] for num in range(4)}
+    assert sorted(batches) == [4, 4]
+    assert batcher.stats()["batch_size"]["count"] == 2
+    assert batcher.stats()["queue_depth"]["count"] == 8
+
+
+def test_backpressure():
+    release = threading.Event()
+
+    def wait(items):
+        release.wait()
+        return items
+
+    batcher = MicroBatcher(wait, max_batch_size=1, max_wait=0, max_queue=1)
+    first = batcher.submit("a")
+    # Wait for the worker to take the first item out of the queue
+    while batcher._queue.qsize():
+        pass
+    second = batcher.submit("b")
+    with pytest.raises(queue.Full):
+        batcher.submit("c")
+
+    release.set()
+    assert (first.result(), second.result()) == ("a", "b")
+    batcher.close()
+
+
+def test_cancel_rejected_request():
+    release = threading.Event()
+    seen = []
+
+    def wait(items):
+        release.wait()
+        seen.extend(items)
+        return items
+
+    batcher = MicroBatcher(wait, max_batch_size=1, max_wait=0, max_queue=2)
+    first = batcher.submit("a")
+    while batcher._queue.qsize():
+        pass
+    # Only "b" and "c" fit in the queue, the whole request is rejected
+    with pytest.raises(queue.Full):
+        batcher.map(["b", "c", "d"])
+
+    release.set()
+    assert first.result() == "a"
+    batcher.close()
+    assert seen == ["a"]
+
+
+def test_errors():
+    def fail(items):
+        raise ValueError("network error")
+
+    batcher = MicroBatcher(fail)
+    with pytest.raises(ValueError):
+        batcher.map([1])
+    batcher.close()
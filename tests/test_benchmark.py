@@ -0,0 +1,57 @@
+import proabc_2.benchmark as bm
+import proabc_2.jobinput as ji
+from proabc_2 import metrics
+
+
+def test_synthetic_pairs():
+    pairs = bm.synthetic_pairs(20, seed=1)
+
+    assert pairs == bm.synthetic_pairs(20, seed=1)
+    assert pairs != bm.synthetic_pairs(20, seed=2)
+    assert len({ab_id for ab_id, _, _ in pairs}) == 20
+
+    # The chains are recognized as antibodies of the expected type
+    sequences = {}
+    for ab_id, heavy_seq, light_seq in pairs:
+        sequences[ab_id, "H"] = heavy_seq
+        sequences[ab_id, "L"] = light_seq
+    isotypes, _ = ji.classify_isotypes(sequences, "", native=True)
+    for (_, chain), isotype in isotypes.items():
+        assert isotype in (["H"] if chain == "H" else ["K", "L"])
+
+
+def test_run_stages(tmp_path):
+    pairs = bm.synthetic_pairs(3)
+    seconds, status = bm.run_stages(
+        pairs,
+        str(tmp_path),
+        hmm_backend="native",
+        germline_backend="kmer",
+        network=False,
+    )
+
+    assert status == {}
+    assert list(seconds) == [
+        stage for stage in bm.STAGES if stage not in ("model_build", "predict")
+    ]
+    assert (tmp_path / "synthetic2" / "heavy-pred.csv").is_file()
+
+
+def test_run_stages_metrics(tmp_path, monkeypatch):
+    # The metrics collected before the benchmark are kept, and the collection
+    # is disabled again afterwards
+    monkeypatch.delenv(metrics.METRICS_ENV, raising=False)
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+    metrics.REGISTRY.inc("antibodies_total")
+
+    bm.run_stages(
+        bm.synthetic_pairs(1),
+        str(tmp_path),
+        hmm_backend="native",
+        germline_backend="kmer",
+        network=False,
+    )
+
+    assert not metrics.enabled()
+    assert metrics.REGISTRY.counters == {("antibodies_total", ()): 1}
+    assert metrics.REGISTRY.histograms == {}
@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+import proabc_2.jobinput as ji
+import proabc_2.proABC as pr
+from proabc_2.cache import ResultCache, StageCache, cached, split_size
+
+
+def test_stage_cache(tmp_path):
+    database = tmp_path / "models.hmm"
+    database.write_text("HMMER3/f\n")
+    cache = StageCache(str(tmp_path / "cache"))
+
+    assert cache.get("scan", "EVQLV", [str(database)]) is None
+    cache.put("scan", "EVQLV", {"H": 1e-50}, [str(database)], "hmmer")
+    assert cache.get("scan", "EVQLV", [str(database)], "hmmer") == {"H": 1e-50}
+    assert cache.get("scan", "EVQLV", [str(database)], "native") is None
+    assert cache.get("align", "EVQLV", [str(database)], "hmmer") is None
+
+    # A new version of the database invalidates the entries
+    database.write_text("HMMER3/f\nNAME  heavy\n")
+    assert cache.get("scan", "EVQLV", [str(database)], "hmmer") is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_run(tmp_path):
+    cache = StageCache(str(tmp_path))
+    computed = []
+
+    def compute(query_ids):
+        computed.append(query_ids)
+        return {q: q.upper() for q in query_ids}
+
+    assert cache.run("align", {"a": "A", "b": "B"}, compute) == {"a": "A", "b": "B"}
+    assert cache.run("align", {"b": "B", "c": "C"}, compute) == {"b": "B", "c": "C"}
+    assert computed == [["a", "b"], ["c"]]
+
+    assert cached(cache, "align", "A", lambda: "X") == "A"
+    assert cached(None, "align", "A", lambda: "X") == "X"
+
+
+def test_eviction(tmp_path):
+    cache = StageCache(str(tmp_path))
+    for num, seq in enumerate(["A", "B", "C"]):
+        cache.put("germline", seq, "IGHV3-Homo")
+        path = cache._path(cache.key("germline", seq))
+        os.utime(path, (num, num))
+    entry_size = cache.size // 3
+
+    # A is the oldest entry, but the least recently used one is B
+    cache.max_size = 3 * entry_size
+    assert cache.get("germline", "A") == "IGHV3-Homo"
+    cache.put("germline", "D", "IGHV1-Mus")
+
+    assert cache.size <= cache.max_size
+    assert cache.get("germline", "B") is None
+    assert cache.get("germline", "A") == "IGHV3-Homo"
+
+
+def test_result_cache(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=1)
+    key = cache.key("prediction", "EVQLV/DIQMT")
+    cache.put_key(key, {"y_pred": np.arange(3, dtype=np.float64), "aln_H": "EVQLV"})
+
+    # The least recently used result is only on disk, with float32 arrays
+    cache.put_key(cache.key("prediction", "QVQLQ/DIQMT"), {"aln_H": "QVQLQ"})
+    assert list(cache.memory) != [key]
+    result = cache.get_key(key)
+    assert list(cache.memory) == [key]
+    assert result["aln_H"] == "EVQLV"
+    assert result["y_pred"].dtype == np.float32
+    assert result["y_pred"].tolist() == [0, 1, 2]
+    with pytest.raises(ValueError):
+        result["y_pred"][0] = 1
+
+    memory_only = ResultCache(max_entries=1)
+    memory_only.put_key(key, result)
+    assert memory_only.get_key(key)["aln_H"] == "EVQLV"
+    memory_only.put_key(cache.key("prediction", "QVQLQ/DIQMT"), result)
+    assert memory_only.get_key(key) is None
+    assert (memory_only.hits, memory_only.misses) == (1, 1)
+
+
+def test_scan_key(tmp_path):
+    # Editing the database of the scan invalidates its entries
+    for name in ["CHAINS.hmm", "CHAINS.hmm.h3m"]:
+        (tmp_path / name).write_text("model 1\n")
+    cache = StageCache(str(tmp_path / "cache"))
+    key = cache.key("scan", "EVQLV", ji.scan_databases(str(tmp_path)), "hmmer")
+
+    (tmp_path / "CHAINS.hmm.h3m").write_text("model 2, edited\n")
+    assert cache.key("scan", "EVQLV", ji.scan_databases(str(tmp_path)), "hmmer") != key
+
+
+def test_size(tmp_path):
+    cache = StageCache(str(tmp_path))
+    cache.put("germline", "A", "IGHV3-Homo")
+    entry_size = cache.size
+
+    # Replacing an entry does not change the size, which is shared by the
+    # caches of the same folder
+    cache.put("germline", "A", "IGHV3-Homo")
+    assert StageCache(str(tmp_path)).size == entry_size
+    StageCache(str(tmp_path)).put("germline", "B", "IGHV3-Homo")
+    assert cache.size == 2 * entry_size
+
+
+def test_split_size():
+    # The stage and result caches of a folder share its size limit
+    assert split_size(1001) == (501, 500)
+    assert sum(split_size(256 * 1024**2)) == 256 * 1024**2
+
+
+def test_result_key(tmp_path):
+    # The single mode keeps the case of the FASTA files, the other modes
+    # upper-case the sequences
+    cache = ResultCache(str(tmp_path))
+    assert pr.result_key(cache, "evqlv", "diqmt", "numpy") == pr.result_key(
+        cache, "EVQLV", "DIQMT", "numpy"
+    )
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import proabc_2.cnn as cn
+
+SEQ_ENCODING = str(
+    Path(
+        Path(__file__).parent.parent,
+        "src",
+        "proabc_2",
+        "data",
+        "Sparse_encoding_v2.txt",
+    )
+)
+golden_h = "EVQLVESGGGLVQPGGSLRLSCAASGYTFTN-------YGMNWVRQAPGKGLEWVGWINT-------YTGEPTYAADFKRRFTFSLDTSKSTAYLQMNSLRAEDTAVYYCAKYPHYYG----------------SSHWYFDVWGQGTLVTVSS"
+golden_l = "DIQMTQSPSSLSASVGDRVTITCSASQDIS----------NYLNWYQQKPGKAPKVLIYF--------TSSLHSGVPSRFSGSGSG--------TDFTLTISSLQPEDFATYYCQQYSTVP--------WTFGQGTKVEIKRTV"
+
+
+def test_encode_X_sequence():
+    df = pd.DataFrame(
+        {
+            "heavy_seq": [golden_h, golden_h[::-1]],
+            "light_seq": [golden_l, golden_l[::-1]],
+        }
+    )
+    seq_data = cn.encode_X_sequence(df, SEQ_ENCODING, add_position=1)
+
+    # Residue by residue encoding
+    embedding_dic = cn.embedding_read(SEQ_ENCODING)
+    expected = np.array(
+        [
+            [embedding_dic[j] + [num / len(i)] for num, j in enumerate(i)]
+            for i in df.sum(axis=1).values
+        ]
+    )
+
+    assert seq_data.shape == (2, 297, 21)
+    assert seq_data.dtype == np.float32
+    assert np.allclose(seq_data, expected)
+
+
+def test_give_score_unknown_residue():
+    embedding_dic = cn.embedding_read(SEQ_ENCODING)
+
+    with pytest.raises(KeyError):
+        cn.give_score(["ACZ"], embedding_dic, add_position=1)
+
+
+def test_categorize_X_data():
+    features = pd.read_csv(
+        Path(Path(__file__).parent, "golden_data", "Test-features.csv"), index_col=0
+    )
+    unknown = features.assign(H_Germline="IGHV99-Homo", L_CanHV2="9")
+    feat_data = cn.categorize_X_data(pd.concat([features, unknown]))
+
+    assert feat_data.shape == (2, cn.N_FEATURES)
+    assert feat_data.dtype == np.float32
+    assert list(feat_data[0, :6]) == [7, 4, 12, 7, 3, 6]
+
+    # One column per categorical feature is set
+    assert feat_data[0, 6:].sum() == len(cn.CATEGORICAL_FEATURES)
+    assert feat_data[0, cn.FEATURE_COLUMNS["H_Germline"]["IGHV9-Mus"]] == 1
+    assert feat_data[0, cn.FEATURE_COLUMNS["H_CanHV3"]["bulged"]] == 1
+
+    # Invalid categories are not encoded
+    assert feat_data[1, 6:].sum() == len(cn.CATEGORICAL_FEATURES) - 2
+    assert feat_data[1, cn.FEATURE_COLUMNS["H_Germline"]["IGHV9-Mus"]] == 0
+
+
+def test_categorize_X_data_records():
+    features = pd.read_csv(
+        Path(Path(__file__).parent, "golden_data", "Test-features.csv"), index_col=0
+    )
+    records = features.to_dict(orient="records")
+
+    assert np.array_equal(cn.categorize_X_data(records), cn.categorize_X_data(features))
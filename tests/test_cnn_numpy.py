@@ -0,0 +1,109 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import proabc_2.cnn_numpy as cnp
+
+MODEL_PATH = str(
+    Path(Path(__file__).parent.parent, "src", "proabc_2", "data", "proABC_v2")
+)
+HPS = {"N_BATCH": 2, "y_out": 891}
+SHAPES = {
+    "conv11/kernel": (3, 21, 32),
+    "conv11/bias": (32,),
+    "conv12/kernel": (3, 21, 32),
+    "conv12/bias": (32,),
+    "conv2/kernel": (3, 32, 64),
+    "conv2/bias": (64,),
+    "d1/kernel": (1966, 512),
+    "d1/bias": (512,),
+    "d2/kernel": (512, 891),
+    "d2/bias": (891,),
+}
+
+
+def random_inputs(n, seed=0):
+    rng = np.random.RandomState(seed)
+    x_seq = rng.rand(n, 297, 21).astype(np.float32)
+    x_feat = rng.randint(0, 2, (n, 110)).astype(np.float32)
+    return x_seq, x_feat
+
+
+def reference_forward(w, x_seq, x_feat):
+    """Residue by residue implementation of the network"""
+
+    def conv(x, kernel, bias):
+        out_len = x.shape[0] - kernel.shape[0] + 1
+        out = np.zeros((out_len, kernel.shape[2]))
+        for i in range(out_len):
+            for j in range(kernel.shape[0]):
+                out[i] += x[i + j] @ kernel[j]
+        return out + bias
+
+    def pool(x, size, strides):
+        n_out = (x.shape[0] - size) // strides + 1
+        return np.array(
+            [x[i * strides : i * strides + size].max(0) for i in range(n_out)]
+        )
+
+    def elu(x):
+        return np.where(x > 0, x, np.exp(x) - 1)
+
+    y = []
+    for x, feat in zip(x_seq, x_feat):
+        x11 = pool(elu(conv(x[:153], w["conv11/kernel"], w["conv11/bias"])), 10, 3)
+        x12 = pool(elu(conv(x[153:], w["conv12/kernel"], w["conv12/bias"])), 10, 3)
+        x1 = np.concatenate([x11, x12])
+        x1 = pool(elu(conv(x1, w["conv2/kernel"], w["conv2/bias"])), 6, 3)
+        x1 = elu(np.concatenate([x1.ravel(), feat]) @ w["d1/kernel"] + w["d1/bias"])
+        y.append(1 / (1 + np.exp(-(x1 @ w["d2/kernel"] + w["d2/bias"]))))
+    return np.array(y)
+
+
+def test_read_checkpoint_index():
+    num_shards, entries = cnp.read_checkpoint_index(MODEL_PATH)
+
+    assert num_shards == 2
+    for name, shape in SHAPES.items():
+        layer, var = name.split("/")
+        assert entries[cnp.checkpoint_name(layer, var)]["shape"] == list(shape)
+
+
+def test_forward(tmp_path):
+    rng = np.random.RandomState(1)
+    weights = {k: (rng.randn(*s) * 0.1).astype(np.float32) for k, s in SHAPES.items()}
+    npz_file = str(tmp_path / "proABC_v2.npz")
+    np.savez(npz_file, **weights)
+
+    x_seq, x_feat = random_inputs(5)
+    y_pred = cnp.NumpyPredictor(npz_file, HPS).predict((x_seq, x_feat))
+
+    assert y_pred.shape == (5, 891)
+    assert (
+        np.abs(y_pred - reference_forward(weights, x_seq, x_feat)).max() < cnp.TOLERANCE
+    )
+
+
+def test_wrong_features(tmp_path):
+    weights = {k: np.zeros(s, dtype=np.float32) for k, s in SHAPES.items()}
+    npz_file = str(tmp_path / "proABC_v2.npz")
+    np.savez(npz_file, **weights)
+
+    with pytest.raises(ValueError):
+        cnp.NumpyPredictor(npz_file, HPS, n_features=100)
+
+
+def test_tf_parity():
+    pytest.importorskip("tensorflow")
+    num_shards, _ = cnp.read_checkpoint_index(MODEL_PATH)
+    for shard in range(num_shards):
+        if not Path(f"{MODEL_PATH}.data-{shard:05d}-of-{num_shards:05d}").is_file():
+            pytest.skip(f"shard {shard} of the checkpoint is missing")
+    import proabc_2.cnn as cn
+
+    x_seq, x_feat = random_inputs(7)
+    y_tf = cn.Predictor(MODEL_PATH, HPS).predict((x_seq, x_feat))
+    y_np = cnp.NumpyPredictor(MODEL_PATH, HPS).predict((x_seq, x_feat))
+
+    assert np.abs(y_tf - y_np).max() < cnp.TOLERANCE
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+
+import proabc_2.germline_kmer as gk
+import proabc_2.jobinput as ji
+
+from . import GOLDEN_DATA_PATH
+
+DATABASE = Path(gk.__file__).parent / "database"
+
+
+def read_chain(filename):
+    _, sequences = gk.read_fasta(str(Path(GOLDEN_DATA_PATH, filename)))
+    return sequences[0]
+
+
+def test_kmer_codes():
+    residues, lengths = gk.encode(["ACDX", "AC"])
+
+    assert lengths.tolist() == [4, 2]
+    assert gk.kmer_codes(residues, 2).tolist() == [[1, 22, -1], [1, -1, -1]]
+
+
+def test_germline_batch(tmp_path):
+    # Germlines of Example-features.csv, given by igblastp
+    sequences = {
+        ("APDB", "H"): read_chain("heavy.fasta"),
+        ("APDB", "X"): "MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEK",
+    }
+    germlines, no_hits = ji.germline_batch(
+        sequences, str(DATABASE / "IGHVp.fasta"), str(tmp_path), "test", native=True
+    )
+    assert germlines == {("APDB", "H"): "IGHV9-Mus"}
+    assert no_hits == [("APDB", "X")]
+
+    germlines, _ = ji.germline_batch(
+        {"APDB_L": read_chain("light.fasta")},
+        str(DATABASE / "IGKVp.fasta"),
+        str(tmp_path),
+        "test",
+        native=True,
+    )
+    assert germlines == {"APDB_L": "IGKV1-Homo"}
+
+
+def test_saved_index(tmp_path):
+    database = str(DATABASE / "IGLVp.fasta")
+    index = gk.KmerIndex.build(database)
+    index.save(str(tmp_path))
+    saved = gk.KmerIndex.load(str(tmp_path))
+
+    assert isinstance(saved.postings, np.memmap)
+    assert saved.subjects == index.subjects
+
+    _, sequences = gk.read_fasta(database)
+    assert saved.assign(sequences[:10]) == index.assign(sequences[:10])
@@ -1,10 +1,12 @@
 import os
+import sys
 from pathlib import Path
 
 import pytest
 
 import proabc_2.jobinput as ji
 import proabc_2.numbering as nu
+from proabc_2 import EnvironmentNotSetError
 
 # Constants for file paths and isotypes
 # jobid = 'Test_data/'
@@ -88,3 +90,87 @@ def test_getCs():
     assert (
         nu.L(golden_l_l).getCs() == golden_cs_l
     ), "Light chain (L) canonical structures are different"
+
+
+def test_isotype_from_evalues():
+    assert ji.isotype_from_evalues({"H": 3.3e-98, "K": 1.2e-07, "L": 1}) == ("H", "")
+    assert ji.isotype_from_evalues({"H": 3.3e-07, "K": 4.9e-106, "L": 1.3e-38}) == (
+        "K",
+        "",
+    )
+    assert ji.isotype_from_evalues({"H": 1, "K": 4.2e-30, "L": 4e-92}) == ("L", "")
+    assert ji.isotype_from_evalues({"H": 1, "K": 1, "L": 1}) == ("", "not_antibody")
+    assert ji.isotype_from_evalues({"H": 1e-90, "K": 1e-80, "L": 1}) == (
+        "",
+        "single_chain",
+    )
+    assert ji.isotype_from_evalues({"H": 0.0, "K": 1, "L": 1}) == ("", "failed_H")
+
+
+def test_germline_label():
+    assert ji.germline_label("KT723008|IGHV1-10*01|Bos") == "IGHV1-Bos"
+    assert ji.germline_label("M99660|IGHV3-23*01|Homo sapiens") == "IGHV3-Homo"
+
+
+def test_read_germline_table():
+    top_hits = ji.read_germline_table(jobid + "germline_batch.germ")
+
+    assert top_hits == {
+        "0": "M99660|IGHV3-23*01|Homo",
+        "1": "",
+        "2": "KT723008|IGHV1-10*01|Bos",
+    }
+
+
+def test_run_tool(tmp_path, monkeypatch):
+    command = [
+        sys.executable,
+        "-c",
+        "import sys; sys.stdout.write(sys.stdin.read().upper())",
+    ]
+    names = (str(tmp_path / "query.fasta"), str(tmp_path / "output.txt"))
+
+    monkeypatch.delenv(ji.DEBUG_FILES_ENV, raising=False)
+    assert ji.run_tool(command, ">a\nevqlv\n", jobid, "Error", names) == [
+        ">A\n",
+        "EVQLV\n",
+    ]
+    assert not os.path.exists(names[0])
+
+    # The input and the output are kept in debug mode
+    monkeypatch.setenv(ji.DEBUG_FILES_ENV, "1")
+    ji.run_tool(command, ">a\nevqlv\n", jobid, "Error", names)
+    assert Path(names[0]).read_text() == ">a\nevqlv\n"
+    assert Path(names[1]).read_text() == ">A\nEVQLV\n"
+
+
+def test_run_tool_error(tmp_path):
+    command = [sys.executable, "-c", "import sys; sys.stderr.write('failed')"]
+    job = str(tmp_path) + "/"
+
+    with pytest.raises(ji.JobError):
+        ji.run_tool(command, "", job, "Error with tool")
+    assert "Error with tool" in (tmp_path / "error.log").read_text()
+
+
+def test_tool_path(monkeypatch):
+    monkeypatch.setenv("HMMER_PATH", "/opt/hmmer/bin")
+    assert ji.hmmer_exec("hmmscan") == str(Path("/opt/hmmer/bin", "hmmscan"))
+
+    # Only checked when a tool is run
+    monkeypatch.delenv("HMMER_PATH")
+    with pytest.raises(EnvironmentNotSetError, match="HMMER_PATH"):
+        ji.hmmer_exec("hmmscan")
+
+
+def test_scan_databases(tmp_path):
+    files = ji.scan_databases()
+    assert files[0] == os.path.join(ji.MARKOV_MODELS, ji.HMM_DATABASE)
+    assert sorted(os.path.splitext(f)[1] for f in files[1:]) == ji.PRESSED_SUFFIXES
+
+    # The single models are used when the database is not pressed
+    for hmm in list(ji.HMM_FILES.values()) + [ji.HMM_DATABASE]:
+        (tmp_path / hmm).write_text("HMMER3/f\n")
+    assert ji.scan_databases(str(tmp_path)) == [
+        str(tmp_path / hmm) for hmm in ji.HMM_FILES.values()
+    ]
@@ -0,0 +1,66 @@
+import pickle
+
+import proabc_2.jobinput as ji
+from proabc_2 import metrics, trace
+from proabc_2.metrics import Registry
+
+
+def test_text():
+    registry = Registry()
+    registry.inc("antibodies_total", 3)
+    registry.inc("antibody_failures_total", reason="not_antibody")
+    registry.observe("stage_seconds", 0.2, stage="hmmscan")
+    registry.observe("stage_seconds", 2, stage="hmmscan")
+
+    lines = registry.text().splitlines()
+    assert "# TYPE proabc2_antibodies_total counter" in lines
+    assert "proabc2_antibodies_total 3" in lines
+    assert 'proabc2_antibody_failures_total{reason="not_antibody"} 1' in lines
+    assert 'proabc2_stage_seconds_bucket{stage="hmmscan",le="0.1"} 0' in lines
+    assert 'proabc2_stage_seconds_bucket{stage="hmmscan",le="0.5"} 1' in lines
+    assert 'proabc2_stage_seconds_bucket{stage="hmmscan",le="+Inf"} 2' in lines
+    assert 'proabc2_stage_seconds_sum{stage="hmmscan"} 2.2' in lines
+    assert 'proabc2_stage_seconds_count{stage="hmmscan"} 2' in lines
+
+
+def test_drain_merge():
+    worker = Registry()
+    worker.inc("subprocesses_total", tool="hmmscan")
+    worker.observe("stage_seconds", 0.2, stage="align")
+    values = pickle.loads(pickle.dumps(worker.drain()))
+    assert worker.text() == "\n"
+
+    main = Registry()
+    main.inc("subprocesses_total", tool="hmmscan")
+    main.merge(values)
+    main.merge(values)
+    assert main.counters == {("subprocesses_total", (("tool", "hmmscan"),)): 3}
+    assert main.histogram("stage_seconds", stage="align").count == 2
+
+
+def test_collection(tmp_path, monkeypatch):
+    monkeypatch.delenv(metrics.METRICS_ENV, raising=False)
+    monkeypatch.setattr(metrics, "REGISTRY", Registry())
+    metrics.record_status("OK")
+    assert metrics.REGISTRY.counters == {}
+
+    monkeypatch.setenv(metrics.METRICS_ENV, "1")
+    metrics.record_status("OK")
+    metrics.record_status("No hits found in the germline database for: ab1_H")
+    with trace.span("numbering"):
+        pass
+
+    filename = tmp_path / "proabc2.prom"
+    metrics.write(str(filename))
+    text = filename.read_text()
+    assert "proabc2_antibodies_total 2\n" in text
+    assert 'proabc2_antibody_failures_total{reason="no_germline"} 1\n' in text
+    assert 'proabc2_stage_seconds_count{stage="numbering"} 1\n' in text
+
+
+def test_error_reason():
+    assert ji.error_reason("Error with hmmalign: segfault") == "hmmalign_error"
+    assert ji.error_reason("Kappa chain found when heavy expected.") == "wrong_chain"
+    assert ji.error_reason("antibody is missing L chain") == "missing_chain"
+    assert ji.error_reason("File heavy.fasta is empty") == "invalid_input"
+    assert ji.error_reason("index out of range") == "other"
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from proabc_2.ParseHmmer import (
+    parse_align_multi,
+    parse_hmmscan_models,
+    read_align_multi,
+    readhmmscan_models,
+    readhmmscan_queries,
+)
+
+from . import GOLDEN_DATA_PATH
+
+MODELS = ["selexoneheavy4", "selexonekappa", "selexonelambda2"]
+
+
+def test_readhmmscan_models():
+    evalues = readhmmscan_models(str(Path(GOLDEN_DATA_PATH, "scan_chains.txt")), MODELS)
+
+    assert evalues == {
+        "selexoneheavy4": 3.3e-07,
+        "selexonekappa": 4.9e-106,
+        "selexonelambda2": 1.3e-38,
+    }
+
+
+def test_readhmmscan_models_missing_file(tmp_path):
+    evalues = readhmmscan_models(str(tmp_path / "scan.txt"), MODELS)
+
+    assert evalues == {model: 1 for model in MODELS}
+
+
+def test_parse_hmmscan_models():
+    # Output piped from hmmscan, parsed as the output file
+    filename = str(Path(GOLDEN_DATA_PATH, "scan_chains.txt"))
+    with open(filename) as fh:
+        lines = fh.read().splitlines(keepends=True)
+
+    assert parse_hmmscan_models(lines, MODELS) == readhmmscan_models(filename, MODELS)
+    assert parse_hmmscan_models([], MODELS) == {model: 1 for model in MODELS}
+
+
+def test_readhmmscan_queries():
+    hits = readhmmscan_queries(str(Path(GOLDEN_DATA_PATH, "scan_batch.txt")), MODELS)
+
+    assert hits["0"] == {"selexoneheavy4": (3.3e-98, 1), "selexonekappa": (1.2e-07, 1)}
+    assert hits["1"]["selexoneheavy4"] == (3.3e-07, 3)
+    assert hits["2"]["selexonelambda2"] == (4e-92, 1)
+    assert hits["2"]["selexonekappa"] == (4.2e-30, 4)
+    assert "3" not in hits
+
+
+def test_read_align_multi():
+    aligned = read_align_multi(str(Path(GOLDEN_DATA_PATH, "align_batch.ali")))
+
+    # Same alignments as for the sequences aligned one by one
+    assert (
+        aligned["0"]
+        == "DIQMTQSPSSLSASVGDRVTITCSASQDIS----------NYLNWYQQKPGKAPKVLIYF--------TSSLHSGVPSRFSGSGSG--------TDFTLTISSLQPEDFATYYCQQYSTVP--------WTFGQGTKVEIKRTV"
+    )
+    assert (
+        aligned["1"]
+        == "DIVMTQSPDSLAVSLGERATINCKSSQSVLYSSNNK----NYLAWYQQKPGQPPKLLIYW--------ASTRESGVPDRFSGSGSG--------TDFTLTISSLQAEDVAVYYCQQYYSTP--------LTFGQGTKVEIK---"
+    )
+    # Residues in insert columns
+    assert aligned["2"] == ""
+
+
+def test_parse_align_multi():
+    filename = str(Path(GOLDEN_DATA_PATH, "align_batch.ali"))
+    with open(filename) as fh:
+        lines = fh.read().splitlines(keepends=True)
+
+    assert parse_align_multi(lines) == read_align_multi(filename)
@@ -0,0 +1,47 @@
+import csv
+from pathlib import Path
+
+import proabc_2.jobinput as ji
+import proabc_2.profile_hmm as ph
+
+from . import GOLDEN_DATA_PATH
+
+MODELS = Path(ph.__file__).parent / "MarkovModels"
+HMM_FILES = {"H": "HEAVY.hmm", "K": "KAPPA.hmm", "L": "LAMBDA.hmm"}
+
+
+def test_read_hmms():
+    hmms = ph.read_hmms(str(MODELS / "CHAINS.hmm"))
+
+    assert [h.name for h in hmms] == [
+        "selexoneheavy4",
+        "selexonekappa",
+        "selexonelambda2",
+    ]
+    assert [h.length for h in hmms] == [153, 144, 144]
+    assert hmms[1].stats["FORWARD"] == (-7.2177, 0.69725)
+
+
+def test_align_parity():
+    # Alignments of hmmalign --trim, parsed with ParseHmmer.read_align
+    with open(Path(GOLDEN_DATA_PATH, "hmmalign_corpus.tsv")) as fh:
+        corpus = list(csv.DictReader(fh, delimiter="\t"))
+
+    for isotype, hmm in HMM_FILES.items():
+        rows = [r for r in corpus if r["isotype"] == isotype]
+        aligned = ph.align_sequences(str(MODELS / hmm), [r["sequence"] for r in rows])
+        assert aligned == [r["aligned"] for r in rows]
+
+
+def test_scan_isotypes():
+    # E-values of hmmscan -Z 1 --domZ 1 and the resulting calls
+    with open(Path(GOLDEN_DATA_PATH, "hmmscan_corpus.tsv")) as fh:
+        corpus = list(csv.DictReader(fh, delimiter="\t"))
+
+    scores = ph.scan_sequences(
+        str(MODELS / "CHAINS.hmm"), [r["sequence"] for r in corpus]
+    )
+
+    for num, row in enumerate(corpus):
+        evalues = {k: scores[name][num] for k, name in ji.HMM_NAMES.items()}
+        assert ji.isotype_from_evalues(evalues) == (row["isotype"], row["error"])
@@ -0,0 +1,122 @@
+import http.client
+import json
+import queue
+import threading
+
+import pandas as pd
+import pytest
+
+import proabc_2.server as sv
+from proabc_2.batcher import MicroBatcher
+
+
+class Service:
+    """Stand-in of PredictionService returning a fixed table"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error = None
+        self.batcher = MicroBatcher(list)
+
+    def predict(self, pairs):
+        table = pd.DataFrame(
+            [["1", "E", 0.1, 0.2, 0.3]],
+            columns=["Chothia", "Sequence", "pt", "hb", "hy"],
+        )
+        return {ab_id: ("OK", table, table) for ab_id, _, _ in pairs}
+
+
+@pytest.fixture
+def server():
+    server = sv.make_server(Service(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.service.batcher.close()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_read_request():
+    pairs, output_format = sv.read_request('{"heavy": "evqlv ", "light": "DIQMT"}')
+    assert pairs == [("antibody1", "EVQLV", "DIQMT")]
+    assert output_format == "records"
+
+    with pytest.raises(ValueError):
+        sv.read_request("[]")
+    with pytest.raises(ValueError):
+        sv.read_request('{"heavy": "EVQLV"}')
+    with pytest.raises(ValueError):
+        sv.read_request('{"antibodies": [{"id": "../a", "heavy": "E", "light": "D"}]}')
+
+
+def test_endpoints(server):
+    assert request(server, "GET", "/health") == (200, {"status": "ok"})
+    assert request(server, "GET", "/ready") == (503, {"status": "loading"})
+    assert request(server, "POST", "/predict", "{}")[0] == 503
+
+    server.service.ready.set()
+    assert request(server, "GET", "/ready") == (200, {"status": "ready"})
+    assert request(server, "POST", "/predict", "{}")[0] == 400
+
+    body = {
+        "antibodies": [{"id": "ab1", "heavy": "EVQLV", "light": "DIQMT"}],
+        "format": "csv",
+    }
+    status, response = request(server, "POST", "/predict", json.dumps(body))
+    assert status == 200
+    antibody = response["antibodies"][0]
+    assert (antibody["id"], antibody["status"]) == ("ab1", "OK")
+    assert antibody["heavy"].splitlines() == [
+        ",Chothia,Sequence,pt,hb,hy",
+        "0,1,E,0.1,0.2,0.3",
+    ]
+
+
+def test_metrics(server):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("text/plain")
+    lines = response.read().decode().splitlines()
+    assert "# TYPE proabc2_batch_size histogram" in lines
+    assert 'proabc2_queue_depth_bucket{le="+Inf"} 0' in lines
+
+
+def test_backpressure(monkeypatch):
+    def batch_features(*args):
+        raise AssertionError("features calculated for a rejected request")
+
+    monkeypatch.setattr(sv.ba, "batch_features", batch_features)
+    release = threading.Event()
+
+    def wait(items):
+        release.wait()
+        return items
+
+    service = sv.PredictionService()
+    service.batcher.close()
+    service.batcher = MicroBatcher(wait, max_batch_size=1, max_wait=0, max_queue=2)
+    pairs = [(f"ab{num}", "EVQLV", "DIQMT") for num in range(3)]
+
+    with pytest.raises(sv.RequestTooLarge):
+        service.predict(pairs)
+
+    # One item is processed and one is waiting, there is room for one antibody
+    service.batcher.submit("a")
+    while service.batcher._queue.qsize():
+        pass
+    service.batcher.submit("b")
+    with pytest.raises(queue.Full):
+        service.predict(pairs[:2])
+
+    release.set()
+    service.batcher.close()
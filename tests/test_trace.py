@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+import pytest
+
+import proabc_2.jobinput as ji
+from proabc_2 import trace
+
+
+def read_trace(filename):
+    with open(filename) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.delenv(trace.TRACE_ENV, raising=False)
+    assert trace.tracer() is None
+    with trace.span("scan", "ab1") as span:
+        span["exit_code"] = 0
+
+
+def test_spans(tmp_path, monkeypatch):
+    filename = tmp_path / "trace.jsonl"
+    monkeypatch.setenv(trace.TRACE_ENV, str(filename))
+    monkeypatch.setenv(trace.PROFILE_ENV, str(tmp_path / "profiles"))
+
+    command = [sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read())"]
+    with trace.span("prediction", "ab1"):
+        ji.run_tool(command, ">H\nEVQLV\n>L\nDIQMT\n", str(tmp_path) + "/", "Error")
+        with pytest.raises(ValueError):
+            with trace.span("numbering"):
+                raise ValueError("bad alignment")
+
+    tool, numbering, prediction = read_trace(filename)
+    assert (tool["stage"], tool["antibody"], tool["parent"]) == (
+        os.path.basename(sys.executable),
+        "ab1",
+        "prediction",
+    )
+    assert tool["exit_code"] == 0
+    assert tool["sequences"] == 2
+    assert numbering["error"] == "ValueError"
+    assert prediction["parent"] is None
+    assert prediction["wall"] >= tool["wall"] + numbering["wall"]
+    for record in (tool, numbering, prediction):
+        assert record["cpu"] >= 0
+        assert record["peak_rss_delta_kb"] >= 0
+        assert os.path.exists(record["profile"])